@@ -1,3 +1,5 @@
+from pathlib import Path
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -11,12 +13,58 @@ class Settings(BaseSettings):
     # MongoDB
     mongo_url: str
     db_name: str
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 5
+    mongo_max_idle_ms: int = 60000
+    mongo_wait_queue_timeout_ms: int = 5000
+    mongo_server_selection_timeout_ms: int = 5000
+    mongo_connect_timeout_ms: int = 5000
+    mongo_socket_timeout_ms: int = 20000
+    mongo_ready_timeout: float = 30
+    history_ttl_days: Optional[int] = None  # TTL-индекс на history.listened_at
     
     # Application
     app_host: str = "0.0.0.0"
     app_port: int = 8000
     debug: bool = False
 
+    # HTTP client pool (VK API)
+    http_pool_size: int = 100
+    http_pool_per_host: int = 30
+    http_dns_ttl: int = 300
+    http_keepalive: float = 60
+    http_timeout: float = 15
+    http_connect_timeout: float = 5
+
+    # VK resolver (общие с server_lite кеш URL и батчинг getById)
+    cache_db: str = str(Path(__file__).resolve().parents[2] / "lite_cache.db")
+    url_cache_max: int = 5000
+    vk_batch_window_ms: int = 5
+    vk_batch_max: int = 50
+    vk_sync_fallback: bool = False  # vkpymusic в потоке, если getById не дал URL
+
+    # Listening history: буфер → insert_many
+    history_batch_size: int = 500
+    history_flush_interval: float = 1.0
+    history_max_pending: int = 10000
+    history_enqueue_timeout: float = 5.0
+    history_spool_path: Optional[str] = None  # напр. ./spool/history.jsonl
+
+    # Recommendations: co-listen индекс по истории (app/services/recommender.py)
+    recs_refresh_interval: float = 60
+    recs_rebuild_interval: float = 6 * 3600
+    recs_history_days: int = 180
+    recs_lag: float = 30
+    recs_window: int = 5
+    recs_session_gap: float = 1800
+    recs_min_count: int = 2
+    recs_min_results: int = 5  # меньше — трек «холодный», добираем VK-поиском
+
+    # Telegram initData
+    auth_max_age: int = 86400
+    auth_cache_max: int = 10000
+    auth_compat_mode: bool = False  # True — принимать и старые варианты подписи
+
     # SSL
     ssl_keyfile: str = None
     ssl_certfile: str = None
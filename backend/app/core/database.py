@@ -1,4 +1,7 @@
+import asyncio
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
 from app.core.config import settings
 
 class Database:
@@ -7,11 +10,86 @@ class Database:
 
 db = Database()
 
+HISTORY_TTL_INDEX = "history_ttl"
+HISTORY_TIME_INDEX = "history_time"
+
 async def connect_to_mongo():
-    db.client = AsyncIOMotorClient(settings.mongo_url)
+    db.client = AsyncIOMotorClient(
+        settings.mongo_url,
+        maxPoolSize=settings.mongo_max_pool_size,
+        minPoolSize=settings.mongo_min_pool_size,
+        maxIdleTimeMS=settings.mongo_max_idle_ms,
+        waitQueueTimeoutMS=settings.mongo_wait_queue_timeout_ms,
+        serverSelectionTimeoutMS=settings.mongo_server_selection_timeout_ms,
+        connectTimeoutMS=settings.mongo_connect_timeout_ms,
+        socketTimeoutMS=settings.mongo_socket_timeout_ms,
+    )
     db.music_db = db.client[settings.db_name]
+    await wait_until_ready()
+    await ensure_indexes()
     print("✅ Connected to MongoDB")
 
 async def close_mongo_connection():
     db.client.close()
     print("❌ Closed MongoDB connection")
+
+async def ping() -> bool:
+    try:
+        await db.client.admin.command("ping")
+        return True
+    except Exception:
+        return False
+
+async def wait_until_ready():
+    """Readiness при старте: ждём Mongo до mongo_ready_timeout, иначе падаем сразу."""
+    deadline = asyncio.get_running_loop().time() + settings.mongo_ready_timeout
+    while not await ping():
+        if asyncio.get_running_loop().time() >= deadline:
+            raise RuntimeError(f"MongoDB is not reachable at {settings.mongo_url}")
+        print("⏳ Waiting for MongoDB...")
+        await asyncio.sleep(1)
+
+async def ensure_indexes():
+    """
+    Схема: индексы для update_one({"id"}) и истории по user_id.
+    create_index идемпотентен — безопасно на каждом старте и в каждом воркере.
+    """
+    users = db.music_db.users
+    history = db.music_db.history
+    try:
+        await users.create_index([("id", ASCENDING)], unique=True, name="users_id")
+    except OperationFailure as e:
+        # Дубли id в старых данных: без unique, но поиск всё равно по индексу
+        print(f"⚠️ users.id unique index: {e}; creating non-unique")
+        await users.create_index([("id", ASCENDING)], name="users_id_nonunique")
+    await history.create_index(
+        [("user_id", ASCENDING), ("listened_at", DESCENDING)], name="history_user_time"
+    )
+    await _ensure_history_ttl(history)
+
+async def _ensure_history_ttl(history):
+    """
+    TTL на старую историю (history_ttl_days); None — индекс удаляется.
+    Индекс по listened_at нужен и без TTL (выборки рекомендателя по времени),
+    а два индекса на один ключ Mongo не даёт — держим ровно один из них.
+    """
+    indexes = await history.index_information()
+    existing = indexes.get(HISTORY_TTL_INDEX)
+    ttl_days = settings.history_ttl_days
+    if not ttl_days:
+        if existing:
+            await history.drop_index(HISTORY_TTL_INDEX)
+        await history.create_index([("listened_at", ASCENDING)], name=HISTORY_TIME_INDEX)
+        return
+    if HISTORY_TIME_INDEX in indexes:
+        await history.drop_index(HISTORY_TIME_INDEX)
+    seconds = int(ttl_days * 86400)
+    if existing is None:
+        await history.create_index(
+            [("listened_at", ASCENDING)], name=HISTORY_TTL_INDEX, expireAfterSeconds=seconds
+        )
+    elif existing.get("expireAfterSeconds") != seconds:
+        await db.music_db.command(
+            "collMod", "history",
+            index={"name": HISTORY_TTL_INDEX, "expireAfterSeconds": seconds},
+        )
@@ -0,0 +1,39 @@
+import aiohttp
+from app.core.config import settings
+
+class HttpClient:
+    session: aiohttp.ClientSession = None
+
+http = HttpClient()
+
+def _create_session() -> aiohttp.ClientSession:
+    # Пул keep-alive соединений + кеш DNS: повторные запросы к api.vk.com
+    # не платят за DNS и TLS-handshake
+    connector = aiohttp.TCPConnector(
+        limit=settings.http_pool_size,
+        limit_per_host=settings.http_pool_per_host,
+        ttl_dns_cache=settings.http_dns_ttl,
+        keepalive_timeout=settings.http_keepalive,
+        enable_cleanup_closed=True,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=settings.http_timeout,
+        connect=settings.http_connect_timeout,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+async def start_http_client():
+    http.session = _create_session()
+    print("✅ HTTP client pool started")
+
+async def close_http_client():
+    if http.session and not http.session.closed:
+        await http.session.close()
+    http.session = None
+    print("❌ Closed HTTP client pool")
+
+def get_session() -> aiohttp.ClientSession:
+    """Общая сессия из lifespan; вне приложения (скрипты) создаётся по запросу."""
+    if http.session is None or http.session.closed:
+        http.session = _create_session()
+    return http.session
@@ -1,16 +1,26 @@
 from fastapi import FastAPI
 from fastapi.openapi.utils import get_openapi
-from app.core.database import connect_to_mongo, close_mongo_connection
+from fastapi.responses import JSONResponse
+from app.core.database import connect_to_mongo, close_mongo_connection, ping
+from app.core.http import start_http_client, close_http_client
+from app.services.history import history_buffer
+from app.services.recommender import recommender
 from app.routers import auth, music
 from contextlib import asynccontextmanager
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: подключаемся к БД
+    # Startup: пул HTTP-соединений и подключение к БД
+    await start_http_client()
     await connect_to_mongo()
+    await history_buffer.start()
+    await recommender.start()
     yield
-    # Shutdown: отключаемся
+    # Shutdown: дописываем историю из буфера и отключаемся
+    await recommender.stop()
+    await history_buffer.stop()
     await close_mongo_connection()
+    await close_http_client()
 
 # Описания тегов с эмодзи для красоты
 tags_metadata = [
@@ -85,6 +95,24 @@ async def root():
         "version": "1.0.0"
     }
 
+@app.get("/ready", tags=["System"])
+async def ready():
+    """
+    Readiness probe - MongoDB ping + history buffer and recommender stats
+    """
+    mongo_ok = await ping()
+    history = history_buffer.stats()
+    status_code = 200 if mongo_ok else 503
+    return JSONResponse(
+        status_code=status_code,
+        content={
+            "status": "ready" if mongo_ok else "not_ready",
+            "mongo": mongo_ok,
+            "history": history,
+            "recommender": recommender.stats(),
+        },
+    )
+
 if __name__ == "__main__":
     import uvicorn
     from app.core.config import settings
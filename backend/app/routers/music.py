@@ -1,6 +1,8 @@
 from fastapi import APIRouter, HTTPException, Query, Path
 from fastapi.responses import RedirectResponse
 from app.models.schemas import SearchResponse, Track
+from app.core.config import settings
+from app.services.recommender import recommender
 from app.services.vk import vk_service
 from urllib.parse import unquote
 import re
@@ -36,12 +38,12 @@ async def download(
         # Игнорируем запросы сегментов .ts или левые ID
         raise HTTPException(status_code=400, detail="Invalid track ID format")
 
-    song = await vk_service.get_audio_url(track_id)
+    url = await vk_service.get_audio_url(track_id)
     
-    if not song or not song.url:
+    if not url:
         raise HTTPException(status_code=404, detail="Track not found or restricted")
         
-    return RedirectResponse(url=song.url)
+    return RedirectResponse(url=url)
     
 @router.get("/recommendations", response_model=SearchResponse)
 async def recommendations(
@@ -53,9 +55,12 @@ async def recommendations(
     🎯 **Get personalized music recommendations**
     
     Returns recommended tracks based on:
-    - A specific track (via `track_id`)
+    - A specific track (via `track_id`): tracks co-listened with it in users' history
     - A search query (via `query`)
     - Popular tracks (if neither is provided)
+
+    Track and popular recommendations are served from an in-memory index built
+    from listening history; tracks without enough history fall back to VK search.
     
     **Parameters:**
     - `track_id` (optional): Get recommendations similar to this track
@@ -75,16 +80,19 @@ async def recommendations(
     if query:
         tracks = await vk_service.search_tracks(query, limit)
     elif track_id:
-        # Находим артиста по ID трека и ищем его песни
-        song = await vk_service.get_audio_url(track_id)
-        if song:
-            tracks = await vk_service.search_tracks(song.artist, limit)
-            # Убираем сам трек из выдачи
-            tracks = [t for t in tracks if t['id'] != track_id]
-        else:
-            tracks = []
+        # Из памяти: треки, которые слушают вместе с этим (app/services/recommender.py)
+        tracks = recommender.similar(track_id, limit)
+        if len(tracks) < min(settings.recs_min_results, limit):
+            # Холодный трек: истории мало — добираем песнями артиста из VK
+            song = await vk_service.get_track(track_id)
+            if song and song.get('artist'):
+                seen = {track_id} | {t['id'] for t in tracks}
+                found = await vk_service.search_tracks(song['artist'], limit)
+                tracks += [t for t in found if t['id'] not in seen][:limit - len(tracks)]
     else:
-        # Fallback на популярное если ничего не задано
-        tracks = await vk_service.search_tracks("Top 100", limit)
+        # Популярное по истории, пока её нет — "Top 100" из VK
+        tracks = recommender.popular(limit)
+        if len(tracks) < min(settings.recs_min_results, limit):
+            tracks = await vk_service.search_tracks("Top 100", limit)
         
     return {"items": tracks}
@@ -0,0 +1,258 @@
+import asyncio
+import json
+import os
+import uuid
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Deque, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from app.core.config import settings
+from app.core.database import db
+
+try:
+    import fcntl
+except ImportError:  # Windows: владельца spool определяем по PID
+    fcntl = None
+
+
+class HistoryBufferFull(Exception):
+    pass
+
+
+class HistoryBuffer:
+    """
+    Буфер событий прослушивания → insert_many пачками.
+
+    - flush по размеру (batch_size) или по времени (flush_interval)
+    - backpressure: при max_pending событий в буфере add() ждёт места
+      (Mongo тормозит → тормозит и запрос), по таймауту — HistoryBufferFull
+    - stop() дописывает всё, что осталось (shutdown в lifespan)
+    - spool (опционально): события дублируются в локальный файл и
+      переживают падение процесса; файл очищается, когда буфер пуст.
+      Имя файла уникально для каждого запуска, живой процесс держит на нём
+      flock: после рестарта (даже с тем же PID) старый spool — чужой и
+      незаблокированный, его забирает (атомарный rename) и дописывает
+      в Mongo первый воркер, который до него дотянется
+    - _id назначается при add(): повтор пачки после ошибки или падения
+      даёт duplicate key, а не дубли в истории
+    """
+
+    def __init__(
+        self,
+        collection: Callable,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_pending: int = 10000,
+        enqueue_timeout: float = 5.0,
+        spool_path: Optional[str] = None,
+    ):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.enqueue_timeout = enqueue_timeout
+        self.spool_path: Optional[Path] = None
+        self._spool_base = Path(spool_path) if spool_path else None
+        self._spool = None
+        self._buffer: Deque[Dict] = deque()
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self.rejected = 0
+
+    # ─── Жизненный цикл ──────────────────────────────────────────
+
+    async def start(self):
+        if self._spool_base:
+            self._spool_base.parent.mkdir(parents=True, exist_ok=True)
+            self.spool_path = self._spool_base.with_name(
+                f"{self._spool_base.name}.{os.getpid()}.{uuid.uuid4().hex[:8]}"
+            )
+            self._spool = open(self.spool_path, "a", encoding="utf-8")
+            if fcntl is not None:
+                fcntl.flock(self._spool.fileno(), fcntl.LOCK_EX)
+            self._recover_spools()
+        self._task = asyncio.create_task(self._run())
+        print(f"✅ History buffer started (batch={self.batch_size}, spool={self.spool_path})")
+
+    async def stop(self):
+        self._closing = True
+        self._wakeup.set()
+        if self._task:
+            await self._task
+        if self._spool:
+            # Удаляем до снятия flock: пустой файл никто не успеет забрать
+            if not self._buffer:
+                self.spool_path.unlink(missing_ok=True)
+            self._spool.close()
+        print(f"❌ History buffer stopped ({len(self._buffer)} events left)")
+
+    # ─── API ─────────────────────────────────────────────────────
+
+    async def add(self, doc: Dict):
+        doc.setdefault("_id", ObjectId())
+        if len(self._buffer) >= self.max_pending:
+            self._space.clear()
+            try:
+                await asyncio.wait_for(self._space.wait(), self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise HistoryBufferFull("History buffer is full")
+        self._buffer.append(doc)
+        if self._spool:
+            self._spool.write(json.dumps(doc, default=_json_default, ensure_ascii=False) + "\n")
+            self._spool.flush()
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    # ─── Запись в Mongo ──────────────────────────────────────────
+
+    async def _run(self):
+        backoff = 0.5
+        while True:
+            if not self._closing and len(self._buffer) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            if not self._buffer:
+                if self._closing:
+                    return
+                continue
+            batch = [self._buffer[i] for i in range(min(self.batch_size, len(self._buffer)))]
+            try:
+                await self.collection().insert_many(batch, ordered=False)
+            except Exception as e:
+                # Только duplicate key — эти события уже записаны прошлой попыткой
+                if not (isinstance(e, BulkWriteError) and _only_duplicates(e)):
+                    self.errors += 1
+                    print(f"⚠️ History flush failed ({len(batch)} events): {e}")
+                    if self._closing and backoff > 8:
+                        return   # Mongo недоступна при остановке: события остаются в spool
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, 30)
+                    continue
+            backoff = 0.5
+            for _ in batch:
+                self._buffer.popleft()
+            self.written += len(batch)
+            self.batches += 1
+            self._space.set()
+            if self._spool and not self._buffer:
+                self._spool.truncate(0)
+
+    # ─── Spool ───────────────────────────────────────────────────
+
+    def _recover_spools(self):
+        """Подхватывает spool-файлы упавших процессов (по одному процессу на файл)."""
+        for path in list(self._spool_base.parent.glob(f"{self._spool_base.name}.*")):
+            if path == self.spool_path:
+                continue
+            try:
+                f = open(path, encoding="utf-8")
+            except OSError:
+                continue
+            with f:
+                if not _owner_gone(f, path, self._spool_base):
+                    continue
+                claimed = self._spool_base.with_name(
+                    f"{self._spool_base.name}.{uuid.uuid4().hex[:8]}.claimed"
+                )
+                try:
+                    # Атомарно: файл достаётся одному воркеру; flock держим
+                    # до удаления, так что и claimed-файл никто не перехватит
+                    os.rename(path, claimed)
+                except OSError:
+                    continue
+                docs = _read_spool(f)
+                for doc in docs:
+                    self._buffer.append(doc)
+                    self._spool.write(json.dumps(doc, default=_json_default, ensure_ascii=False) + "\n")
+                self._spool.flush()
+                claimed.unlink(missing_ok=True)
+            if docs:
+                print(f"♻️ History: recovered {len(docs)} events from {path.name}")
+
+    def stats(self) -> Dict:
+        return {
+            "pending": len(self._buffer),
+            "written": self.written,
+            "batches": self.batches,
+            "errors": self.errors,
+            "rejected": self.rejected,
+        }
+
+
+def _only_duplicates(e: BulkWriteError) -> bool:
+    details = e.details or {}
+    return not details.get("writeConcernErrors") and all(
+        err.get("code") == 11000 for err in details.get("writeErrors", [])
+    )
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    raise TypeError(f"Not JSON serializable: {type(value).__name__}")
+
+
+def _json_hook(obj: Dict):
+    if set(obj) == {"$date"}:
+        return datetime.fromisoformat(obj["$date"])
+    if set(obj) == {"$oid"}:
+        return ObjectId(obj["$oid"])
+    return obj
+
+
+def _read_spool(f) -> List[Dict]:
+    docs = []
+    for line in f:
+        try:
+            docs.append(json.loads(line, object_hook=_json_hook))
+        except ValueError:
+            pass   # оборванная при падении последняя строка
+    return docs
+
+
+def _owner_gone(f, path: Path, base: Path) -> bool:
+    """Владелец spool завершился: его flock снят (без fcntl — по PID в имени)."""
+    if fcntl is not None:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+    # history.jsonl.<pid>.<token> — PID может быть переиспользован, это лишь запасной путь
+    owner = path.name[len(base.name) + 1:].split(".", 1)[0]
+    return not (owner.isdigit() and _pid_alive(int(owner)))
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+history_buffer = HistoryBuffer(
+    lambda: db.music_db.history,
+    batch_size=settings.history_batch_size,
+    flush_interval=settings.history_flush_interval,
+    max_pending=settings.history_max_pending,
+    enqueue_timeout=settings.history_enqueue_timeout,
+    spool_path=settings.history_spool_path,
+)
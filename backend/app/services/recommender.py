@@ -0,0 +1,177 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from app.core.config import settings
+from app.core.database import db
+# Разреженный индекс совместных прослушиваний (numpy/scipy), без Mongo и настроек
+import colisten
+from colisten import CoListenIndex
+
+
+class Recommender:
+    """
+    Рекомендации из истории прослушиваний, целиком из памяти.
+
+    - при старте: полная сборка CoListenIndex по history за history_days
+    - каждые refresh_interval: догружаются новые события (инкрементально)
+    - каждые rebuild_interval: полная пересборка в фоне и подмена индекса —
+      подбирает опоздавшие записи (spool после падения) и TTL-удаления
+    - события моложе lag секунд не читаются: буфер истории мог их ещё не записать
+    - numpy/scipy в потоке (asyncio.to_thread), запросы — без I/O
+    """
+
+    def __init__(
+        self,
+        collection: Callable,
+        refresh_interval: float = 60,
+        rebuild_interval: float = 6 * 3600,
+        history_days: int = 180,
+        lag: float = 30,
+        **index_options,
+    ):
+        self.collection = collection
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.history_days = history_days
+        self.lag = lag
+        self.index_options = index_options
+        self.index: Optional[CoListenIndex] = None
+        self._since: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self.builds = 0
+        self.refreshes = 0
+        self.errors = 0
+        self.last_build_seconds = 0.0
+
+    # ─── Жизненный цикл ──────────────────────────────────────────
+
+    async def start(self):
+        if not colisten.available:
+            print("⚠️ numpy/scipy not installed: recommendations fall back to VK search")
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        print("❌ Recommender stopped")
+
+    # ─── API ─────────────────────────────────────────────────────
+
+    def similar(self, track_id: str, limit: int = 20) -> List[Dict]:
+        index = self.index
+        if index is None:
+            return []
+        return [self._track(index, tid) for tid, _ in index.similar(track_id, limit, exclude=(track_id,))]
+
+    def popular(self, limit: int = 20) -> List[Dict]:
+        index = self.index
+        if index is None:
+            return []
+        return [self._track(index, tid) for tid in index.popular(limit)]
+
+    @staticmethod
+    def _track(index: CoListenIndex, track_id: str) -> Dict:
+        # Длительности и обложки в history не пишутся
+        title, artist = index.track(track_id)
+        return {
+            "id": track_id,
+            "title": title,
+            "artist": artist,
+            "duration": 0,
+            "cover_url": None,
+            "url_api": f"/api/music/download/{track_id}",
+        }
+
+    # ─── Сборка ──────────────────────────────────────────────────
+
+    async def _run(self):
+        while True:
+            try:
+                await self._build()
+                break
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️ Recommender build failed: {e}")
+                await asyncio.sleep(self.refresh_interval)
+        last_build = asyncio.get_running_loop().time()
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                if asyncio.get_running_loop().time() - last_build >= self.rebuild_interval:
+                    await self._build()
+                    last_build = asyncio.get_running_loop().time()
+                else:
+                    await self._refresh()
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️ Recommender refresh failed: {e}")
+
+    async def _build(self):
+        started = asyncio.get_running_loop().time()
+        until = datetime.utcnow() - timedelta(seconds=self.lag)
+        index = CoListenIndex(**self.index_options)
+        since = until - timedelta(days=self.history_days)
+        async for events in self._load(since, until):
+            await asyncio.to_thread(index.add, events)
+        # Подмена целиком: запросы видят либо старый индекс, либо новый
+        self.index, self._since = index, until
+        self.builds += 1
+        self.last_build_seconds = asyncio.get_running_loop().time() - started
+        print(f"✅ Recommender index built: {index.stats()} in {self.last_build_seconds:.1f}s")
+
+    async def _refresh(self):
+        until = datetime.utcnow() - timedelta(seconds=self.lag)
+        async for events in self._load(self._since, until):
+            await asyncio.to_thread(self.index.add, events)
+        self._since = until
+        self.refreshes += 1
+
+    async def _load(self, since: datetime, until: datetime, page: int = 100000):
+        """События history в (since, until], по времени, пачками по page."""
+        cursor = self.collection().find(
+            {"listened_at": {"$gt": since, "$lte": until}},
+            {"_id": 0, "user_id": 1, "track_id": 1, "listened_at": 1, "title": 1, "artist": 1},
+        ).sort("listened_at", 1).batch_size(10000)
+        events = []
+        async for doc in cursor:
+            events.append((
+                doc["user_id"],
+                doc["track_id"],
+                # В Mongo — naive UTC; .timestamp() приняло бы его за локальное время
+                doc["listened_at"].replace(tzinfo=timezone.utc).timestamp(),
+                doc.get("title") or "",
+                doc.get("artist") or "Unknown",
+            ))
+            if len(events) >= page:
+                yield events
+                events = []
+        if events:
+            yield events
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": colisten.available,
+            "index": self.index.stats() if self.index else None,
+            "builds": self.builds,
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "last_build_seconds": round(self.last_build_seconds, 2),
+        }
+
+
+recommender = Recommender(
+    lambda: db.music_db.history,
+    refresh_interval=settings.recs_refresh_interval,
+    rebuild_interval=settings.recs_rebuild_interval,
+    history_days=settings.recs_history_days,
+    lag=settings.recs_lag,
+    window=settings.recs_window,
+    session_gap=settings.recs_session_gap,
+    min_count=settings.recs_min_count,
+)
@@ -1,38 +1,61 @@
 import asyncio
-import aiohttp
-from vkpymusic import Service
+from pathlib import Path
+from typing import Dict, List, Optional
 from app.core.config import settings
+from app.core.http import get_session
+# Те же кеш URL, склейка и батчинг getById, что и в server_lite.py
+from shared_cache import make_cache
+from singleflight import SingleFlight
+from vk_batch import GetByIdBatcher
+
+URL_TTL = 1500  # 25 минут, как в server_lite
 
 class VKService:
     def __init__(self):
-        # Инициализируем библиотеку vkpymusic. 
-        # Используем наш "волшебный" User-Agent и Токен.
-        self.service = Service(settings.vk_user_agent, settings.vk_token)
+        # Тот же SQLite-кеш (таблица audio_urls), что у server_lite: URL,
+        # полученный одним бэкендом, сразу виден другому и всем воркерам
+        self.url_cache = make_cache(
+            "audio_urls",
+            ttl=URL_TTL,
+            max_entries=settings.url_cache_max,
+            path=Path(settings.cache_db),
+        )
+        self.sf_info = SingleFlight("track_info")
+        self.batcher = GetByIdBatcher(
+            self._get_by_id_many,
+            window=settings.vk_batch_window_ms / 1000,
+            max_batch=settings.vk_batch_max,
+        )
+        # vkpymusic (блокирующий requests в потоке) — только запасной путь
+        self.service = None
+        if settings.vk_sync_fallback:
+            from vkpymusic import Service
+            self.service = Service(settings.vk_user_agent, settings.vk_token)
 
     async def search_tracks(self, query: str, limit: int = 20):
         """
         Прямой поиск через API для получения обложек.
         """
-        async with aiohttp.ClientSession() as session:
-            params = {
-                'access_token': settings.vk_token,
-                'v': '5.131',
-                'q': query,
-                'count': limit,
-                'sort': 2, 
-                'auto_complete': 1
-            }
-            # Честно прикидываемся официальным клиентом
-            headers = {
-                'User-Agent': settings.vk_user_agent
-            }
-            
-            try:
-                async with session.get('https://api.vk.com/method/audio.search', params=params, headers=headers) as resp:
-                    data = await resp.json()
-            except Exception as e:
-                print(f"VK API Connection Error: {e}")
-                return []
+        params = {
+            'access_token': settings.vk_token,
+            'v': '5.131',
+            'q': query,
+            'count': limit,
+            'sort': 2, 
+            'auto_complete': 1
+        }
+        # Честно прикидываемся официальным клиентом
+        headers = {
+            'User-Agent': settings.vk_user_agent
+        }
+        
+        # Общая сессия с пулом соединений (app/core/http.py), а не новая на каждый поиск
+        try:
+            async with get_session().get('https://api.vk.com/method/audio.search', params=params, headers=headers) as resp:
+                data = await resp.json()
+        except Exception as e:
+            print(f"VK API Connection Error: {e}")
+            return []
 
         if 'error' in data:
             print(f"VK API Error: {data['error']}")
@@ -67,14 +90,68 @@ class VKService:
         print(f"✅ Found {len(tracks)} tracks for query: {query}")
         return tracks
 
-    async def get_audio_url(self, track_id: str):
+    async def _get_by_id_many(self, track_ids: List[str]) -> Dict[str, Dict]:
+        """Один audio.getById на пачку id → {track_id: item}."""
+        params = {
+            'access_token': settings.vk_token,
+            'v': '5.131',
+            'audios': ','.join(track_ids),
+        }
+        headers = {'User-Agent': settings.vk_user_agent}
+        try:
+            async with get_session().get('https://api.vk.com/method/audio.getById', params=params, headers=headers) as resp:
+                data = await resp.json()
+        except Exception as e:
+            print(f"VK getById Connection Error: {e}")
+            return {}
+
+        if 'error' in data:
+            print(f"VK getById Error: {data['error']}")
+            return {}
+        return {
+            f"{item['owner_id']}_{item['id']}": item
+            for item in data.get('response', [])
+            if 'owner_id' in item and 'id' in item
+        }
+
+    async def get_track(self, track_id: str) -> Optional[Dict]:
         """
-        Получение ссылки на MP3 через vkpymusic (она умеет делать getById).
+        Item трека из audio.getById (url, artist, title, duration...).
+        Конкурентные запросы одного трека склеиваются, разных — идут одним батчем.
         """
-        # vkpymusic принимает список ID
+        return await self.sf_info.do(track_id, lambda: self._fetch_track(track_id))
+
+    async def _fetch_track(self, track_id: str) -> Optional[Dict]:
+        item = await self.batcher.get(track_id)
+        if item and item.get('url'):
+            await self.url_cache.aset(track_id, item['url'])
+            return item
+        if self.service is not None:
+            return await self._get_track_sync(track_id) or item
+        return item
+
+    async def _get_track_sync(self, track_id: str) -> Optional[Dict]:
+        """Запасной путь через vkpymusic (в потоке executor'а)."""
         songs = await asyncio.to_thread(self.service.get_songs_by_id, [track_id])
-        if not songs:
+        if not songs or not songs[0].url:
             return None
-        return songs[0]
+        song = songs[0]
+        await self.url_cache.aset(track_id, song.url)
+        return {
+            'url': song.url,
+            'artist': song.artist,
+            'title': song.title,
+            'duration': song.duration,
+        }
+
+    async def get_audio_url(self, track_id: str) -> Optional[str]:
+        """
+        Прямая ссылка на аудио: кеш → getById (async, батчем), без потоков.
+        """
+        cached = await self.url_cache.aget(track_id)
+        if cached:
+            return cached
+        item = await self.get_track(track_id)
+        return item.get('url') if item else None
 
 vk_service = VKService()
@@ -0,0 +1,110 @@
+"""
+Бенчмарк проверки Telegram initData (tg_auth.py) против старого перебора
+из app/routers/auth.py.
+
+    python3 benchmarks/bench_auth.py [--n 20000]
+
+Сценарии: валидная initData (без кеша / из кеша), поток невалидных подписей,
+протухшие и мусорные строки. Для каждого — мкс на вызов.
+"""
+from __future__ import annotations
+import argparse, contextlib, hashlib, hmac, io, json, os, sys, time
+from urllib.parse import parse_qsl, urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tg_auth import InitDataValidator, webapp_secret
+
+TOKEN = "123456:ABC-benchmark-token"
+
+
+def make_init_data(auth_date: int, user_id: int = 1, bad_hash: bool = False) -> str:
+    fields = {
+        "auth_date": str(auth_date),
+        "query_id": f"AAH{user_id:08d}",
+        "user": json.dumps({"id": user_id, "first_name": "Bench", "username": f"u{user_id}"}),
+    }
+    check = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+    h = hmac.new(webapp_secret(TOKEN), check.encode(), hashlib.sha256).hexdigest()
+    if bad_hash:
+        h = h[::-1]
+    return urlencode({**fields, "hash": h})
+
+
+def legacy_validate(init_data: str, token: str):
+    """Старый алгоритм: 2 ключа × 2 набора полей × 2 варианта строки + print."""
+    params = dict(parse_qsl(init_data))
+    if "hash" not in params:
+        raise ValueError("Hash is missing")
+    received_hash = params.pop("hash")
+    params.pop("signature", None)
+    keys = [
+        hmac.new(b"WebAppData", token.encode(), hashlib.sha256).digest(),
+        hashlib.sha256(token.encode()).digest(),
+    ]
+    full_sorted = sorted(params.items())
+    core_sorted = sorted((k, v) for k, v in params.items() if k in ("user", "auth_date", "query_id"))
+    for key in keys:
+        for fields in (full_sorted, core_sorted):
+            if not fields:
+                continue
+            combos = ["\n".join(f"{k}={v}" for k, v in fields)]
+            if any(k == "user" and "\\/" in v for k, v in fields):
+                combos.append("\n".join(
+                    f"{k}={v.replace(chr(92) + '/', '/') if k == 'user' else v}" for k, v in fields))
+            for s in combos:
+                if hmac.new(key, s.encode(), hashlib.sha256).hexdigest().lower() == received_hash.lower():
+                    return json.loads(next(v for k, v in fields if k == "user"))
+    raw = "\n".join(f"{k}={v}" for k, v in full_sorted)
+    print("--- FATAL AUTH FAILURE ---")
+    print(raw)
+    print(hmac.new(keys[0], raw.encode(), hashlib.sha256).hexdigest())
+    raise ValueError("Invalid hash signature")
+
+
+def bench(name: str, fn, inputs, n: int) -> None:
+    sink = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(sink):
+        for i in range(n):
+            try:
+                fn(inputs[i % len(inputs)])
+            except ValueError:
+                pass
+    us = (time.perf_counter() - start) / n * 1e6
+    print(f"  {name:<44} {us:8.2f} мкс/вызов")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=20000)
+    n = ap.parse_args().n
+    now = int(time.time())
+
+    valid_one = [make_init_data(now)]
+    valid_many = [make_init_data(now, user_id=i) for i in range(n)]
+    invalid = [make_init_data(now, user_id=i, bad_hash=True) for i in range(1000)]
+    expired = [make_init_data(now - 2 * 86400, user_id=i) for i in range(1000)]
+    garbage = ["hash=zzz&user=x", "", "a" * 512, "hash=" + "0" * 64]
+
+    strict = InitDataValidator(TOKEN, compat=False)
+    compat = InitDataValidator(TOKEN, compat=True)
+    uncached = InitDataValidator(TOKEN, cache_size=0)
+
+    print(f"n={n}")
+    print("Валидная initData:")
+    bench("legacy", lambda s: legacy_validate(s, TOKEN), valid_many, n)
+    bench("tg_auth, без кеша", uncached.validate, valid_many, n)
+    bench("tg_auth, повторная (кеш)", strict.validate, valid_one, n)
+    print("Поток невалидных подписей:")
+    bench("legacy (перебор + print)", lambda s: legacy_validate(s, TOKEN), invalid, n)
+    bench("tg_auth compat=True", compat.validate, invalid, n)
+    bench("tg_auth compat=False", strict.validate, invalid, n)
+    print("Протухшие и мусорные initData:")
+    bench("legacy, протухшие (auth_date не проверяется)", lambda s: legacy_validate(s, TOKEN), expired, n)
+    bench("tg_auth, протухшие (отказ до HMAC)", strict.validate, expired, n)
+    bench("tg_auth, мусор", strict.validate, garbage, n)
+    print("stats:", json.dumps(strict.stats(), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
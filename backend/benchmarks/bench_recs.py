@@ -0,0 +1,67 @@
+"""
+Сборка и запросы co-listen индекса (colisten.py) на синтетической истории.
+
+    python3 benchmarks/bench_recs.py [--users 20000] [--per-user 50] [--tracks 50000]
+
+Популярность треков — степенной закон (как в реальной истории). Меряем
+полную сборку, инкрементальную догрузку пачками и мкс на similar().
+"""
+from __future__ import annotations
+import argparse, os, random, statistics, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from colisten import CoListenIndex, available
+
+
+def synthetic(users: int, per_user: int, tracks: int) -> list:
+    events = []
+    for user_id in range(users):
+        ts = random.uniform(0, 86400)
+        for _ in range(per_user):
+            ts += random.choice((180, 200, 240, 7200))   # треки подряд и перерывы
+            track = int(random.paretovariate(1.1)) % tracks
+            events.append((user_id, f"1_{track}", ts, "title", "artist"))
+    events.sort(key=lambda e: e[2])
+    return events
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=20000)
+    ap.add_argument("--per-user", type=int, default=50)
+    ap.add_argument("--tracks", type=int, default=50000)
+    ap.add_argument("--queries", type=int, default=5000)
+    args = ap.parse_args()
+    if not available:
+        sys.exit("нужны numpy и scipy")
+
+    random.seed(1)
+    events = synthetic(args.users, args.per_user, args.tracks)
+    print(f"{len(events)} событий, {args.users} пользователей")
+
+    start = time.perf_counter()
+    full = CoListenIndex()
+    full.add(events)
+    print(f"  полная сборка            {time.perf_counter() - start:7.2f} с   {full.stats()}")
+
+    inc = CoListenIndex()
+    step = max(1, len(events) // 20)
+    start = time.perf_counter()
+    for i in range(0, len(events), step):
+        inc.add(events[i:i + step])
+    print(f"  20 инкрементальных пачек {time.perf_counter() - start:7.2f} с")
+
+    popular = full.popular(500)
+    samples = []
+    for i in range(args.queries):
+        tid = popular[i % len(popular)]
+        t0 = time.perf_counter()
+        full.similar(tid, 20, exclude=(tid,))
+        samples.append((time.perf_counter() - t0) * 1e6)
+    samples.sort()
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"  similar() top-20         median {statistics.median(samples):6.1f} мкс   p99 {p99:6.1f} мкс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Латентность поиска VK: новая aiohttp-сессия на каждый запрос (как было в
+app/services/vk.py) против общей сессии с пулом (app/core/http.py).
+
+    python3 benchmarks/bench_vk_session.py [--n 30] [--query "Макс Корж"]
+    python3 benchmarks/bench_vk_session.py --url https://example.com/  # без токена
+
+Токен и User-Agent — из backend/.env (VK_TOKEN, VK_USER_AGENT).
+Запросы идут последовательно: меряем цену DNS + TCP + TLS на каждый поиск.
+"""
+from __future__ import annotations
+import argparse, asyncio, os, statistics, sys, time
+from pathlib import Path
+
+import aiohttp
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).resolve().parent.parent / ".env")
+
+VK_SEARCH = "https://api.vk.com/method/audio.search"
+
+
+def _request(args) -> dict:
+    if args.url:
+        return {"url": args.url}
+    token = os.getenv("VK_TOKEN")
+    if not token:
+        sys.exit("VK_TOKEN не задан — укажите --url для замера без VK")
+    return {
+        "url": VK_SEARCH,
+        "params": {"access_token": token, "v": "5.131", "q": args.query, "count": 20},
+        "headers": {"User-Agent": os.getenv("VK_USER_AGENT", "VKAndroidApp/5.52-4543")},
+    }
+
+
+async def _one(session: aiohttp.ClientSession, req: dict) -> float:
+    start = time.perf_counter()
+    async with session.get(req["url"], params=req.get("params"), headers=req.get("headers")) as resp:
+        await resp.read()
+    return (time.perf_counter() - start) * 1000
+
+
+async def per_request_session(req: dict, n: int) -> list:
+    out = []
+    for _ in range(n):
+        start = time.perf_counter()
+        async with aiohttp.ClientSession() as session:
+            await _one(session, req)
+        out.append((time.perf_counter() - start) * 1000)
+    return out
+
+
+async def shared_session(req: dict, n: int) -> list:
+    connector = aiohttp.TCPConnector(limit=100, limit_per_host=30, ttl_dns_cache=300, keepalive_timeout=60)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await _one(session, req)   # прогрев: первое соединение
+        return [await _one(session, req) for _ in range(n)]
+
+
+def _report(name: str, samples: list) -> None:
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"  {name:<28} median {statistics.median(samples):7.1f} мс   p95 {p95:7.1f} мс")
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=30)
+    ap.add_argument("--query", default="Макс Корж")
+    ap.add_argument("--url", help="замерить произвольный HTTPS URL вместо audio.search")
+    args = ap.parse_args()
+    req = _request(args)
+
+    print(f"{req['url']}  n={args.n}")
+    _report("новая сессия на запрос", await per_request_session(req, args.n))
+    _report("общая сессия (пул)", await shared_session(req, args.n))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,11 +1,18 @@
 """
 TGPlay Telegram Bot — один экземпляр (fcntl flock), /start → одно сообщение.
+
+Два режима:
+- long polling: python3 bot.py (fallback, один процесс)
+- webhook: BOT_MODE=webhook в .env — обновления принимает server_lite
+  (/api/telegram/webhook) на всех uvicorn-воркерах, bot.py не запускается
 """
 from __future__ import annotations
 import asyncio, os, signal, sys
+from collections import OrderedDict
 from pathlib import Path
 from dotenv import load_dotenv
 import aiohttp
+from tg_client import TelegramClient
 
 try:
     import fcntl
@@ -18,26 +25,41 @@ BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 WEBAPP_URL = os.getenv("WEBAPP_URL", "")
 LOCK_FILE = Path(__file__).parent / "bot.lock"
 _lock_fd = None
+_UPDATE_CONCURRENCY = int(os.getenv("BOT_UPDATE_CONCURRENCY", "16"))
+_POLL_TIMEOUT = 30   # секунд: Telegram держит getUpdates открытым до новых апдейтов
+
+
+def _check_config() -> None:
+    if not BOT_TOKEN:
+        print("❌  BOT_TOKEN не указан в backend/.env!")
+        sys.exit(1)
+
+    if not WEBAPP_URL:
+        print("❌  WEBAPP_URL не указан в backend/.env!")
+        print("   Запусти cloudflared tunnel и укажи URL в .env")
+        sys.exit(1)
+
 
-if not BOT_TOKEN:
-    print("❌  BOT_TOKEN не указан в backend/.env!")
-    sys.exit(1)
+_clients: dict[int, TelegramClient] = {}
+_shared_client: TelegramClient | None = None
 
-if not WEBAPP_URL:
-    print("❌  WEBAPP_URL не указан в backend/.env!")
-    print("   Запусти cloudflared tunnel и укажи URL в .env")
-    sys.exit(1)
 
-API = f"https://api.telegram.org/bot{BOT_TOKEN}"
+def use_client(client: TelegramClient) -> None:
+    """Webhook-режим: server_lite отдаёт свой клиент (общие rate limit bucket'ы)."""
+    global _shared_client
+    _shared_client = client
 
 
 async def tg_request(session: aiohttp.ClientSession, method: str, **kwargs) -> dict:
-    """Вызов Telegram Bot API."""
-    async with session.post(f"{API}/{method}", json=kwargs) as resp:
-        data = await resp.json()
-    if not data.get("ok"):
-        print(f"⚠️  TG API {method}: {data.get('description', data)}")
-    return data
+    """Вызов Telegram Bot API (rate limit + повтор при 429 — в TelegramClient)."""
+    if _shared_client is not None:
+        return await _shared_client.call(method, **kwargs)
+    client = _clients.get(id(session))
+    if client is None:
+        async def _get_session() -> aiohttp.ClientSession:
+            return session
+        client = _clients[id(session)] = TelegramClient(BOT_TOKEN, _get_session)
+    return await client.call(method, **kwargs)
 
 
 async def set_menu_button(session: aiohttp.ClientSession):
@@ -67,19 +89,57 @@ async def set_bot_commands(session: aiohttp.ClientSession):
     print("✅ Bot commands set")
 
 
-_processed_updates: set[int] = set()
-_MAX_PROCESSED = 500
+async def configure_bot(session: aiohttp.ClientSession):
+    """Меню Mini App и команды — общее для polling и webhook."""
+    await set_menu_button(session)
+    await set_bot_commands(session)
+
+
+async def set_webhook(session: aiohttp.ClientSession, url: str, secret: str) -> bool:
+    """Переключает бота на webhook. Telegram шлёт secret в X-Telegram-Bot-Api-Secret-Token."""
+    data = await tg_request(
+        session,
+        "setWebhook",
+        url=url,
+        secret_token=secret,
+        allowed_updates=["message"],
+        max_connections=40,
+    )
+    if data.get("ok"):
+        print(f"✅ Webhook set → {url}")
+    return bool(data.get("ok"))
+
+
+# Последние update_id (LRU): при переполнении выбрасываем самые старые,
+# а не весь набор сразу — иначе повторная доставка после clear() прошла бы
+_processed_updates: OrderedDict[int, None] = OrderedDict()
+_MAX_PROCESSED = 5000
+
+
+def mark_processed(update_id: int) -> bool:
+    """True, если update_id новый (и запоминает его)."""
+    if update_id in _processed_updates:
+        return False
+    _processed_updates[update_id] = None
+    if len(_processed_updates) > _MAX_PROCESSED:
+        _processed_updates.popitem(last=False)
+    return True
 
 
 async def handle_update(session: aiohttp.ClientSession, update: dict):
     """Обрабатывает входящее обновление."""
     update_id = update.get("update_id")
-    if update_id in _processed_updates:
+    if not mark_processed(update_id):
         return
-    _processed_updates.add(update_id)
-    if len(_processed_updates) > _MAX_PROCESSED:
-        _processed_updates.clear()
+    try:
+        await _dispatch(session, update)
+    except BaseException:
+        # Не обработали — повторная доставка того же update_id должна пройти
+        _processed_updates.pop(update_id, None)
+        raise
 
+
+async def _dispatch(session: aiohttp.ClientSession, update: dict):
     message = update.get("message")
     if not message:
         return
@@ -104,9 +164,19 @@ async def handle_update(session: aiohttp.ClientSession, update: dict):
         )
 
 
+async def _handle_limited(session: aiohttp.ClientSession, update: dict, sem: asyncio.Semaphore):
+    async with sem:
+        try:
+            await handle_update(session, update)
+        except Exception as e:
+            print(f"⚠️  Update {update.get('update_id')} failed: {e}")
+
+
 async def poll_updates(session: aiohttp.ClientSession):
-    """Long polling для получения обновлений."""
+    """Long polling для получения обновлений (обработка — параллельно)."""
     offset = 0
+    sem = asyncio.Semaphore(_UPDATE_CONCURRENCY)
+    tasks: set[asyncio.Task] = set()
     print("🔄 Polling for updates...")
 
     while True:
@@ -115,13 +185,17 @@ async def poll_updates(session: aiohttp.ClientSession):
                 session,
                 "getUpdates",
                 offset=offset,
-                timeout=30,
+                timeout=_POLL_TIMEOUT,
                 allowed_updates=["message"],
+                # HTTP-таймаут длиннее long poll, иначе пустой ответ обрывается
+                http_timeout=_POLL_TIMEOUT + 10,
             )
             updates = data.get("result", [])
             for update in updates:
                 offset = update["update_id"] + 1
-                await handle_update(session, update)
+                task = asyncio.create_task(_handle_limited(session, update, sem))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
         except asyncio.CancelledError:
             break
         except Exception as e:
@@ -148,8 +222,7 @@ async def main():
         await tg_request(session, "deleteWebhook", drop_pending_updates=True)
 
         # Настраиваем меню и команды
-        await set_menu_button(session)
-        await set_bot_commands(session)
+        await configure_bot(session)
 
         print("━" * 50)
         print("🎵 Бот запущен! Напиши /start в Telegram.")
@@ -195,6 +268,10 @@ def _on_signal(signum, frame):
 
 
 if __name__ == "__main__":
+    _check_config()
+    if os.getenv("BOT_MODE", "polling").lower() == "webhook":
+        print("❌ BOT_MODE=webhook: обновления принимает server_lite, bot.py не нужен")
+        sys.exit(1)
     if sys.platform != "win32":
         signal.signal(signal.SIGTERM, _on_signal)
     if not _acquire_lock():
@@ -0,0 +1,189 @@
+"""
+Item-to-item рекомендации по совместным прослушиваниям (co-listen).
+
+- события истории (user_id, track_id, время) режутся на сессии: между
+  соседними прослушиваниями пользователя не больше session_gap секунд
+- пара треков засчитывается, если второй — среди window следующих
+  прослушиваний сессии; счётчики пар — разреженная симметричная матрица (scipy CSR)
+- add(events) инкрементальный: хвост последней сессии каждого пользователя
+  запоминается, и пары «старый хвост → новое событие» не теряются
+- similar(): строка матрицы → cosine count / sqrt(plays_i * plays_j),
+  пары с count < min_count отбрасываются; чистый numpy по строке, без I/O
+- popular(): самые прослушиваемые треки, считаются при add()
+- нужны numpy и scipy; без них available = False
+"""
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+    import scipy.sparse as sp
+except ImportError:  # без numpy/scipy рекомендации уходят в VK-поиск
+    np = sp = None
+
+available = np is not None
+
+# (user_id, track_id, timestamp, title, artist)
+Event = Tuple[int, str, float, str, str]
+
+
+class CoListenIndex:
+    def __init__(self, window: int = 5, session_gap: float = 1800, min_count: int = 2, top_popular: int = 100):
+        if not available:
+            raise RuntimeError("numpy and scipy are required for CoListenIndex")
+        self.window = window
+        self.session_gap = session_gap
+        self.min_count = min_count
+        self.top_popular = top_popular
+        self.ids: Dict[str, int] = {}
+        self.names: List[str] = []
+        self.meta: List[Tuple[str, str]] = []          # (title, artist) последнего события
+        # (pairs, plays) меняются одним присваиванием: читатель не увидит матрицу
+        # и счётчики разного размера, даже если add() идёт в потоке
+        self._state = (sp.csr_matrix((0, 0), dtype=np.float32), np.zeros(0, dtype=np.float32))
+        self._tails: Dict[int, List[Tuple[int, float]]] = {}
+        self._popular: List[int] = []
+        self.events = 0
+        self.latest = 0.0
+
+    # ─── Построение ──────────────────────────────────────────────
+
+    def add(self, events: Sequence[Event]) -> int:
+        """
+        Добавляет события не старше уже добавленных (история догружается
+        вперёд по времени). Каждое новое событие даёт пары с window
+        предыдущими прослушиваниями своей сессии, в том числе из хвоста
+        прошлой пачки; пара учитывается в обе стороны. Возвращает число новых пар.
+        """
+        if not events:
+            return 0
+        users, items, times = [], [], []
+        for user_id, track_id, ts, title, artist in events:
+            users.append(user_id)
+            items.append(self._intern(track_id, title, artist))
+            times.append(ts)
+        fresh = [True] * len(events)
+        # Хвосты прошлых сессий тех же пользователей — в начало, без повторного учёта plays
+        for user_id in set(users):
+            for item, ts in self._tails.get(user_id, ()):
+                users.append(user_id)
+                items.append(item)
+                times.append(ts)
+                fresh.append(False)
+
+        u = np.asarray(users, dtype=np.int64)
+        t = np.asarray(times, dtype=np.float64)
+        order = np.lexsort((t, u))
+        u, t = u[order], t[order]
+        it = np.asarray(items, dtype=np.int64)[order]
+        fr = np.asarray(fresh, dtype=bool)[order]
+
+        new_session = np.ones(len(u), dtype=bool)
+        new_session[1:] = (u[1:] != u[:-1]) | (t[1:] - t[:-1] > self.session_gap)
+        session = np.cumsum(new_session)
+
+        rows, cols = [], []
+        for k in range(1, min(self.window, len(u) - 1) + 1):
+            a, b = it[:-k], it[k:]
+            m = (session[k:] == session[:-k]) & fr[k:] & (a != b)
+            rows.append(a[m])
+            cols.append(b[m])
+
+        n = len(self.names)
+        pairs, plays = self._state
+        plays = np.concatenate([plays, np.zeros(n - len(plays), dtype=np.float32)])
+        plays += np.bincount(it[fr], minlength=n).astype(np.float32)
+        added = 0
+        if rows:
+            r, c = np.concatenate(rows), np.concatenate(cols)
+            added = len(r)
+            delta = sp.coo_matrix(
+                (np.ones(2 * added, dtype=np.float32), (np.concatenate([r, c]), np.concatenate([c, r]))),
+                shape=(n, n),
+            ).tocsr()
+            pairs = pairs.copy()
+            pairs.resize((n, n))
+            pairs = (pairs + delta).tocsr()
+        else:
+            pairs = pairs.copy()
+            pairs.resize((n, n))
+        self._state = (pairs, plays)
+
+        self.events += len(events)
+        self.latest = max(self.latest, float(t.max()))
+        self._keep_tails(u, it, t, session)
+        top = np.argpartition(-plays, self.top_popular)[: self.top_popular] if n > self.top_popular else np.arange(n)
+        self._popular = top[np.argsort(-plays[top])].tolist()
+        return added
+
+    def _intern(self, track_id: str, title: str, artist: str) -> int:
+        i = self.ids.get(track_id)
+        if i is None:
+            i = len(self.names)
+            self.names.append(track_id)
+            self.meta.append((title, artist))
+            self.ids[track_id] = i
+        elif title:
+            self.meta[i] = (title, artist)
+        return i
+
+    def _keep_tails(self, u, it, t, session) -> None:
+        """Последние window событий незакрытой сессии каждого пользователя."""
+        ends = np.flatnonzero(np.r_[u[1:] != u[:-1], True])
+        for e in ends.tolist():
+            s = e
+            while s > 0 and e - s < self.window - 1 and session[s - 1] == session[e]:
+                s -= 1
+            self._tails[int(u[e])] = [(int(it[j]), float(t[j])) for j in range(s, e + 1)]
+        # Сессия, молчащая дольше session_gap, уже не продолжится
+        cutoff = self.latest - self.session_gap
+        for user_id in [uid for uid, tail in self._tails.items() if tail[-1][1] < cutoff]:
+            del self._tails[user_id]
+
+    # ─── Запросы ─────────────────────────────────────────────────
+
+    def similar(self, track_id: str, limit: int = 20, exclude: Iterable[str] = ()) -> List[Tuple[str, float]]:
+        pairs, plays = self._state
+        i = self.ids.get(track_id)
+        if i is None or i >= pairs.shape[0]:
+            return []
+        start, end = pairs.indptr[i], pairs.indptr[i + 1]
+        if start == end:
+            return []
+        cols = pairs.indices[start:end]
+        counts = pairs.data[start:end]
+        keep = counts >= self.min_count
+        cols, counts = cols[keep], counts[keep]
+        if not len(cols):
+            return []
+        scores = counts / np.sqrt(np.maximum(plays[i] * plays[cols], 1.0))
+        skip = {self.ids[x] for x in exclude if x in self.ids}
+        want = limit + len(skip)
+        top = np.argpartition(-scores, want - 1)[:want] if len(scores) > want else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        out = []
+        for j in top.tolist():
+            col = int(cols[j])
+            if col in skip:
+                continue
+            out.append((self.names[col], float(scores[j])))
+            if len(out) >= limit:
+                break
+        return out
+
+    def popular(self, limit: int = 20) -> List[str]:
+        return [self.names[i] for i in self._popular[:limit]]
+
+    def track(self, track_id: str) -> Optional[Tuple[str, str]]:
+        i = self.ids.get(track_id)
+        return self.meta[i] if i is not None else None
+
+    def stats(self) -> Dict:
+        pairs, _ = self._state
+        return {
+            "tracks": len(self.names),
+            "events": self.events,
+            "pairs": int(pairs.nnz // 2),
+            "open_sessions": len(self._tails),
+            "matrix_bytes": int(pairs.data.nbytes + pairs.indices.nbytes + pairs.indptr.nbytes),
+        }
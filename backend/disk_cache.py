@@ -0,0 +1,253 @@
+"""
+Дисковый кеш MP3 с индексом в SQLite.
+
+- индекс: key → size, created, accessed, hits (без glob/stat на каждую запись)
+- бюджет в байтах, вытеснение LRU (или LFU: реже всего читаемые)
+- запись атомарная: временный файл в той же папке + os.replace
+- безопасен для нескольких uvicorn-воркеров: изменения индекса идут в
+  транзакциях BEGIN IMMEDIATE, файлы удаляются только после коммита
+  (уже открытые дескрипторы на Linux/macOS остаются валидными)
+- из async-кода — alookup/acontains/acommit: индекс и файлы трогаются в
+  пуле потоков run_db, ожидание блокировки другого воркера не стопорит loop
+"""
+from __future__ import annotations
+import hashlib, os, re, shutil, sqlite3, threading, time, uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from shared_cache import run_db
+
+_SAFE_KEY_RE = re.compile(r"^[A-Za-z0-9_\-]{1,64}$")
+
+
+class DiskCache:
+    def __init__(self, directory: Path, max_bytes: int, policy: str = "lru", suffix: str = ".mp3"):
+        if policy not in ("lru", "lfu"):
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        self.dir = Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.dir / "index.db"
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._local = threading.local()
+        self._init_index()
+
+    # ─── SQLite ──────────────────────────────────────────────────
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(str(self.index_path), timeout=10, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_index(self) -> None:
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL,"
+            " hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)")
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_hits ON entries(hits, accessed)")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE name = 'total_bytes'").fetchone()
+            if row is None:
+                self._import_existing(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _import_existing(self, conn: sqlite3.Connection) -> None:
+        """Первый запуск: индексируем файлы, оставшиеся от старого кеша."""
+        total = 0
+        for f in self.dir.glob(f"*{self.suffix}"):
+            try:
+                st = f.stat()
+            except OSError:
+                continue
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, size, created, accessed, hits)"
+                " VALUES (?, ?, ?, ?, 0)",
+                (f.name[: -len(self.suffix)], st.st_size, st.st_mtime, st.st_mtime),
+            )
+            total += st.st_size
+        conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('total_bytes', ?)", (total,))
+
+    # ─── Пути ────────────────────────────────────────────────────
+
+    def path_for(self, key: str) -> Path:
+        # Защита от path traversal: небезопасные ключи хешируем
+        if not _SAFE_KEY_RE.match(key):
+            key = hashlib.sha256(key.encode()).hexdigest()[:32]
+        return self.dir / f"{key}{self.suffix}"
+
+    def temp_path(self, key: str) -> Path:
+        """Уникальный временный файл рядом с итоговым (для os.replace)."""
+        return self.dir / f".{self.path_for(key).stem}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+
+    # ─── Чтение ──────────────────────────────────────────────────
+
+    def lookup(self, key: str) -> Optional[Path]:
+        """Путь к файлу в кеше или None. Обновляет accessed и hits."""
+        path = self.path_for(key)
+        name = path.stem
+        conn = self._conn()
+        row = conn.execute("SELECT size FROM entries WHERE key = ?", (name,)).fetchone()
+        if row is None or not path.exists():
+            if row is not None:
+                self._forget(name)
+            self.misses += 1
+            return None
+        conn.execute(
+            "UPDATE entries SET accessed = ?, hits = hits + 1 WHERE key = ?", (time.time(), name)
+        )
+        self.hits += 1
+        return path
+
+    def contains(self, key: str) -> bool:
+        """Проверка без учёта в статистике и без обновления accessed."""
+        path = self.path_for(key)
+        row = self._conn().execute("SELECT 1 FROM entries WHERE key = ?", (path.stem,)).fetchone()
+        return row is not None and path.exists()
+
+    async def alookup(self, key: str) -> Optional[Path]:
+        return await run_db(self.lookup, key)
+
+    async def acontains(self, key: str) -> bool:
+        return await run_db(self.contains, key)
+
+    # ─── Запись ──────────────────────────────────────────────────
+
+    def put_bytes(self, key: str, data: bytes) -> Path:
+        tmp = self.temp_path(key)
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            return self.commit(key, tmp)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    def commit(self, key: str, tmp: Path) -> Path:
+        """Атомарно переносит готовый временный файл в кеш и индексирует его."""
+        path = self.path_for(key)
+        size = tmp.stat().st_size
+        os.replace(tmp, path)
+        now = time.time()
+        conn = self._conn()
+        victims: List[str] = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            old = conn.execute("SELECT size FROM entries WHERE key = ?", (path.stem,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, size, created, accessed, hits)"
+                " VALUES (?, ?, ?, ?, 0)",
+                (path.stem, size, now, now),
+            )
+            total = self._add_total(conn, size - (old[0] if old else 0))
+            if total > self.max_bytes:
+                victims = self._pick_victims(conn, total - self.max_bytes, exclude=path.stem)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        for name in victims:
+            (self.dir / f"{name}{self.suffix}").unlink(missing_ok=True)
+        self.evictions += len(victims)
+        return path
+
+    async def acommit(self, key: str, tmp: Path) -> Path:
+        return await run_db(self.commit, key, tmp)
+
+    def adopt(self, key: str, src: Path) -> Path:
+        """Кладёт в кеш файл из другого кеша: hardlink (та же ФС), иначе копия."""
+        tmp = self.temp_path(key)
+        try:
+            try:
+                os.link(src, tmp)
+            except OSError:
+                shutil.copyfile(src, tmp)
+            return self.commit(key, tmp)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    def discard(self, key: str) -> None:
+        """Убирает запись и файл (hardlink в другом кеше остаётся)."""
+        path = self.path_for(key)
+        self._forget(path.stem)
+        path.unlink(missing_ok=True)
+
+    def _add_total(self, conn: sqlite3.Connection, delta: int) -> int:
+        conn.execute(
+            "INSERT INTO meta (name, value) VALUES ('total_bytes', ?)"
+            " ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (delta,),
+        )
+        return conn.execute("SELECT value FROM meta WHERE name = 'total_bytes'").fetchone()[0]
+
+    def _pick_victims(self, conn: sqlite3.Connection, need: int, exclude: str) -> List[str]:
+        order = "accessed ASC" if self.policy == "lru" else "hits ASC, accessed ASC"
+        victims, freed = [], 0
+        for name, size in conn.execute(
+            f"SELECT key, size FROM entries WHERE key != ? ORDER BY {order}", (exclude,)
+        ):
+            victims.append(name)
+            freed += size
+            if freed >= need:
+                break
+        conn.executemany("DELETE FROM entries WHERE key = ?", [(n,) for n in victims])
+        self._add_total(conn, -freed)
+        return victims
+
+    def _forget(self, name: str) -> None:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT size FROM entries WHERE key = ?", (name,)).fetchone()
+            if row:
+                conn.execute("DELETE FROM entries WHERE key = ?", (name,))
+                self._add_total(conn, -row[0])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def cleanup_temp(self, max_age: float = 3600) -> None:
+        """Удаляет брошенные временные файлы (воркер упал посреди записи)."""
+        cutoff = time.time() - max_age
+        for f in self.dir.glob(".*.tmp"):
+            try:
+                if f.stat().st_mtime < cutoff:
+                    f.unlink(missing_ok=True)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict:
+        conn = self._conn()
+        entries = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        row = conn.execute("SELECT value FROM meta WHERE name = 'total_bytes'").fetchone()
+        return {
+            "entries": entries,
+            "bytes": row[0] if row else 0,
+            "max_bytes": self.max_bytes,
+            "policy": self.policy,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
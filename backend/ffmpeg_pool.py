@@ -0,0 +1,208 @@
+"""
+Лимит одновременных ffmpeg-процессов на узел.
+
+- slot(priority): ждём свободный слот; меньший priority — раньше
+  (стриминг слушателю раньше фоновой конвертации для send-to-bot)
+- admit(priority): мгновенная проверка перед ответом клиенту — очередь
+  уже полна → Saturated (отдаём 503 с Retry-After, а не висим)
+- ожидание ограничено timeout → Saturated
+- общий лимит для всех uvicorn-воркеров: slots_dir с файлами slot.{i}.lock,
+  слот занят, пока процесс держит flock (умер — ядро снимает блокировку).
+  Очередь с приоритетами — внутри воркера; между воркерами интерактивные
+  опрашивают свободный слот чаще фоновых
+- без fcntl (Windows) — лимит на воркер: max_procs // workers, не меньше 1
+- метрики: занято/всего, глубина очереди по приоритетам, время ожидания
+"""
+from __future__ import annotations
+import asyncio, heapq, itertools, os, time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: только лимит на воркер
+    fcntl = None
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class Saturated(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"ffmpeg pool is saturated, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class NodeSlots:
+    """count слотов на узел: файлы slot.{i}.lock под flock(LOCK_EX | LOCK_NB)."""
+
+    def __init__(self, directory: Path, count: int):
+        self.dir = Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.count = count
+        self._held: Dict[int, int] = {}   # номер слота → fd
+
+    def try_acquire(self) -> Optional[int]:
+        for i in range(self.count):
+            if i in self._held:
+                continue
+            fd = os.open(self.dir / f"slot.{i}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                continue
+            self._held[i] = fd
+            return i
+        return None
+
+    def release(self, i: int) -> None:
+        fd = self._held.pop(i)
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def busy(self) -> int:
+        """Сколько слотов узла занято сейчас (всеми воркерами)."""
+        busy = len(self._held)
+        for i in range(self.count):
+            if i in self._held:
+                continue
+            fd = os.open(self.dir / f"slot.{i}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            except OSError:
+                busy += 1
+            finally:
+                os.close(fd)
+        return busy
+
+
+class FfmpegPool:
+    def __init__(
+        self,
+        max_procs: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        timeouts: Optional[Dict[int, float]] = None,
+        retry_after: float = 5,
+        slots_dir: Optional[Path] = None,
+        workers: int = 1,
+        poll: Optional[Dict[int, float]] = None,
+    ):
+        node_procs = max_procs or os.cpu_count() or 2
+        if slots_dir is not None and fcntl is not None:
+            self.node: Optional[NodeSlots] = NodeSlots(slots_dir, node_procs)
+            # Воркер может занять и все слоты узла, если остальные простаивают
+            self.max_procs = node_procs
+        else:
+            self.node = None
+            self.max_procs = max(1, node_procs // max(1, workers))
+        self.poll = {INTERACTIVE: 0.05, BACKGROUND: 0.5, **(poll or {})}
+        self.max_queue = max_queue if max_queue is not None else self.max_procs * 2
+        self.timeouts = {INTERACTIVE: 10.0, BACKGROUND: 300.0, **(timeouts or {})}
+        self.retry_after = retry_after
+        self.running = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+
+    def queued(self, priority: Optional[int] = None) -> int:
+        return sum(1 for p, _, f in self._waiters
+                   if not f.done() and (priority is None or p <= priority))
+
+    def admit(self, priority: int = INTERACTIVE) -> None:
+        """Бросает Saturated, если запрос с таким приоритетом всё равно не дождётся слота."""
+        full = self.running >= self.max_procs or (self.node is not None and self.node.busy() >= self.node.count)
+        if full and self.queued(priority) >= self.max_queue:
+            self.rejected += 1
+            raise Saturated(self.retry_after)
+
+    @asynccontextmanager
+    async def slot(self, priority: int = INTERACTIVE, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        timeout = self.timeouts.get(priority) if timeout is None else timeout
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        await self._acquire(priority, timeout)
+        try:
+            node_slot = await self._acquire_node(priority, deadline)
+        except BaseException:
+            self._release()
+            raise
+        try:
+            yield
+        finally:
+            if node_slot is not None:
+                self.node.release(node_slot)
+            self._release()
+
+    async def _acquire_node(self, priority: int, deadline: Optional[float]) -> Optional[int]:
+        """Слот узла (общий для воркеров) — опросом до deadline."""
+        if self.node is None:
+            return None
+        started = time.monotonic()
+        while True:
+            i = self.node.try_acquire()
+            if i is not None:
+                self.wait_seconds += time.monotonic() - started
+                return i
+            if deadline is not None and time.monotonic() >= deadline:
+                self.timed_out += 1
+                raise Saturated(self.retry_after)
+            delay = self.poll.get(priority, self.poll[BACKGROUND])
+            if deadline is not None:
+                delay = min(delay, max(0.0, deadline - time.monotonic()))
+            await asyncio.sleep(delay)
+
+    async def _acquire(self, priority: int, timeout: Optional[float]) -> None:
+        started = time.monotonic()
+        if self.running < self.max_procs and not self.queued():
+            self.running += 1
+        else:
+            self.admit(priority)
+            fut = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+            try:
+                await asyncio.wait_for(asyncio.shield(fut), timeout)
+            except asyncio.TimeoutError:
+                if not fut.done():
+                    fut.cancel()
+                    self.timed_out += 1
+                    raise Saturated(self.retry_after)
+                # слот выдали в момент таймаута — берём его
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    self._release()   # слот уже передан нам — возвращаем
+                else:
+                    fut.cancel()
+                raise
+        waited = time.monotonic() - started
+        self.admitted += 1
+        self.wait_seconds += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def _release(self) -> None:
+        # Слот переходит первому живому ожидающему, running не меняется
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.running -= 1
+
+    def stats(self) -> Dict:
+        return {
+            "max_procs": self.max_procs,
+            "running": self.running,
+            "node_busy": self.node.busy() if self.node is not None else None,
+            "queued_interactive": sum(1 for p, _, f in self._waiters if p == INTERACTIVE and not f.done()),
+            "queued_background": sum(1 for p, _, f in self._waiters if p != INTERACTIVE and not f.done()),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait": round(self.wait_seconds / self.admitted, 3) if self.admitted else 0.0,
+            "max_wait": round(self.max_wait, 3),
+        }
@@ -0,0 +1,354 @@
+"""
+HLS → MP3 без ffmpeg: сами качаем m3u8 и сегменты, MP3 из MPEG-TS отдаём как есть.
+
+- сегменты качаются через общую aiohttp-сессию, до prefetch штук параллельно,
+  отдаются строго по порядку
+- AES-128 (EXT-X-KEY): ключи кешируются на поток, IV из тега или номер
+  сегмента; нужен пакет cryptography
+- MPEG-TS демультиплексируется на лету: payload аудио-PES с MP3
+  (stream_type 0x03/0x04) склеивается в обычный MP3-поток без перекодирования
+- seek: open(url, start) начинает с сегмента, покрывающего start, и
+  отрезает его начало пропорционально (по границе MP3-кадра)
+- всё, что так не отдать (AAC, fMP4, SAMPLE-AES, live-плейлист, нет
+  cryptography), и любой сбой до первого байта (сеть, битый плейлист или
+  сегмент, ключ) → HlsUnsupported, и вызывающий уходит в ffmpeg
+"""
+from __future__ import annotations
+import asyncio, re
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional
+from urllib.parse import urljoin
+
+import aiohttp
+
+try:
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:  # без cryptography зашифрованные потоки уходят в ffmpeg
+    Cipher = None
+
+_TS_PACKET = 188
+_MP3_STREAM_TYPES = (0x03, 0x04)
+_ATTR_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def _spawn(coro) -> asyncio.Task:
+    task = asyncio.ensure_future(coro)
+    # Ошибку брошенной (отменённой клиентом) задачи забираем, чтобы не было
+    # «Task exception was never retrieved»
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return task
+
+
+def find_mp3_sync(data: bytes, pos: int = 0) -> int:
+    """Начало ближайшего MP3-кадра (11 бит синхрослова) с позиции pos."""
+    while True:
+        pos = data.find(b"\xff", pos)
+        if pos < 0 or pos + 1 >= len(data):
+            return len(data)
+        if data[pos + 1] & 0xE0 == 0xE0:
+            return pos
+        pos += 1
+
+
+class HlsUnsupported(Exception):
+    """Поток нельзя отдать без перекодирования — нужен ffmpeg."""
+
+
+@dataclass
+class HlsKey:
+    method: str
+    uri: Optional[str] = None
+    iv: Optional[bytes] = None
+
+
+@dataclass
+class HlsSegment:
+    uri: str
+    seq: int
+    duration: float
+    key: Optional[HlsKey] = None
+
+
+def _attrs(line: str) -> Dict[str, str]:
+    return {k: v.strip('"') for k, v in _ATTR_RE.findall(line.split(":", 1)[1])}
+
+
+def parse_playlist(text: str, base_url: str) -> Dict:
+    """
+    {"variants": [(bandwidth, url), ...]} для master-плейлиста или
+    {"segments": [...], "ended": bool, "map": bool} для media-плейлиста.
+    """
+    lines = [l.strip() for l in text.splitlines() if l.strip()]
+    if not lines or lines[0] != "#EXTM3U":
+        raise HlsUnsupported("not an m3u8 playlist")
+
+    variants, segments = [], []
+    seq, duration, key = 0, 0.0, None
+    ended = has_map = False
+    pending_variant: Optional[int] = None
+    for line in lines[1:]:
+        if line.startswith("#EXT-X-STREAM-INF"):
+            pending_variant = int(_attrs(line).get("BANDWIDTH", "0") or 0)
+        elif line.startswith("#EXT-X-MEDIA-SEQUENCE"):
+            seq = int(line.split(":", 1)[1])
+        elif line.startswith("#EXTINF"):
+            duration = float(line.split(":", 1)[1].split(",", 1)[0] or 0)
+        elif line.startswith("#EXT-X-KEY"):
+            a = _attrs(line)
+            method = a.get("METHOD", "NONE").upper()
+            if method == "NONE":
+                key = None
+            else:
+                iv = a.get("IV")
+                key = HlsKey(
+                    method,
+                    urljoin(base_url, a["URI"]) if "URI" in a else None,
+                    bytes.fromhex(iv[2:] if iv.lower().startswith("0x") else iv) if iv else None,
+                )
+        elif line.startswith("#EXT-X-MAP"):
+            has_map = True
+        elif line.startswith("#EXT-X-ENDLIST"):
+            ended = True
+        elif line.startswith("#"):
+            continue
+        elif pending_variant is not None:
+            variants.append((pending_variant, urljoin(base_url, line)))
+            pending_variant = None
+        else:
+            segments.append(HlsSegment(urljoin(base_url, line), seq, duration, key))
+            seq += 1
+            duration = 0.0
+
+    if variants:
+        return {"variants": variants}
+    return {"segments": segments, "ended": ended, "map": has_map}
+
+
+class TsAudioDemuxer:
+    """Достаёт payload первой аудиодорожки из MPEG-TS (PAT → PMT → PES)."""
+
+    def __init__(self):
+        self.pmt_pid: Optional[int] = None
+        self.audio_pid: Optional[int] = None
+        self.stream_type: Optional[int] = None
+
+    def feed(self, data: bytes) -> bytes:
+        if len(data) % _TS_PACKET or (data and data[0] != 0x47):
+            raise HlsUnsupported("segment is not MPEG-TS")
+        out = bytearray()
+        view = memoryview(data)
+        for off in range(0, len(data), _TS_PACKET):
+            pkt = view[off:off + _TS_PACKET]
+            if pkt[0] != 0x47:
+                raise HlsUnsupported("lost MPEG-TS sync")
+            pusi = pkt[1] & 0x40
+            pid = ((pkt[1] & 0x1F) << 8) | pkt[2]
+            afc = (pkt[3] >> 4) & 0x3
+            pos = 4
+            if afc & 0x2:
+                pos += 1 + pkt[4]
+            if not afc & 0x1 or pos >= _TS_PACKET:
+                continue
+            payload = pkt[pos:]
+            if pid == self.audio_pid:
+                if pusi:
+                    if bytes(payload[:3]) != b"\x00\x00\x01" or len(payload) < 9:
+                        continue
+                    payload = payload[9 + payload[8]:]
+                out += payload
+            elif pid == 0 and pusi:
+                self._parse_pat(payload)
+            elif pid == self.pmt_pid and pusi:
+                self._parse_pmt(payload)
+        return bytes(out)
+
+    @staticmethod
+    def _section(payload) -> memoryview:
+        s = payload[1 + payload[0]:]
+        length = ((s[1] & 0x0F) << 8) | s[2]
+        return s[:3 + length - 4]  # без CRC32
+
+    def _parse_pat(self, payload) -> None:
+        s = self._section(payload)
+        for i in range(8, len(s) - 3, 4):
+            if (s[i] << 8) | s[i + 1]:  # program 0 — network PID
+                self.pmt_pid = ((s[i + 2] & 0x1F) << 8) | s[i + 3]
+                return
+
+    def _parse_pmt(self, payload) -> None:
+        s = self._section(payload)
+        i = 12 + (((s[10] & 0x0F) << 8) | s[11])
+        while i + 5 <= len(s):
+            stream_type = s[i]
+            pid = ((s[i + 1] & 0x1F) << 8) | s[i + 2]
+            if self.audio_pid is None and stream_type in (0x03, 0x04, 0x0F, 0x11):
+                self.audio_pid, self.stream_type = pid, stream_type
+            i += 5 + (((s[i + 3] & 0x0F) << 8) | s[i + 4])
+
+
+SessionGetter = Callable[[], Awaitable[aiohttp.ClientSession]]
+
+
+class HlsStream:
+    """Один проигрываемый HLS-трек. Создаётся через HlsProxy.open()."""
+
+    def __init__(self, proxy: "HlsProxy", segments: List[HlsSegment], skip: float = 0.0):
+        self.proxy = proxy
+        self.segments = segments
+        self.skip = skip        # доля первого сегмента, которую отрезаем при seek
+        self.demuxer = TsAudioDemuxer()
+        self._keys: Dict[str, asyncio.Task] = {}
+        self._first: Optional[bytes] = None
+        self.complete = False  # все сегменты отданы без ошибок
+
+    async def _prime(self) -> None:
+        """Первый сегмент качаем до ответа клиенту: по нему решаем, нужен ли ffmpeg."""
+        self._first = self.demuxer.feed(await self._segment(self.segments[0]))
+        if self.demuxer.stream_type not in _MP3_STREAM_TYPES:
+            raise HlsUnsupported(f"audio stream_type {self.demuxer.stream_type}")
+        if self.skip > 0:
+            self._first = self._first[find_mp3_sync(self._first, int(len(self._first) * self.skip)):]
+
+    @property
+    def buffered(self) -> int:
+        """Байт уже скачано и держится в памяти до первой выдачи."""
+        return len(self._first or b"")
+
+    async def _key(self, uri: str) -> bytes:
+        task = self._keys.get(uri)
+        if task is None:
+            task = self._keys[uri] = _spawn(self.proxy._get(uri))
+        key = await task
+        if len(key) != 16:
+            raise HlsUnsupported("bad AES-128 key")
+        return key
+
+    async def _segment(self, seg: HlsSegment) -> bytes:
+        data = await self.proxy._get(seg.uri)
+        if seg.key is not None:
+            iv = seg.key.iv or seg.seq.to_bytes(16, "big")
+            decryptor = Cipher(algorithms.AES(await self._key(seg.key.uri)), modes.CBC(iv)).decryptor()
+            unpadder = padding.PKCS7(128).unpadder()
+            data = unpadder.update(decryptor.update(data) + decryptor.finalize()) + unpadder.finalize()
+        self.proxy.segments += 1
+        self.proxy.bytes_in += len(data)
+        return data
+
+    async def iter_mp3(self) -> AsyncIterator[bytes]:
+        """MP3-поток. Сегменты качаются окном по prefetch, отдаются по порядку."""
+        window: Deque[asyncio.Task] = deque()
+        pending = iter(self.segments[1:])
+        try:
+            if self._first:
+                yield self._first
+            self._first = None
+            while True:
+                while len(window) < self.proxy.prefetch:
+                    seg = next(pending, None)
+                    if seg is None:
+                        break
+                    window.append(_spawn(self._segment(seg)))
+                if not window:
+                    self.complete = True
+                    break
+                chunk = self.demuxer.feed(await window.popleft())
+                if chunk:
+                    yield chunk
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Заголовки уже ушли клиенту — остаётся только оборвать поток
+            self.proxy.errors += 1
+            print(f"⚠️ HLS stream aborted: {type(e).__name__}: {e}")
+        finally:
+            for task in window:
+                task.cancel()
+            for task in self._keys.values():
+                task.cancel()
+
+
+class HlsProxy:
+    def __init__(self, get_session: SessionGetter, user_agent: str, prefetch: int = 4, retries: int = 2):
+        self.get_session = get_session
+        self.headers = {"User-Agent": user_agent}
+        self.prefetch = max(1, prefetch)
+        self.retries = retries
+        self.streams = 0
+        self.fallbacks = 0
+        self.open_errors = 0     # из fallbacks: сбои загрузки/разбора, а не «не MP3»
+        self.segments = 0
+        self.bytes_in = 0
+        self.errors = 0
+
+    async def _get(self, url: str) -> bytes:
+        for attempt in range(self.retries + 1):
+            try:
+                session = await self.get_session()
+                async with session.get(url, headers=self.headers) as resp:
+                    if resp.status == 200:
+                        return await resp.read()
+                    if resp.status < 500:
+                        raise HlsUnsupported(f"HTTP {resp.status} for {url[:80]}")
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt >= self.retries:
+                    raise
+            await asyncio.sleep(0.2 * (attempt + 1))
+        raise HlsUnsupported(f"HTTP 5xx for {url[:80]}")
+
+    async def open(self, url: str, start: float = 0.0) -> HlsStream:
+        """
+        Готовый к отдаче поток или HlsUnsupported (тогда — ffmpeg).
+        start — позиция в секундах: пропускаем сегменты по длительностям EXTINF.
+        """
+        try:
+            playlist = parse_playlist((await self._get(url)).decode("utf-8", "replace"), url)
+            if "variants" in playlist:
+                best = max(playlist["variants"])[1]
+                playlist = parse_playlist((await self._get(best)).decode("utf-8", "replace"), best)
+            segments = playlist.get("segments")
+            if not segments or playlist.get("map"):
+                raise HlsUnsupported("empty or fMP4 playlist")
+            if not playlist["ended"]:
+                raise HlsUnsupported("live playlist")
+            for seg in segments:
+                if seg.key is not None:
+                    if seg.key.method != "AES-128" or not seg.key.uri:
+                        raise HlsUnsupported(f"key method {seg.key.method}")
+                    if Cipher is None:
+                        raise HlsUnsupported("cryptography is not installed")
+            skip = 0.0
+            if start > 0:
+                i, elapsed = 0, 0.0
+                while i < len(segments) - 1 and elapsed + segments[i].duration <= start:
+                    elapsed += segments[i].duration
+                    i += 1
+                segments = segments[i:]
+                if segments[0].duration > 0:
+                    skip = min(max((start - elapsed) / segments[0].duration, 0.0), 1.0)
+            stream = HlsStream(self, segments, skip)
+            await stream._prime()
+        except HlsUnsupported:
+            self.fallbacks += 1
+            raise
+        except Exception as e:
+            # Сеть, битый плейлист или сегмент, ключ — ffmpeg может справиться
+            # там, где не справился прокси; 502 вместо трека хуже лишнего CPU
+            self.fallbacks += 1
+            self.open_errors += 1
+            raise HlsUnsupported(f"{type(e).__name__}: {e}") from e
+        self.streams += 1
+        return stream
+
+    def stats(self) -> Dict:
+        return {
+            "prefetch": self.prefetch,
+            "streams": self.streams,
+            "ffmpeg_fallbacks": self.fallbacks,
+            "open_errors": self.open_errors,
+            "segments": self.segments,
+            "bytes_in": self.bytes_in,
+            "errors": self.errors,
+            "aes": Cipher is not None,
+        }
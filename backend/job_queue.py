@@ -0,0 +1,228 @@
+"""
+Очередь фоновых задач с ограниченным пулом воркеров.
+
+- concurrency: сколько задач выполняется одновременно (в процессе)
+- max_pending: размер очереди; переполнение → QueueFull (отдаём 503)
+- дедупликация по (user_id, key): повторный клик возвращает ту же задачу;
+  active-ключ захватывается атомарным store.add, так что одновременные
+  клики (в том числе в разных воркерах) не создают двух задач
+- rate limit на пользователя: не больше rate_limit задач в окне rate_window
+  сек; счётчик окна — store.incr, общий для всех uvicorn-воркеров
+  (RateLimiter — тот же лимит для эндпоинтов без очереди)
+- приоритет: меньше — раньше (например, треки из кеша вперёд)
+- статус задач хранится в store (shared_cache), поэтому его видит любой
+  uvicorn-воркер, а не только тот, что принял запрос
+- при остановке задачи из очереди и прерванные помечаются failed —
+  клиент, опрашивающий статус, не ждёт вечно «queued»
+"""
+from __future__ import annotations
+import asyncio, itertools, json, time, uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+class QueueFull(Exception):
+    pass
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limited, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+Handler = Callable[[Dict[str, Any]], Awaitable[bool]]
+
+
+class RateLimiter:
+    """
+    Не больше limit действий пользователя в окне window секунд. Фиксированное
+    окно: счётчик rate:{user}:{номер окна} в общем store (incr атомарен для
+    всех воркеров), поэтому лимит не умножается на число воркеров.
+    """
+
+    def __init__(self, store, limit: int, window: float = 60):
+        self.store = store
+        self.limit = limit
+        self.window = window
+        self.rejected = 0
+
+    async def check(self, user_id: int) -> None:
+        now = time.time()
+        window = int(now // self.window)
+        hits = await self.store.aincr(f"rate:{user_id}:{window}")
+        if hits > self.limit:
+            self.rejected += 1
+            raise RateLimited((window + 1) * self.window - now)
+
+
+class JobQueue:
+    def __init__(
+        self,
+        handler: Handler,
+        store,
+        concurrency: int = 2,
+        max_pending: int = 200,
+        rate_limit: int = 10,
+        rate_window: float = 60,
+        name: str = "jobs",
+        stale_after: float = 900,
+    ):
+        self.handler = handler
+        self.store = store
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.limiter = RateLimiter(store, rate_limit, rate_window)
+        self.name = name
+        self.stale_after = stale_after
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._seq = itertools.count()
+        self.running = 0
+        self.submitted = 0
+        self.deduplicated = 0
+        self.rejected = 0
+        self.done = 0
+        self.failed = 0
+
+    # ─── Жизненный цикл (из lifespan) ────────────────────────────
+
+    def start(self) -> None:
+        if self._workers:
+            return
+        self._queue = asyncio.PriorityQueue(maxsize=self.max_pending)
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.concurrency)
+        ]
+
+    async def stop(self) -> None:
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        # Очередь живёт в памяти процесса: после рестарта её никто не выполнит
+        while self._queue is not None and not self._queue.empty():
+            _, _, job = self._queue.get_nowait()
+            await self._finish(job, False, error="shutdown")
+
+    # ─── API ─────────────────────────────────────────────────────
+
+    async def submit(self, user_id: int, key: str, payload: Dict[str, Any], priority: int = 1) -> Dict:
+        """Ставит задачу в очередь или возвращает уже активную такую же."""
+        if self._queue is None:
+            self.start()
+        if self._queue.full():
+            self.rejected += 1
+            raise QueueFull(f"{self.name} queue is full")
+
+        job = {
+            "id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "key": key,
+            "status": "queued",
+            "priority": priority,
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "payload": payload,
+            "error": None,
+        }
+        # Запись задачи — до захвата active-ключа: кто увидит ключ, найдёт и задачу
+        await self._save(job)
+        active_key = f"active:{user_id}:{key}"
+        existing = await self._claim(active_key, job["id"])
+        if existing is not None:
+            self.deduplicated += 1
+            await self.store.adelete(f"job:{job['id']}")
+            return existing
+
+        try:
+            # Пока ждали store, очередь могли заполнить другие запросы
+            if self._queue.full():
+                raise QueueFull(f"{self.name} queue is full")
+            await self.limiter.check(user_id)
+        except (QueueFull, RateLimited) as e:
+            self.rejected += 1
+            job.update(status="failed", finished=time.time(), error=str(e))
+            await self._save(job)
+            await self.store.adelete(active_key)
+            raise
+        self._queue.put_nowait((priority, next(self._seq), job))
+        self.submitted += 1
+        return job
+
+    async def _claim(self, active_key: str, job_id: str) -> Optional[Dict]:
+        """
+        Атомарно (store.add) делает job_id активной задачей для ключа.
+        None — захватили; иначе — уже активная задача, её и отдаём.
+        """
+        for _ in range(20):
+            if await self.store.aadd(active_key, job_id):
+                return None
+            existing_id = await self.store.aget(active_key)
+            if not existing_id:
+                continue   # задача только что завершилась — пробуем снова
+            existing = await self.get(existing_id)
+            if (existing and existing["status"] in ("queued", "running")
+                    and time.time() - existing["created"] < self.stale_after):
+                return existing
+            # Задача «зависшего» воркера (рестарт) не блокирует повтор навсегда;
+            # заменить её может только один из одновременных запросов
+            if await self.store.aadd(f"takeover:{existing_id}", job_id):
+                await self.store.aset(active_key, job_id)
+                return None
+            await asyncio.sleep(0.05)
+        raise QueueFull(f"{self.name}: could not claim {active_key}")
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        raw = await self.store.aget(f"job:{job_id}")
+        return json.loads(raw) if raw else None
+
+    async def _save(self, job: Dict) -> None:
+        await self.store.aset(f"job:{job['id']}", json.dumps(job, ensure_ascii=False))
+
+    async def _finish(self, job: Dict, ok: bool, error: Optional[str] = None) -> None:
+        job["status"] = "done" if ok else "failed"
+        job["finished"] = time.time()
+        job["error"] = error
+        if ok:
+            self.done += 1
+        else:
+            self.failed += 1
+        await self._save(job)
+        await self.store.adelete(f"active:{job['user_id']}:{job['key']}")
+
+    # ─── Воркеры ─────────────────────────────────────────────────
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, job = await self._queue.get()
+            self.running += 1
+            job["status"] = "running"
+            job["started"] = time.time()
+            error = None
+            try:
+                await self._save(job)
+                ok = await self.handler(job["payload"])
+            except asyncio.CancelledError:
+                # Остановка посреди задачи: результат неизвестен — failed
+                await self._finish(job, False, error="shutdown")
+                raise
+            except Exception as e:
+                print(f"⚠️ [{self.name}] job {job['id']} failed: {e}")
+                ok, error = False, str(e)
+            finally:
+                self.running -= 1
+                self._queue.task_done()
+            await self._finish(job, ok, error=error)
+
+    def stats(self) -> Dict:
+        return {
+            "concurrency": self.concurrency,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "running": self.running,
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "rejected": self.rejected,
+            "done": self.done,
+            "failed": self.failed,
+        }
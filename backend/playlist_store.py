@@ -0,0 +1,487 @@
+"""
+Хранилище плейлистов: SQLite в WAL-режиме вместо user_data/{id}.json.
+
+- (user_id, track_id) — первичный ключ: проверка «уже в плейлисте» — поиск по индексу
+- добавление/удаление — одна строка, без перезаписи всего списка
+- изменения в транзакциях BEGIN IMMEDIATE: несколько uvicorn-воркеров
+  не теряют записи друг друга
+- version плейлиста растёт на каждое изменение
+
+PlaylistReadCache — LRU готовых JSON-ответов перед хранилищем (см. ниже).
+
+Миграция старых JSON-файлов:
+    python3 playlist_store.py migrate [--dir user_data] [--db user_data/playlists.db]
+Пользователи, которых ещё не мигрировали, подхватываются из JSON при первом обращении.
+"""
+from __future__ import annotations
+import json, os, sqlite3, sys, threading, time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+TRACK_FIELDS = ("id", "title", "artist", "duration", "cover_url")
+
+
+class VersionConflict(Exception):
+    """if_version клиента не совпал с текущей версией плейлиста."""
+
+    def __init__(self, current: int):
+        super().__init__(f"Playlist version is {current}")
+        self.current = current
+
+
+class LimitExceeded(Exception):
+    pass
+
+
+class PlaylistStore:
+    def __init__(self, db_path: Path, legacy_dir: Optional[Path] = None):
+        self.db_path = Path(db_path)
+        self.legacy_dir = Path(legacy_dir) if legacy_dir else None
+        self._local = threading.local()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._init_schema()
+
+    # ─── SQLite ──────────────────────────────────────────────────
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(str(self.db_path), timeout=10, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _write(self) -> Iterator[sqlite3.Connection]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _init_schema(self) -> None:
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS playlists ("
+            " user_id INTEGER PRIMARY KEY,"
+            " version INTEGER NOT NULL DEFAULT 0,"
+            " count INTEGER NOT NULL DEFAULT 0,"
+            " next_pos INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS playlist_tracks ("
+            " user_id INTEGER NOT NULL,"
+            " track_id TEXT NOT NULL,"
+            " position INTEGER NOT NULL,"
+            " title TEXT NOT NULL,"
+            " artist TEXT NOT NULL,"
+            " duration INTEGER NOT NULL DEFAULT 0,"
+            " cover_url TEXT,"
+            " added REAL NOT NULL,"
+            " PRIMARY KEY (user_id, track_id)) WITHOUT ROWID"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS playlist_tracks_pos ON playlist_tracks(user_id, position)"
+        )
+
+    # ─── Чтение ──────────────────────────────────────────────────
+
+    def _meta(self, conn: sqlite3.Connection, user_id: int) -> Optional[Tuple[int, int, int]]:
+        return conn.execute(
+            "SELECT version, count, next_pos FROM playlists WHERE user_id = ?", (user_id,)
+        ).fetchone()
+
+    def _ensure_user(self, user_id: int) -> None:
+        """Первое обращение: создаём запись, подхватив старый JSON, если он есть."""
+        if self._meta(self._conn(), user_id) is not None:
+            return
+        tracks = self._read_legacy(user_id)
+        with self._write() as conn:
+            if self._meta(conn, user_id) is None:
+                self._import_tracks(conn, user_id, tracks)
+
+    def load(self, user_id: int) -> Tuple[List[Dict], int]:
+        """(треки по порядку, version)."""
+        user_id = int(user_id)
+        self._ensure_user(user_id)
+        conn = self._conn()
+        rows = conn.execute(
+            "SELECT track_id, title, artist, duration, cover_url FROM playlist_tracks"
+            " WHERE user_id = ? ORDER BY position",
+            (user_id,),
+        ).fetchall()
+        meta = self._meta(conn, user_id)
+        return [dict(zip(TRACK_FIELDS, row)) for row in rows], meta[0] if meta else 0
+
+    def data_version(self) -> int:
+        """PRAGMA data_version: меняется, когда коммитит ДРУГОЕ соединение
+        (другой воркер). Читается из shared memory WAL, без диска."""
+        return self._conn().execute("PRAGMA data_version").fetchone()[0]
+
+    def version(self, user_id: int) -> int:
+        meta = self._meta(self._conn(), int(user_id))
+        return meta[0] if meta else 0
+
+    def contains(self, user_id: int, track_id: str) -> bool:
+        row = self._conn().execute(
+            "SELECT 1 FROM playlist_tracks WHERE user_id = ? AND track_id = ?",
+            (int(user_id), track_id),
+        ).fetchone()
+        return row is not None
+
+    # ─── Запись ──────────────────────────────────────────────────
+
+    def add(self, user_id: int, track: Dict, limit: int) -> Tuple[str, int, int]:
+        """Добавляет трек в конец. Возвращает (status, count, version);
+        status: saved | already_exists | limit_reached."""
+        user_id = int(user_id)
+        self._ensure_user(user_id)
+        with self._write() as conn:
+            version, count, next_pos = self._meta(conn, user_id)
+            exists = conn.execute(
+                "SELECT 1 FROM playlist_tracks WHERE user_id = ? AND track_id = ?",
+                (user_id, track["id"]),
+            ).fetchone()
+            if exists:
+                return "already_exists", count, version
+            if count >= limit:
+                return "limit_reached", count, version
+            self._insert(conn, user_id, track, next_pos)
+            conn.execute(
+                "UPDATE playlists SET version = version + 1, count = count + 1,"
+                " next_pos = next_pos + 1 WHERE user_id = ?",
+                (user_id,),
+            )
+            return "saved", count + 1, version + 1
+
+    def remove(self, user_id: int, track_id: str) -> Tuple[int, int]:
+        """Удаляет трек. Возвращает (count, version)."""
+        user_id = int(user_id)
+        self._ensure_user(user_id)
+        with self._write() as conn:
+            cur = conn.execute(
+                "DELETE FROM playlist_tracks WHERE user_id = ? AND track_id = ?",
+                (user_id, track_id),
+            )
+            if cur.rowcount:
+                conn.execute(
+                    "UPDATE playlists SET version = version + 1, count = count - ?"
+                    " WHERE user_id = ?",
+                    (cur.rowcount, user_id),
+                )
+            version, count, _ = self._meta(conn, user_id)
+            return count, version
+
+    # ─── Пакетные операции: одна транзакция, одна новая версия ───
+
+    @contextmanager
+    def _batch(self, user_id: int, if_version: Optional[int]) -> Iterator[Tuple[sqlite3.Connection, Tuple[int, int, int]]]:
+        self._ensure_user(user_id)
+        with self._write() as conn:
+            meta = self._meta(conn, user_id)
+            if if_version is not None and if_version != meta[0]:
+                raise VersionConflict(meta[0])
+            yield conn, meta
+
+    def _finish(self, conn: sqlite3.Connection, user_id: int, changed: bool) -> Tuple[int, int]:
+        if changed:
+            conn.execute(
+                "UPDATE playlists SET version = version + 1,"
+                " count = (SELECT COUNT(*) FROM playlist_tracks WHERE user_id = ?),"
+                " next_pos = COALESCE((SELECT MAX(position) + 1 FROM playlist_tracks WHERE user_id = ?), 0)"
+                " WHERE user_id = ?",
+                (user_id, user_id, user_id),
+            )
+        version, count, _ = self._meta(conn, user_id)
+        return count, version
+
+    def _ordered_ids(self, conn: sqlite3.Connection, user_id: int) -> List[str]:
+        return [r[0] for r in conn.execute(
+            "SELECT track_id FROM playlist_tracks WHERE user_id = ? ORDER BY position", (user_id,)
+        )]
+
+    def _renumber(self, conn: sqlite3.Connection, user_id: int, ids: List[str]) -> None:
+        conn.executemany(
+            "UPDATE playlist_tracks SET position = ? WHERE user_id = ? AND track_id = ?",
+            [(i, user_id, tid) for i, tid in enumerate(ids)],
+        )
+
+    def add_many(self, user_id: int, tracks: List[Dict], limit: int,
+                 if_version: Optional[int] = None) -> Tuple[int, int, int]:
+        """Добавляет новые треки в конец (уже существующие пропускает).
+        Всё или ничего: при превышении limit — LimitExceeded. → (added, count, version)"""
+        user_id = int(user_id)
+        with self._batch(user_id, if_version) as (conn, (_, count, next_pos)):
+            existing = {r[0] for r in conn.execute(
+                "SELECT track_id FROM playlist_tracks WHERE user_id = ?", (user_id,)
+            )}
+            new, seen = [], set()
+            for t in tracks:
+                if t["id"] not in existing and t["id"] not in seen:
+                    seen.add(t["id"])
+                    new.append(t)
+            if count + len(new) > limit:
+                raise LimitExceeded(f"Playlist limit reached ({limit})")
+            for i, t in enumerate(new):
+                self._insert(conn, user_id, t, next_pos + i)
+            return (len(new), *self._finish(conn, user_id, bool(new)))
+
+    def remove_many(self, user_id: int, track_ids: List[str],
+                    if_version: Optional[int] = None) -> Tuple[int, int, int]:
+        """→ (removed, count, version)"""
+        user_id = int(user_id)
+        with self._batch(user_id, if_version) as (conn, _):
+            removed = 0
+            for tid in set(track_ids):
+                removed += conn.execute(
+                    "DELETE FROM playlist_tracks WHERE user_id = ? AND track_id = ?", (user_id, tid)
+                ).rowcount
+            return (removed, *self._finish(conn, user_id, removed > 0))
+
+    def move(self, user_id: int, track_id: str, to_index: int,
+             if_version: Optional[int] = None) -> Tuple[int, int]:
+        """Переносит трек на позицию to_index (0 — начало). → (count, version)"""
+        user_id = int(user_id)
+        with self._batch(user_id, if_version) as (conn, _):
+            ids = self._ordered_ids(conn, user_id)
+            if track_id not in ids:
+                raise KeyError(track_id)
+            old = ids.index(track_id)
+            ids.pop(old)
+            to_index = max(0, min(to_index, len(ids)))
+            ids.insert(to_index, track_id)
+            changed = old != to_index
+            if changed:
+                # Позиции растут хотя бы на 1, поэтому хвост после max(old, to_index)
+                # остаётся правильным — перенумеровываем только префикс
+                self._renumber(conn, user_id, ids[: max(old, to_index) + 1])
+            return self._finish(conn, user_id, changed)
+
+    def reorder(self, user_id: int, track_ids: List[str],
+                if_version: Optional[int] = None) -> Tuple[int, int]:
+        """Новый порядок: сначала track_ids (чужие id игнорируются),
+        затем не упомянутые треки в прежнем порядке. → (count, version)"""
+        user_id = int(user_id)
+        with self._batch(user_id, if_version) as (conn, _):
+            current = self._ordered_ids(conn, user_id)
+            present = set(current)
+            head, seen = [], set()
+            for tid in track_ids:
+                if tid in present and tid not in seen:
+                    seen.add(tid)
+                    head.append(tid)
+            ids = head + [tid for tid in current if tid not in seen]
+            changed = ids != current
+            if changed:
+                self._renumber(conn, user_id, ids)
+            return self._finish(conn, user_id, changed)
+
+    def replace(self, user_id: int, tracks: List[Dict], limit: int,
+                if_version: Optional[int] = None) -> Tuple[int, int]:
+        """Заменяет плейлист целиком. → (count, version)"""
+        user_id = int(user_id)
+        unique, seen = [], set()
+        for t in tracks:
+            if t["id"] not in seen:
+                seen.add(t["id"])
+                unique.append(t)
+        if len(unique) > limit:
+            raise LimitExceeded(f"Playlist limit reached ({limit})")
+        with self._batch(user_id, if_version) as (conn, _):
+            conn.execute("DELETE FROM playlist_tracks WHERE user_id = ?", (user_id,))
+            for i, t in enumerate(unique):
+                self._insert(conn, user_id, t, i)
+            return self._finish(conn, user_id, True)
+
+    def _insert(self, conn: sqlite3.Connection, user_id: int, track: Dict, position: int) -> None:
+        conn.execute(
+            "INSERT INTO playlist_tracks"
+            " (user_id, track_id, position, title, artist, duration, cover_url, added)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                user_id, track["id"], position, track.get("title") or "",
+                track.get("artist") or "", int(track.get("duration") or 0),
+                track.get("cover_url"), time.time(),
+            ),
+        )
+
+    # ─── Миграция JSON ───────────────────────────────────────────
+
+    def _read_legacy(self, user_id: int) -> List[Dict]:
+        if self.legacy_dir is None:
+            return []
+        p = self.legacy_dir / f"{int(user_id)}.json"
+        if not p.exists():
+            return []
+        try:
+            data = json.loads(p.read_text("utf-8"))
+            return data if isinstance(data, list) else []
+        except Exception:
+            return []
+
+    def _import_tracks(self, conn: sqlite3.Connection, user_id: int, tracks: List[Dict]) -> int:
+        seen = set()
+        for t in tracks:
+            if not isinstance(t, dict) or not t.get("id") or t["id"] in seen:
+                continue
+            self._insert(conn, user_id, t, len(seen))
+            seen.add(t["id"])
+        conn.execute(
+            "INSERT INTO playlists (user_id, version, count, next_pos) VALUES (?, 1, ?, ?)",
+            (user_id, len(seen), len(seen)),
+        )
+        return len(seen)
+
+    def import_json_dir(self, directory: Path) -> Tuple[int, int]:
+        """Пакетный импорт {user_id}.json. Уже мигрированные пользователи пропускаются.
+        Возвращает (пользователей, треков)."""
+        users = tracks = 0
+        for p in sorted(Path(directory).glob("*.json")):
+            if not p.stem.lstrip("-").isdigit():
+                continue
+            user_id = int(p.stem)
+            try:
+                data = json.loads(p.read_text("utf-8"))
+            except Exception as e:
+                print(f"⚠️  {p.name}: {e}")
+                continue
+            with self._write() as conn:
+                if self._meta(conn, user_id) is not None:
+                    continue
+                tracks += self._import_tracks(conn, user_id, data if isinstance(data, list) else [])
+                users += 1
+        return users, tracks
+
+
+class PlaylistReadCache:
+    """
+    Кеш готовых JSON-ответов GET /api/playlist (bytes) на воркер.
+
+    - write-through: add/remove этого воркера сразу правят запись кеша
+    - инвалидация между воркерами: если data_version не менялся с последней
+      проверки записи — никто другой не писал, отдаём bytes без запросов;
+      иначе сверяем version пользователя (один поиск по первичному ключу)
+    - LRU по числу пользователей
+    - без блокировок: вызывать из одного потока (server_lite — свой executor),
+      тогда и data_version читается с одного и того же соединения
+    """
+
+    def __init__(self, store: PlaylistStore, max_users: int = 2000):
+        self.store = store
+        self.max_users = max_users
+        # user_id → [version, tracks, body, checked_data_version]
+        self._entries: "OrderedDict[int, list]" = OrderedDict()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    @staticmethod
+    def _serialize(tracks: List[Dict], version: int) -> bytes:
+        return json.dumps({"items": tracks, "version": version}, ensure_ascii=False).encode("utf-8")
+
+    def get_json(self, user_id: int) -> bytes:
+        user_id = int(user_id)
+        dv = self.store.data_version()
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            if entry[3] == dv:
+                self.hits += 1
+                self._entries.move_to_end(user_id)
+                return entry[2]
+            if self.store.version(user_id) == entry[0]:
+                self.revalidated += 1
+                entry[3] = dv
+                self._entries.move_to_end(user_id)
+                return entry[2]
+        self.misses += 1
+        tracks, version = self.store.load(user_id)
+        body = self._serialize(tracks, version)
+        self._put(user_id, [version, tracks, body, dv])
+        return body
+
+    def _put(self, user_id: int, entry: list) -> None:
+        self._entries[user_id] = entry
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+
+    def _apply(self, user_id: int, version: int, mutate) -> None:
+        """Применяет изменение к записи, если она ровно на версию позади."""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return
+        if entry[0] != version - 1:
+            del self._entries[user_id]
+            return
+        tracks = mutate(entry[1])
+        entry[0], entry[1], entry[2] = version, tracks, self._serialize(tracks, version)
+
+    # ─── Write-through обёртки над PlaylistStore ─────────────────
+
+    def add(self, user_id: int, track: Dict, limit: int) -> Tuple[str, int, int]:
+        status, count, version = self.store.add(user_id, track, limit)
+        if status == "saved":
+            saved = {k: track.get(k) for k in TRACK_FIELDS}
+            self._apply(int(user_id), version, lambda tracks: tracks + [saved])
+        return status, count, version
+
+    def remove(self, user_id: int, track_id: str) -> Tuple[int, int]:
+        before = self._entries.get(int(user_id))
+        old_version = before[0] if before else None
+        count, version = self.store.remove(user_id, track_id)
+        if version != old_version:
+            self._apply(int(user_id), version, lambda tracks: [t for t in tracks if t["id"] != track_id])
+        return count, version
+
+    def _reload(self, user_id: int) -> None:
+        """После пакетной операции кладём свежий список сразу (write-through)."""
+        dv = self.store.data_version()
+        tracks, version = self.store.load(user_id)
+        self._put(user_id, [version, tracks, self._serialize(tracks, version), dv])
+
+    def batch(self, op: str, user_id: int, *args, **kwargs):
+        """Пакетная операция PlaylistStore (add_many, remove_many, move, reorder, replace)."""
+        if op not in ("add_many", "remove_many", "move", "reorder", "replace"):
+            raise ValueError(f"Unknown batch operation: {op}")
+        result = getattr(self.store, op)(user_id, *args, **kwargs)
+        self._reload(int(user_id))
+        return result
+
+    def invalidate(self, user_id: int) -> None:
+        self._entries.pop(int(user_id), None)
+
+    def stats(self) -> Dict:
+        return {
+            "users": len(self._entries),
+            "max_users": self.max_users,
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    base = Path(__file__).parent / "user_data"
+    parser = argparse.ArgumentParser(description="TGPlay playlist storage")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    mig = sub.add_parser("migrate", help="импорт user_data/*.json в SQLite")
+    mig.add_argument("--dir", type=Path, default=base)
+    mig.add_argument("--db", type=Path, default=base / "playlists.db")
+    args = parser.parse_args()
+
+    if args.cmd == "migrate":
+        store = PlaylistStore(args.db)
+        started = time.time()
+        users, tracks = store.import_json_dir(args.dir)
+        print(f"✅ Imported {users} users, {tracks} tracks in {time.time() - started:.1f}s → {args.db}")
+        sys.exit(0)
@@ -0,0 +1,84 @@
+"""
+Прогрев следующих треков: аудио готово до того, как по нему кликнут.
+
+- schedule(ids): треки встают в очередь прогрева (дубли пропускаются,
+  переполненная очередь отбрасывает лишнее, а не растёт)
+- warm(track_id) (задаёт сервер) кладёт трек туда, откуда его отдаст любой
+  воркер (общий дисковый кеш), и возвращает True, если что-то прогрел;
+  сам Prefetcher ничего не хранит — память воркера не растёт
+- одновременно прогревается не больше concurrency треков
+"""
+from __future__ import annotations
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Iterable, Set
+
+Warm = Callable[[str], Awaitable[bool]]
+
+
+class Prefetcher:
+    def __init__(self, warm: Warm, concurrency: int = 2, max_pending: int = 50):
+        self.warm = warm
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self._pending: Deque[str] = deque()
+        self._queued: Set[str] = set()      # в очереди или греется сейчас
+        self._running = 0
+        self.scheduled = 0
+        self.dropped = 0
+        self.warmed = 0
+        self.skipped = 0                     # уже в кеше / греет другой воркер
+        self.used = 0                        # прогретый трек потом запросили
+        self.failed = 0
+
+    # ─── API ─────────────────────────────────────────────────────
+
+    def schedule(self, track_ids: Iterable[str]) -> int:
+        """Ставит треки в очередь прогрева. Возвращает, сколько реально добавлено."""
+        added = 0
+        for tid in track_ids:
+            if tid in self._queued:
+                continue
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                continue
+            self._pending.append(tid)
+            self._queued.add(tid)
+            added += 1
+        self.scheduled += added
+        self._pump()
+        return added
+
+    # ─── Внутреннее ──────────────────────────────────────────────
+
+    def _pump(self) -> None:
+        while self._pending and self._running < self.concurrency:
+            tid = self._pending.popleft()
+            self._running += 1
+            asyncio.ensure_future(self._run(tid))
+
+    async def _run(self, track_id: str) -> None:
+        try:
+            if await self.warm(track_id):
+                self.warmed += 1
+            else:
+                self.skipped += 1
+        except Exception as e:
+            self.failed += 1
+            print(f"⚠️ prefetch {track_id} failed: {type(e).__name__}: {e}")
+        finally:
+            self._running -= 1
+            self._queued.discard(track_id)
+            self._pump()
+
+    def stats(self) -> Dict:
+        return {
+            "pending": len(self._pending),
+            "running": self._running,
+            "scheduled": self.scheduled,
+            "dropped": self.dropped,
+            "warmed": self.warmed,
+            "skipped": self.skipped,
+            "used": self.used,
+            "failed": self.failed,
+        }
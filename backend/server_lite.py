@@ -1,21 +1,21 @@
 """
-TGPlay Lite API — поиск VK + ffmpeg-стриминг HLS→MP3 + Telegram auth + плейлисты.
+TGPlay Lite API — поиск VK + стриминг HLS→MP3 + Telegram auth + плейлисты.
 Запускай:  python3 server_lite.py
 
 Оптимизации:
 - Единая aiohttp сессия (connection pool)
 - Параллельные VK-запросы через asyncio.gather
 - Быстрый ffmpeg пресет для низкой задержки
-- Кеширование VK audio URL (TTL 10 мин)
+- Кеширование VK audio URL (TTL 25 мин, общий SQLite-кеш для всех воркеров)
 - Потоковая отдача MP3 — клиент играет через 1-2 сек
 - Security headers
 """
 from __future__ import annotations
-import asyncio, hashlib, hmac, json, os, re, shutil, time
+import asyncio, functools, hashlib, hmac, json, os, re, shutil, sqlite3, time, unicodedata
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Optional, List, Dict
-from urllib.parse import parse_qs, unquote
+from typing import AsyncIterator, Optional, List, Dict, Tuple
 from dotenv import load_dotenv
 
 load_dotenv(Path(__file__).parent / ".env")
@@ -36,25 +36,24 @@ if not BOT_TOKEN:
 DATA_DIR = Path(__file__).parent / "user_data"
 DATA_DIR.mkdir(exist_ok=True)
 
-# ─── Кеш VK audio URL (track_id → (url, timestamp)) ─────────────
-_url_cache: Dict[str, tuple] = {}
+# ─── Кеш VK audio URL (track_id → url), общий для всех воркеров ─
+from shared_cache import MemoryCache, SQLiteCache, TieredCache, make_cache, run_db
+
 _URL_TTL = 1500  # 25 минут
+CACHE_DB = Path(os.getenv("CACHE_DB", str(Path(__file__).parent / "lite_cache.db")))
+_url_cache = make_cache(
+    "audio_urls",
+    ttl=_URL_TTL,
+    max_entries=int(os.getenv("URL_CACHE_MAX", "5000")),
+    path=CACHE_DB,
+)
 
-def _cache_get(track_id: str) -> Optional[str]:
-    entry = _url_cache.get(track_id)
-    if entry and time.time() - entry[1] < _URL_TTL:
-        return entry[0]
-    _url_cache.pop(track_id, None)
-    return None
-
-def _cache_set(track_id: str, url: str):
-    _url_cache[track_id] = (url, time.time())
-    # Очистка старых записей (макс 500)
-    if len(_url_cache) > 500:
-        cutoff = time.time() - _URL_TTL
-        to_del = [k for k, v in _url_cache.items() if v[1] < cutoff]
-        for k in to_del:
-            del _url_cache[k]
+# SQLite — в пуле потоков (run_db): ожидание блокировки другого воркера не стопорит loop
+async def _cache_get(track_id: str) -> Optional[str]:
+    return await _url_cache.aget(track_id)
+
+async def _cache_set(track_id: str, url: str):
+    await _url_cache.aset(track_id, url)
 
 # ─── Транслитерация EN↔RU для fallback-поиска ───────────────────
 _EN2RU = {
@@ -80,6 +79,32 @@ def _has_cyrillic(text: str) -> bool:
 def _has_latin(text: str) -> bool:
     return bool(re.search(r'[a-zA-Z]', text))
 
+# Визуально одинаковые буквы: «мaкс» с латинской a и «макс» — один запрос
+_LAT2CYR_LOOKALIKE = str.maketrans("aceopxyk", "асеорхук")
+_CYR2LAT_LOOKALIKE = str.maketrans("асеорхук", "aceopxyk")
+
+def _normalize_query(text: str) -> str:
+    """
+    Ключ кеша поиска: регистр, пробелы, ё→е и смешанная раскладка в слове
+    (латинские двойники кириллических букв приводятся к основному алфавиту слова).
+    """
+    text = unicodedata.normalize("NFKC", text).casefold().replace("ё", "е")
+    words = []
+    for w in text.split():
+        if _has_cyrillic(w) and _has_latin(w):
+            as_cyr = w.translate(_LAT2CYR_LOOKALIKE)
+            as_lat = w.translate(_CYR2LAT_LOOKALIKE)
+            if not _has_latin(as_cyr):
+                w = as_cyr
+            elif not _has_cyrillic(as_lat):
+                w = as_lat
+            elif len(re.findall(r'[а-я]', w)) >= len(re.findall(r'[a-z]', w)):
+                w = as_cyr
+            else:
+                w = as_lat
+        words.append(w)
+    return " ".join(words)
+
 # Формат VK track_id: owner_id (опционально минус) + _ + id (только цифры)
 TRACK_ID_RE = re.compile(r"^-?\d+_\d+$")
 
@@ -93,16 +118,33 @@ if not FFMPEG:
     exit(1)
 
 import aiohttp
-from fastapi import FastAPI, Query, Path as Param, Header, HTTPException, Request, BackgroundTasks
+import anyio
+from fastapi import FastAPI, Query, Path as Param, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, Response, RedirectResponse
+from fastapi.responses import FileResponse, StreamingResponse, Response, RedirectResponse
 
 # ─── Единая HTTP-сессия ──────────────────────────────────────────
 _http_session: Optional[aiohttp.ClientSession] = None
 
 @asynccontextmanager
 async def _lifespan(app: FastAPI):
+    _send_queue.start()
+    webhook_task = None
+    if BOT_MODE == "webhook":
+        # Ссылка на задачу: иначе её может собрать GC, а ошибка потеряется
+        webhook_task = asyncio.create_task(_setup_webhook())
     yield
+    if webhook_task is not None:
+        webhook_task.cancel()
+        try:
+            await webhook_task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"⚠️ Webhook setup failed: {type(e).__name__}: {e}")
+    await _send_queue.stop()
+    if BOT_MODE == "webhook":
+        tg_bot._release_lock()
     global _http_session
     if _http_session and not _http_session.closed:
         await _http_session.close()
@@ -125,6 +167,17 @@ async def get_session() -> aiohttp.ClientSession:
     return _http_session
 
 
+# ─── Telegram Bot API: общий клиент с rate limit и обработкой 429 ─
+from tg_client import FileForm, TelegramClient
+
+_tg = TelegramClient(
+    BOT_TOKEN,
+    get_session,
+    global_rate=float(os.getenv("TG_GLOBAL_RATE", "30")),
+    chat_rate=float(os.getenv("TG_CHAT_RATE", "1")),
+)
+
+
 # ─── CORS ────────────────────────────────────────────────────────
 app.add_middleware(
     CORSMiddleware,
@@ -151,39 +204,15 @@ app.add_middleware(SecurityHeadersMiddleware)
 
 # ─── Telegram WebApp Auth ────────────────────────────────────────
 
-def validate_init_data(init_data: str, bot_token: str) -> Optional[Dict]:
-    try:
-        parsed = parse_qs(init_data, keep_blank_values=True)
-        check_hash = parsed.get("hash", [None])[0]
-        if not check_hash:
-            return None
-
-        pairs = []
-        for key, values in parsed.items():
-            if key == "hash":
-                continue
-            pairs.append(f"{key}={values[0]}")
-        pairs.sort()
-        data_check_string = "\n".join(pairs)
-
-        secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
-        calculated = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
-
-        if not hmac.compare_digest(calculated, check_hash):
-            return None
-
-        auth_date = int(parsed.get("auth_date", ["0"])[0])
-        if time.time() - auth_date > 86400:
-            return None
-
-        user_raw = parsed.get("user", [None])[0]
-        if not user_raw:
-            return None
-        user = json.loads(unquote(user_raw))
-        return user
-    except Exception as e:
-        print(f"⚠️ initData validation error: {e}")
-        return None
+# Проверка initData вынесена в tg_auth.py (общая с app/): секрет считается
+# один раз, проверенные initData кешируются до истечения auth_date
+from tg_auth import InitDataValidator
+
+_auth = InitDataValidator(
+    BOT_TOKEN,
+    cache_size=int(os.getenv("AUTH_CACHE_MAX", "10000")),
+    compat=os.getenv("TG_AUTH_COMPAT", "0") == "1",
+)
 
 
 def get_user_from_header(authorization: Optional[str]) -> Dict:
@@ -192,7 +221,7 @@ def get_user_from_header(authorization: Optional[str]) -> Dict:
     parts = authorization.split(" ", 1)
     if len(parts) != 2 or parts[0].lower() != "tma":
         raise HTTPException(401, "Invalid Authorization format")
-    user = validate_init_data(parts[1], BOT_TOKEN)
+    user = _auth.validate(parts[1])
     if not user:
         raise HTTPException(401, "Invalid or expired Telegram initData")
     return user
@@ -200,26 +229,33 @@ def get_user_from_header(authorization: Optional[str]) -> Dict:
 
 # ─── User playlist storage ──────────────────────────────────────
 
-def _playlist_path(user_id: int) -> Path:
-    # Защита от path traversal
-    safe_id = int(user_id)
-    return DATA_DIR / f"{safe_id}.json"
+# SQLite (WAL) с индексом (user_id, track_id); старые user_data/{id}.json
+# подхватываются при первом обращении или: python3 playlist_store.py migrate
+from playlist_store import LimitExceeded, PlaylistReadCache, PlaylistStore, VersionConflict
 
-def load_playlist(user_id: int) -> List[Dict]:
-    p = _playlist_path(user_id)
-    if not p.exists():
-        return []
-    try:
-        return json.loads(p.read_text("utf-8"))
-    except Exception:
-        return []
+_PLAYLIST_LIMIT = 500
+_playlist_store = PlaylistStore(DATA_DIR / "playlists.db", legacy_dir=DATA_DIR)
+# Горячие чтения — готовые bytes из памяти воркера (write-through + data_version)
+_playlists = PlaylistReadCache(
+    _playlist_store, max_users=int(os.getenv("PLAYLIST_CACHE_USERS", "2000"))
+)
+# Все обращения к плейлистам — в одном своём потоке, не в event loop:
+# одно соединение SQLite (data_version считается на соединение) и
+# PlaylistReadCache без блокировок
+_playlist_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="playlists")
 
-def save_playlist(user_id: int, tracks: List[Dict]):
-    p = _playlist_path(user_id)
-    p.write_text(json.dumps(tracks, ensure_ascii=False, indent=2), "utf-8")
+
+async def _pl(fn, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(
+        _playlist_executor, functools.partial(fn, *args, **kwargs)
+    )
+
+
+async def load_playlist(user_id: int) -> List[Dict]:
+    return (await _pl(_playlist_store.load, user_id))[0]
 
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 class TrackPayload(BaseModel):
     id: str
@@ -290,7 +326,45 @@ def _parse_tracks(items: List[Dict]) -> List[Dict]:
     return tracks
 
 
+# ─── Кеш результатов поиска (stale-while-revalidate) ─────────────
+# Свежие записи отдаём как есть, устаревшие (до _SEARCH_MAX_STALE) — сразу,
+# с фоновым обновлением. L1 — в процессе, L2 — общий SQLite.
+_SEARCH_FRESH = int(os.getenv("SEARCH_CACHE_FRESH", "300"))
+_SEARCH_MAX_STALE = int(os.getenv("SEARCH_CACHE_MAX_STALE", "3600"))
+_search_l2 = make_cache(
+    "search_results",
+    ttl=_SEARCH_MAX_STALE,
+    max_entries=int(os.getenv("SEARCH_CACHE_MAX", "2000")),
+    path=CACHE_DB,
+)
+_search_cache = TieredCache(
+    MemoryCache(ttl=_SEARCH_MAX_STALE, max_entries=int(os.getenv("SEARCH_CACHE_L1", "200"))),
+    _search_l2 if isinstance(_search_l2, SQLiteCache) else None,
+)
+_search_stats = {"fresh_hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "refresh_skipped": 0}
+# Ключи, для которых фоновое обновление уже идёт: поток stale-хитов
+# не должен плодить по задаче на каждый запрос
+_search_refreshing: set = set()
+
+
+# ─── Single-flight: одинаковые конкурентные запросы → один вызов VK ─
+from singleflight import SingleFlight
+from vk_batch import GetByIdBatcher
+from job_queue import JobQueue, QueueFull, RateLimited, RateLimiter
+
+_sf_url = SingleFlight("audio_url")
+_sf_info = SingleFlight("track_info")
+_sf_search = SingleFlight("search")
+_sf_mp3 = SingleFlight("mp3_file")
+
+
 async def vk_audio_search(query: str, limit: int = 50) -> List[Dict]:
+    """Поиск со склейкой одинаковых конкурентных запросов."""
+    key = (_normalize_query(query), limit)
+    return await _sf_search.do(key, lambda: _vk_audio_search(query, limit))
+
+
+async def _vk_audio_search(query: str, limit: int = 50) -> List[Dict]:
     """Оптимизированный поиск: параллельные запросы через asyncio.gather."""
     # Запускаем 2 запроса параллельно (вместо 3 последовательных)
     results = await asyncio.gather(
@@ -324,14 +398,18 @@ async def vk_audio_search(query: str, limit: int = 50) -> List[Dict]:
 
 async def vk_get_audio_url(track_id: str) -> Optional[str]:
     # Проверяем кеш
-    cached = _cache_get(track_id)
+    cached = await _cache_get(track_id)
     if cached:
         return cached
+    return await _sf_url.do(track_id, lambda: _vk_fetch_audio_url(track_id))
 
+
+async def _vk_get_by_id_many(track_ids: List[str]) -> Dict[str, Dict]:
+    """Один audio.getById на пачку id → {track_id: item}."""
     params = {
         "access_token": VK_TOKEN,
         "v": "5.131",
-        "audios": track_id,
+        "audios": ",".join(track_ids),
     }
     headers = {"User-Agent": VK_USER_AGENT}
     session = await get_session()
@@ -343,29 +421,64 @@ async def vk_get_audio_url(track_id: str) -> Optional[str]:
             data = await resp.json()
     except Exception as e:
         print(f"⚠️ VK getById error: {e}")
-        return None
+        return {}
 
     if "error" in data:
         print(f"❌ VK getById error: {data['error']}")
+        return {}
+    return {
+        f"{item['owner_id']}_{item['id']}": item
+        for item in data.get("response", [])
+        if "owner_id" in item and "id" in item
+    }
+
+
+_getbyid = GetByIdBatcher(
+    _vk_get_by_id_many,
+    window=int(os.getenv("VK_BATCH_WINDOW_MS", "5")) / 1000,
+    max_batch=int(os.getenv("VK_BATCH_MAX", "50")),
+)
+
+
+async def _vk_fetch_audio_url(track_id: str) -> Optional[str]:
+    item = await _getbyid.get(track_id)
+    if not item:
         return None
-    items = data.get("response", [])
-    if not items:
-        return None
-    url = items[0].get("url")
+    url = item.get("url")
     if url:
-        _cache_set(track_id, url)
+        await _cache_set(track_id, url)
     return url
 
 
+# ─── Пул ffmpeg: лимит процессов на узел, стриминг важнее фона ─────
+from ffmpeg_pool import BACKGROUND, INTERACTIVE, FfmpegPool, Saturated
+
+# FFMPEG_MAX_PROCS — на весь узел: слоты-файлы под flock общие для воркеров
+# (без fcntl лимит делится на WORKERS, как в Dockerfile)
+_ffmpeg = FfmpegPool(
+    max_procs=int(os.getenv("FFMPEG_MAX_PROCS", str(os.cpu_count() or 2))),
+    slots_dir=Path(os.getenv("FFMPEG_SLOTS_DIR", str(CACHE_DB.parent / ".ffmpeg_slots"))),
+    workers=int(os.getenv("WORKERS", "4")),
+    max_queue=int(os.getenv("FFMPEG_MAX_QUEUE", "4")),
+    timeouts={
+        INTERACTIVE: float(os.getenv("FFMPEG_STREAM_WAIT", "10")),
+        BACKGROUND: float(os.getenv("FFMPEG_BACKGROUND_WAIT", "300")),
+    },
+)
+
+
 # ─── ffmpeg streaming (оптимизированный) ─────────────────────────
 
-async def ffmpeg_stream_mp3(source_url: str):
+async def ffmpeg_stream_mp3(source_url: str, start: float = 0.0,
+                            priority: int = INTERACTIVE, wait: Optional[float] = None):
     """
     Быстрый ffmpeg стриминг с минимальной задержкой.
     - fflags +nobuffer: без буферизации входа
     - analyzeduration/probesize: быстрый старт
     - q:a 5: VBR ~130kbps (быстрее чем CBR 192k, хорошее качество)
     - write_xing 0: не ждём конца для записи заголовка
+    - start: -ss перед -i — быстрый seek по входу, без декодирования начала
+    - priority/wait: слот пула (прогрев — BACKGROUND, без ожидания)
     """
     cmd = [
         FFMPEG,
@@ -374,6 +487,7 @@ async def ffmpeg_stream_mp3(source_url: str):
         "-analyzeduration", "500000",   # 0.5 сек анализа вместо дефолтных 5
         "-probesize", "500000",         # 500KB пробы вместо дефолтных 5MB
         "-user_agent", VK_USER_AGENT,
+        *(["-ss", f"{start:.2f}"] if start > 0 else []),
         "-i", source_url,
         "-vn",
         "-acodec", "libmp3lame",
@@ -384,25 +498,184 @@ async def ffmpeg_stream_mp3(source_url: str):
         "pipe:1",
     ]
 
-    proc = await asyncio.create_subprocess_exec(
-        *cmd,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
+    async with _ffmpeg.slot(priority, timeout=wait):
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
 
+        try:
+            while True:
+                chunk = await proc.stdout.read(16 * 1024)  # 16KB чанки для быстрого старта
+                if not chunk:
+                    break
+                yield chunk
+            await proc.wait()
+            if proc.returncode != 0:
+                raise RuntimeError(f"ffmpeg exited with {proc.returncode}")
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+            await proc.wait()
+            stderr_data = await proc.stderr.read()
+            if proc.returncode != 0 and stderr_data:
+                print(f"⚠️  ffmpeg stderr: {stderr_data.decode(errors='replace')[:300]}")
+
+
+# ─── HLS без ffmpeg: сегменты качаем сами, MP3 из TS отдаём как есть ─
+from hls_proxy import HlsProxy, HlsUnsupported, find_mp3_sync
+
+_hls = HlsProxy(get_session, VK_USER_AGENT, prefetch=int(os.getenv("HLS_PREFETCH", "4")))
+HLS_PROXY = os.getenv("HLS_PROXY", "1") == "1"
+
+
+async def _open_hls(url: str, start: float = 0.0):
+    """Поток MP3 из HLS без перекодирования или None (тогда — ffmpeg)."""
+    if not HLS_PROXY:
+        return None
     try:
+        return await _hls.open(url, start)
+    except HlsUnsupported as e:
+        print(f"🔧 HLS → ffmpeg: {e}")
+        return None
+
+
+# ─── Один поток на трек для всех слушателей + tee в дисковый кеш ─
+from transcode_hub import TranscodeHub
+
+_hub = TranscodeHub(
+    max_buffer=int(os.getenv("TRANSCODE_BUFFER_MB", "32")) * 1024 * 1024,
+    idle_timeout=float(os.getenv("TRANSCODE_IDLE_TIMEOUT", "15")),
+)
+
+
+async def _open_mp3_source(url: str, start: float = 0.0):
+    """
+    Источник MP3 для ответа клиенту. Выбор HLS/ffmpeg делается до ответа:
+    если нужен ffmpeg, а пул занят — Saturated (503), а не пустой поток.
+    """
+    hls = await _open_hls(url, start)
+    if hls is None:
+        _ffmpeg.admit(INTERACTIVE)
+    return _mp3_source(url, start, hls)
+
+
+async def _mp3_source(url: str, start: float = 0.0, hls=None):
+    """MP3 из HLS: сегменты без перекодирования, иначе ffmpeg."""
+    if hls is None:
+        async for chunk in ffmpeg_stream_mp3(url, start):
+            yield chunk
+        return
+    async for chunk in hls.iter_mp3():
+        yield chunk
+    if not hls.complete:
+        raise RuntimeError("HLS stream aborted")
+
+
+class _CacheSink:
+    """Пишет поток во временный файл кеша, по успешному окончанию — commit."""
+
+    def __init__(self, track_id: str, cache: Optional["DiskCache"] = None):
+        self.cache = cache or _mp3_cache
+        self.key = _cache_mp3_key(track_id)
+        self.tmp = self.cache.temp_path(self.key)
+        self.file = open(self.tmp, "wb")
+
+    def write(self, chunk: bytes) -> None:
+        self.file.write(chunk)
+
+    async def finish(self, ok: bool) -> None:
+        self.file.close()
+        try:
+            if ok:
+                await self.cache.acommit(self.key, self.tmp)
+        finally:
+            self.tmp.unlink(missing_ok=True)
+
+
+async def _stream_file_from(path: Path, offset: int):
+    """Файл из кеша с байта offset, выровненного на начало MP3-кадра.
+    Чтение — в потоках anyio: медленный диск не останавливает event loop."""
+    async with await anyio.open_file(path, "rb") as f:
+        await f.seek(offset)
+        head = await f.read(64 * 1024)
+        yield head[find_mp3_sync(head):] if offset else head
         while True:
-            chunk = await proc.stdout.read(16 * 1024)  # 16KB чанки для быстрого старта
+            chunk = await f.read(64 * 1024)
             if not chunk:
                 break
             yield chunk
+
+
+# ─── Прогрев вероятных следующих треков ──────────────────────────
+# Трек целиком — в дисковый кеш прогрева (_prefetch_cache: общий для воркеров,
+# бюджет PREFETCH_MAX_MB на узел). Источник — тот же хаб, что у слушателей:
+# один прогон HLS-прокси или ffmpeg, клик во время прогрева подключается к нему.
+# ffmpeg — только если в пуле есть свободный слот (BACKGROUND, без ожидания).
+# Прямые MP3 клиент берёт с VK сам — для них прогрев = resolve URL.
+from prefetch import Prefetcher
+
+_PREFETCH_SEARCH_TOP = int(os.getenv("PREFETCH_SEARCH_TOP", "2"))
+_PREFETCH_PLAYLIST_NEXT = int(os.getenv("PREFETCH_PLAYLIST_NEXT", "2"))
+_PREFETCH_ARTIST = int(os.getenv("PREFETCH_ARTIST", "2"))
+# Захваты прогрева (claim:{track}) и лимит POST /api/music/prefetch — общие для воркеров
+_prefetch_store = make_cache("prefetch", ttl=600, max_entries=20000, path=CACHE_DB)
+_prefetch_limiter = RateLimiter(
+    _prefetch_store, limit=int(os.getenv("PREFETCH_RATE_PER_MIN", "30")), window=60
+)
+
+
+async def _warm_track(track_id: str) -> bool:
+    url = await vk_get_audio_url(track_id)
+    if not url or not _is_hls_url(url):
+        return False
+    if _hub.active(track_id) or await _has_mp3(track_id):
+        return False
+    # Один прогрев трека на узел, даже если его запланировали несколько воркеров
+    claim = f"claim:{track_id}"
+    if not await _prefetch_store.aadd(claim, str(os.getpid())):
+        return False
+    try:
+        hls = await _open_hls(url)
+        if hls is not None:
+            source = _mp3_source(url, hls=hls)
+        else:
+            source = ffmpeg_stream_mp3(url, priority=BACKGROUND, wait=0)
+        async for _ in _hub.stream(
+            track_id, lambda: source, lambda: _CacheSink(track_id, _prefetch_cache)
+        ):
+            pass
+        return True
+    except Saturated:
+        return False
     finally:
-        if proc.returncode is None:
-            proc.kill()
-        await proc.wait()
-        stderr_data = await proc.stderr.read()
-        if proc.returncode != 0 and stderr_data:
-            print(f"⚠️  ffmpeg stderr: {stderr_data.decode(errors='replace')[:300]}")
+        await _prefetch_store.adelete(claim)
+
+
+_prefetch = Prefetcher(
+    _warm_track,
+    concurrency=int(os.getenv("PREFETCH_CONCURRENCY", "2")),
+)
+
+
+async def _artist_neighbors(track_id: str, limit: int) -> List[str]:
+    """Другие треки исполнителя текущего трека (через кеш поиска)."""
+    artist = (await _fetch_track_info(track_id)).get("artist")
+    if not artist:
+        return []
+    key = f"{_normalize_query(artist)}|20"
+    cached = await _search_cache.aget_with_age(key)
+    body = cached[0] if cached else await _search_refresh(key, artist, 20)
+    items = json.loads(body).get("items", [])
+    return [t["id"] for t in items if t["id"] != track_id][:limit]
+
+
+async def _prefetch_artist(track_id: str):
+    try:
+        _prefetch.schedule(await _artist_neighbors(track_id, _PREFETCH_ARTIST))
+    except Exception as e:
+        print(f"⚠️ prefetch neighbors {track_id}: {e}")
 
 
 # ─── Routes ──────────────────────────────────────────────────────
@@ -419,23 +692,73 @@ async def search(
 ):
     if not q.strip():
         raise HTTPException(400, "Empty query")
-    tracks = await vk_audio_search(q.strip(), limit=limit)
+    query = q.strip()
+    key = f"{_normalize_query(query)}|{limit}"
 
-    # Pre-resolve audio URLs для первых 5 треков (в фоне, кешируем)
-    # Клиент получит их мгновенно при клике
-    if tracks:
-        top_ids = [t["id"] for t in tracks[:5]]
-        asyncio.ensure_future(_batch_presolve(top_ids))
+    cached = await _search_cache.aget_with_age(key)
+    if cached:
+        body, age = cached
+        if age < _SEARCH_FRESH:
+            _search_stats["fresh_hits"] += 1
+        else:
+            # stale-while-revalidate: отдаём сразу, обновляем в фоне
+            _search_stats["stale_hits"] += 1
+            _schedule_search_refresh(key, query, limit)
+    else:
+        _search_stats["misses"] += 1
+        body = await _search_refresh(key, query, limit)
 
     return Response(
-        content=json.dumps({"items": tracks}, ensure_ascii=False),
+        content=body,
         media_type="application/json",
         headers={"Cache-Control": "public, max-age=60"},
     )
 
 
+def _schedule_search_refresh(key: str, query: str, limit: int):
+    """Фоновое обновление ключа — не больше одного одновременно на воркер."""
+    if key in _search_refreshing:
+        _search_stats["refresh_skipped"] += 1
+        return
+    _search_refreshing.add(key)
+
+    async def run():
+        try:
+            await _search_refresh(key, query, limit)
+        except Exception as e:
+            print(f"⚠️ search refresh {query!r}: {e}")
+        finally:
+            _search_refreshing.discard(key)
+
+    asyncio.ensure_future(run())
+
+
+async def _search_refresh(key: str, query: str, limit: int) -> str:
+    """Запрос в VK + запись в кеш поиска. Возвращает готовый JSON-ответ."""
+    # Другой воркер мог уже обновить общий кеш
+    if _search_cache.l2 is not None:
+        shared = await _search_cache.l2.aget_with_age(key)
+        if shared and shared[1] < _SEARCH_FRESH:
+            _search_cache.l1.set(key, shared[0], created=time.time() - shared[1])
+            return shared[0]
+
+    _search_stats["refreshes"] += 1
+    tracks = await vk_audio_search(query, limit=limit)
+    body = json.dumps({"items": tracks}, ensure_ascii=False)
+    # Пустой ответ обычно = ошибка VK, не кешируем
+    if tracks:
+        await _search_cache.aset(key, body)
+        # Pre-resolve audio URLs для первых 5 треков (в фоне, кешируем)
+        # Клиент получит их мгновенно при клике
+        top_ids = [t["id"] for t in tracks[:5]]
+        asyncio.ensure_future(_batch_presolve(top_ids))
+        _prefetch.schedule(top_ids[:_PREFETCH_SEARCH_TOP])
+    return body
+
+
 async def _batch_presolve(track_ids: List[str]):
-    """Фоновая предзагрузка audio URLs в кеш для быстрого resolve."""
+    """Фоновая предзагрузка audio URLs в кеш для быстрого resolve.
+    Некешированные id уходят в VK одним батчем getById."""
     try:
         await asyncio.gather(
             *[vk_get_audio_url(tid) for tid in track_ids],
@@ -461,8 +784,16 @@ async def resolve_url(track_id: str = Param(...)):
 
 
 @app.get("/api/music/download/{track_id}")
-async def download(track_id: str = Param(...)):
-    """302 redirect на VK CDN для прямых MP3. ffmpeg только для HLS."""
+async def download(
+    track_id: str = Param(...),
+    t: float = Query(0, ge=0, description="Start position, seconds"),
+):
+    """
+    302 redirect на VK CDN для прямых MP3 (Range отдаёт сам VK).
+    HLS: из дискового кеша — файл с Range; иначе прокси сегментов (ffmpeg — запасной).
+    t — seek без перекачки с начала: смещение в кеше, сегмент HLS или ffmpeg -ss.
+    Клиент шлёт t, когда поток не поддерживает Range (трек ещё не в кеше).
+    """
     if not _valid_track_id(track_id):
         raise HTTPException(400, "Invalid track ID format")
 
@@ -474,16 +805,98 @@ async def download(track_id: str = Param(...)):
     if not _is_hls_url(url):
         return RedirectResponse(url, status_code=302)
 
-    # HLS → ffmpeg transcode (единственный случай когда нужен прокси)
-    return StreamingResponse(
-        ffmpeg_stream_mp3(url),
-        media_type="audio/mpeg",
-        headers={
-            "Cache-Control": "public, max-age=300",
-            "Accept-Ranges": "none",
-            "Transfer-Encoding": "chunked",
-        },
-    )
+    stream_headers = {
+        "Cache-Control": "public, max-age=300",
+        "Accept-Ranges": "none",
+        "Transfer-Encoding": "chunked",
+    }
+
+    # Уже в кеше: Range/Content-Length отдаёт FileResponse — плеер сам
+    # делает seek запросом диапазона, без CPU на сервере
+    cached = await _cached_mp3(track_id)
+    if cached and t == 0:
+        return FileResponse(
+            cached, media_type="audio/mpeg", headers={"Cache-Control": "public, max-age=300"}
+        )
+    if cached:
+        duration = (await _fetch_track_info(track_id)).get("duration") or 0
+        if duration > 0:
+            # Смещение пропорционально t — приблизительно: кеш пишется с
+            # -q:a (VBR), байты не линейны по времени, ошибка — в пределах
+            # разброса битрейта. Точный seek по кешу — Range-запросом (t=0)
+            size = (await anyio.Path(cached).stat()).st_size
+            offset = int(size * min(t / duration, 1.0))
+            return StreamingResponse(
+                _stream_file_from(cached, offset), media_type="audio/mpeg", headers=stream_headers
+            )
+
+    try:
+        if t > 0:
+            # Seek — отдельный поток с позиции t, мимо общего потока и кеша
+            body = await _open_mp3_source(url, start=t)
+        elif _hub.active(track_id):
+            body = _hub.stream(track_id, None)
+        else:
+            # Один поток на трек, сколько бы ни было слушателей, с записью в дисковый кеш.
+            # Если пока открывали источник, поток уже запустил другой запрос, —
+            # подключаемся к нему, а наш (ещё не начатый) источник выбрасываем.
+            # Промах по кешу уже проверен выше (alookup)
+            source = await _open_mp3_source(url)
+            body = _hub.stream(track_id, lambda: source, lambda: _CacheSink(track_id))
+        body = await _primed(body)
+    except Saturated as e:
+        raise HTTPException(503, "Transcoder is busy", headers={"Retry-After": str(int(e.retry_after))})
+    except Exception as e:
+        print(f"⚠️ stream {track_id} failed before first byte: {type(e).__name__}: {e}")
+        raise HTTPException(502, "Audio stream failed")
+    return StreamingResponse(body, media_type="audio/mpeg", headers=stream_headers)
+
+
+async def _primed(body: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Первый чанк — до ответа: слот ffmpeg берётся внутри генератора, и
+    таймаут ожидания (Saturated) после отправки заголовков дал бы пустой 200.
+    Так клиент получает 503 (или 502, если источник упал сразу).
+    """
+    try:
+        first = await body.__anext__()
+    except StopAsyncIteration:
+        raise RuntimeError("empty stream")
+
+    async def rest():
+        try:
+            yield first
+            async for chunk in body:
+                yield chunk
+        finally:
+            # Обрыв клиента: слушатель хаба / ffmpeg освобождаются сразу, не при GC
+            await body.aclose()
+
+    return rest()
+
+
+@app.post("/api/music/prefetch/{track_id}", status_code=202)
+async def prefetch_next(track_id: str = Param(...), authorization: Optional[str] = Header(None)):
+    """
+    Играет track_id — прогреваем вероятные следующие: следующие в плейлисте
+    пользователя и другие треки того же исполнителя. Прогрев тратит ffmpeg и
+    диск узла, поэтому — только с авторизацией и с лимитом на пользователя.
+    """
+    user = get_user_from_header(authorization)
+    if not _valid_track_id(track_id):
+        raise HTTPException(400, "Invalid track ID format")
+    try:
+        await _prefetch_limiter.check(user["id"])
+    except RateLimited as e:
+        raise HTTPException(429, "Too many requests", headers={"Retry-After": str(int(e.retry_after) + 1)})
+    scheduled = 0
+    ids = [t["id"] for t in await load_playlist(user["id"])]
+    if track_id in ids:
+        i = ids.index(track_id)
+        scheduled = _prefetch.schedule(ids[i + 1:i + 1 + _PREFETCH_PLAYLIST_NEXT])
+    if _PREFETCH_ARTIST > 0:
+        asyncio.ensure_future(_prefetch_artist(track_id))
+    return {"scheduled": scheduled}
 
 
 # ─── Auth route ──────────────────────────────────────────────────
@@ -494,7 +907,7 @@ async def login(request: Request):
     init_data = body.get("initData", "")
     if not init_data:
         raise HTTPException(400, "Missing initData")
-    user = validate_init_data(init_data, BOT_TOKEN)
+    user = _auth.validate(init_data)
     if not user:
         raise HTTPException(401, "Invalid or expired Telegram initData")
     # Не возвращаем лишние данные — только id, first_name, username
@@ -511,29 +924,27 @@ async def login(request: Request):
 @app.get("/api/playlist")
 async def get_playlist(authorization: Optional[str] = Header(None)):
     user = get_user_from_header(authorization)
-    tracks = load_playlist(user["id"])
-    return {"items": tracks}
+    return Response(content=await _pl(_playlists.get_json, user["id"]), media_type="application/json")
 
 
-@app.post("/api/playlist")
-async def add_to_playlist(track: TrackPayload, authorization: Optional[str] = Header(None)):
-    user = get_user_from_header(authorization)
-    tracks = load_playlist(user["id"])
-    if len(tracks) >= 500:
-        raise HTTPException(400, "Playlist limit reached (500)")
-    if any(t["id"] == track.id for t in tracks):
-        return {"status": "already_exists", "count": len(tracks)}
-    # Санитизация
-    safe_track = {
+def _sanitize_track(track: TrackPayload) -> Dict:
+    return {
         "id": track.id[:50],
         "title": track.title[:200],
         "artist": track.artist[:200],
         "duration": min(max(track.duration, 0), 36000),
         "cover_url": (track.cover_url or "")[:500] or None,
     }
-    tracks.append(safe_track)
-    save_playlist(user["id"], tracks)
-    return {"status": "saved", "count": len(tracks)}
+
+
+@app.post("/api/playlist")
+async def add_to_playlist(track: TrackPayload, authorization: Optional[str] = Header(None)):
+    user = get_user_from_header(authorization)
+    safe_track = _sanitize_track(track)
+    status, count, version = await _pl(_playlists.add, user["id"], safe_track, limit=_PLAYLIST_LIMIT)
+    if status == "limit_reached":
+        raise HTTPException(400, f"Playlist limit reached ({_PLAYLIST_LIMIT})")
+    return {"status": status, "count": count, "version": version}
 
 
 @app.delete("/api/playlist/{track_id}")
@@ -541,50 +952,176 @@ async def remove_from_playlist(track_id: str, authorization: Optional[str] = Hea
     if not _valid_track_id(track_id):
         raise HTTPException(400, "Invalid track ID format")
     user = get_user_from_header(authorization)
-    tracks = load_playlist(user["id"])
-    tracks = [t for t in tracks if t["id"] != track_id]
-    save_playlist(user["id"], tracks)
-    return {"status": "removed", "count": len(tracks)}
+    count, version = await _pl(_playlists.remove, user["id"], track_id)
+    return {"status": "removed", "count": count, "version": version}
+
+
+# ─── Playlist batch routes ───────────────────────────────────────
+# Каждая операция — одна транзакция и одна новая version. if_version —
+# оптимистическая блокировка: при несовпадении 409 с текущей версией.
+
+class PlaylistBatchAdd(BaseModel):
+    tracks: List[TrackPayload] = Field(..., max_length=_PLAYLIST_LIMIT)
+    if_version: Optional[int] = None
+
+class PlaylistBatchRemove(BaseModel):
+    ids: List[str] = Field(..., max_length=_PLAYLIST_LIMIT)
+    if_version: Optional[int] = None
+
+class PlaylistMove(BaseModel):
+    track_id: str
+    to_index: int = Field(..., ge=0)
+    if_version: Optional[int] = None
+
+class PlaylistReorder(BaseModel):
+    ids: List[str] = Field(..., max_length=_PLAYLIST_LIMIT)
+    if_version: Optional[int] = None
+
+class PlaylistReplace(BaseModel):
+    tracks: List[TrackPayload] = Field(..., max_length=_PLAYLIST_LIMIT)
+    if_version: Optional[int] = None
+
+
+def _check_track_ids(ids: List[str]):
+    bad = [tid for tid in ids if not _valid_track_id(tid)]
+    if bad:
+        raise HTTPException(400, f"Invalid track ID format: {bad[0][:50]}")
+
+
+async def _playlist_batch(op: str, user_id: int, *args, **kwargs):
+    try:
+        return await _pl(_playlists.batch, op, user_id, *args, **kwargs)
+    except VersionConflict as e:
+        raise HTTPException(409, {"error": "version_conflict", "version": e.current})
+    except LimitExceeded as e:
+        raise HTTPException(400, str(e))
+
+
+@app.post("/api/playlist/batch")
+async def add_many_to_playlist(body: PlaylistBatchAdd, authorization: Optional[str] = Header(None)):
+    user = get_user_from_header(authorization)
+    _check_track_ids([t.id for t in body.tracks])
+    tracks = [_sanitize_track(t) for t in body.tracks]
+    added, count, version = await _playlist_batch(
+        "add_many", user["id"], tracks, _PLAYLIST_LIMIT, if_version=body.if_version
+    )
+    return {"status": "saved", "added": added, "count": count, "version": version}
+
+
+@app.post("/api/playlist/batch-remove")
+async def remove_many_from_playlist(body: PlaylistBatchRemove, authorization: Optional[str] = Header(None)):
+    user = get_user_from_header(authorization)
+    removed, count, version = await _playlist_batch(
+        "remove_many", user["id"], body.ids, if_version=body.if_version
+    )
+    return {"status": "removed", "removed": removed, "count": count, "version": version}
+
+
+@app.post("/api/playlist/move")
+async def move_in_playlist(body: PlaylistMove, authorization: Optional[str] = Header(None)):
+    user = get_user_from_header(authorization)
+    try:
+        count, version = await _playlist_batch(
+            "move", user["id"], body.track_id, body.to_index, if_version=body.if_version
+        )
+    except KeyError:
+        raise HTTPException(404, "Track not in playlist")
+    return {"status": "moved", "count": count, "version": version}
+
+
+@app.put("/api/playlist/order")
+async def reorder_playlist(body: PlaylistReorder, authorization: Optional[str] = Header(None)):
+    user = get_user_from_header(authorization)
+    count, version = await _playlist_batch("reorder", user["id"], body.ids, if_version=body.if_version)
+    return {"status": "reordered", "count": count, "version": version}
+
+
+@app.put("/api/playlist")
+async def replace_playlist(body: PlaylistReplace, authorization: Optional[str] = Header(None)):
+    user = get_user_from_header(authorization)
+    _check_track_ids([t.id for t in body.tracks])
+    tracks = [_sanitize_track(t) for t in body.tracks]
+    count, version = await _playlist_batch(
+        "replace", user["id"], tracks, _PLAYLIST_LIMIT, if_version=body.if_version
+    )
+    return {"status": "replaced", "count": count, "version": version}
 
 
 # ─── MP3 кеш на диске ────────────────────────────────────────────
 
+from disk_cache import DiskCache
+
 CACHE_DIR = Path(__file__).parent / "mp3_cache"
-CACHE_DIR.mkdir(exist_ok=True)
-_MAX_CACHE_FILES = 100  # макс файлов в кеше
+# Бюджет в байтах, а не в файлах; индекс (size/accessed/hits) в mp3_cache/index.db
+_mp3_cache = DiskCache(
+    CACHE_DIR,
+    max_bytes=int(os.getenv("MP3_CACHE_MAX_MB", "1024")) * 1024 * 1024,
+    policy=os.getenv("MP3_CACHE_POLICY", "lru").lower(),
+)
+_mp3_cache.cleanup_temp()
+# Прогретые треки — отдельный бюджет на узел, чтобы прогрев не вытеснял
+# то, что реально слушают; при первом запросе трек переезжает в _mp3_cache
+_prefetch_cache = DiskCache(
+    CACHE_DIR / "prefetch", max_bytes=int(os.getenv("PREFETCH_MAX_MB", "512")) * 1024 * 1024
+)
+_prefetch_cache.cleanup_temp()
 
-def _cache_mp3_path(track_id: str) -> Path:
+def _cache_mp3_key(track_id: str) -> str:
     # Только валидный формат VK — защита от path traversal
     if not _valid_track_id(track_id):
         track_id = hashlib.sha256(track_id.encode()).hexdigest()[:32]
-    return CACHE_DIR / f"{track_id}.mp3"
+    return track_id
+
+
+def _promote(key: str, warm: Path) -> Optional[Path]:
+    try:
+        path = _mp3_cache.adopt(key, warm)
+    except OSError:
+        # Соседний воркер уже перенёс (и убрал) файл прогрева
+        return _mp3_cache.lookup(key)
+    _prefetch_cache.discard(key)
+    return path
+
+
+async def _cached_mp3(track_id: str) -> Optional[Path]:
+    """MP3 из дискового кеша; прогретый трек при первом запросе — в основной кеш."""
+    key = _cache_mp3_key(track_id)
+    path = await _mp3_cache.alookup(key)
+    if path is not None:
+        return path
+    warm = await _prefetch_cache.alookup(key)
+    if warm is None:
+        return None
+    _prefetch.used += 1
+    return await run_db(_promote, key, warm)
 
-def _cleanup_cache():
-    """Удаляем самые старые файлы если кеш переполнен."""
-    files = sorted(CACHE_DIR.glob("*.mp3"), key=lambda f: f.stat().st_mtime)
-    while len(files) > _MAX_CACHE_FILES:
-        files.pop(0).unlink(missing_ok=True)
 
+async def _has_mp3(track_id: str) -> bool:
+    key = _cache_mp3_key(track_id)
+    return await _mp3_cache.acontains(key) or await _prefetch_cache.acontains(key)
 
-async def _download_direct(url: str) -> Optional[bytes]:
-    """Скачивает прямой MP3/аудио файл без ffmpeg."""
+
+async def _download_direct(url: str, dest: Path) -> bool:
+    """Скачивает прямой MP3/аудио файл без ffmpeg, потоково в dest."""
     session = await get_session()
     try:
         async with session.get(url, headers={"User-Agent": VK_USER_AGENT}) as resp:
             if resp.status != 200:
-                return None
+                return False
             ct = resp.headers.get("Content-Type", "")
             # Если HLS — нужен ffmpeg
             if "mpegurl" in ct.lower() or "m3u8" in ct.lower():
-                return None
-            data = await resp.read()
-            if len(data) < 500:
-                return None
-            if data[:3] == b"<! " or data[:5] == b"<html":
-                return None
-            return data
+                return False
+            size = 0
+            with open(dest, "wb") as f:
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    if size == 0 and (chunk[:3] == b"<! " or chunk[:5] == b"<html"):
+                        return False
+                    f.write(chunk)
+                    size += len(chunk)
+            return size >= 500
     except Exception:
-        return None
+        return False
 
 
 def _is_hls_url(url: str) -> bool:
@@ -592,88 +1129,159 @@ def _is_hls_url(url: str) -> bool:
     return ".m3u8" in url.lower() or "/index.m3u8" in url.lower()
 
 
-async def _get_mp3_data(track_id: str, url: str) -> Optional[bytes]:
-    """
-    Получает MP3 данные трека. Приоритеты:
-    1. Кеш на диске (мгновенно)
-    2. Прямое скачивание (если не HLS) — быстро, без ffmpeg
-    3. ffmpeg конвертация (HLS → MP3) — медленнее, но работает всегда
-    """
-    # 1. Проверяем дисковый кеш
-    cache_path = _cache_mp3_path(track_id)
-    if cache_path.exists():
+async def _get_mp3_file(track_id: str, url: str) -> Optional[Path]:
+    """Путь к MP3 в дисковом кеше; конкурентные запросы одного трека склеиваются."""
+    cache_path = await _cached_mp3(track_id)
+    if cache_path:
         print(f"⚡ Cache hit: {track_id}")
-        return cache_path.read_bytes()
+        return cache_path
+    # Трек сейчас кто-то слушает — его поток и так пишется в кеш
+    if await _hub.wait(track_id):
+        cache_path = await _cached_mp3(track_id)
+        if cache_path:
+            return cache_path
+    return await _sf_mp3.do(track_id, lambda: _fill_mp3_cache(track_id, url))
 
-    mp3_data = None
-
-    # 2. Прямое скачивание (без ffmpeg) если URL не HLS
-    if not _is_hls_url(url):
-        print(f"⬇️  Direct download: {track_id}")
-        mp3_data = await _download_direct(url)
-
-    # 3. Fallback: ffmpeg (для HLS или если прямое скачивание не удалось)
-    if not mp3_data:
-        print(f"🔧 ffmpeg convert: {track_id}")
-        cmd = [
-            FFMPEG,
-            "-hide_banner", "-loglevel", "error",
-            "-fflags", "+nobuffer+fastseek",
-            "-analyzeduration", "500000",
-            "-probesize", "500000",
-            "-user_agent", VK_USER_AGENT,
-            "-i", url,
-            "-vn",
-            "-acodec", "libmp3lame",
-            "-q:a", "7",            # VBR ~100kbps — быстрее, компактнее для Telegram
-            "-write_xing", "0",
-            "-f", "mp3", "pipe:1",
-        ]
-        proc = await asyncio.create_subprocess_exec(
-            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-        )
-        mp3_data, stderr = await proc.communicate()
-        if proc.returncode != 0 or not mp3_data:
-            err = stderr.decode(errors="replace")[:200] if stderr else ""
-            print(f"⚠️ ffmpeg error: {err}")
-            return None
 
-    # Сохраняем в кеш
+async def _fill_mp3_cache(track_id: str, url: str) -> Optional[Path]:
+    """
+    Получает MP3 трека прямо в файл кеша (без копии всего трека в памяти):
+    1. Прямое скачивание (если не HLS) — быстро, без ffmpeg
+    2. HLS: сегменты → MP3 без перекодирования
+    3. ffmpeg конвертация (HLS → MP3) — медленнее, но работает всегда
+    """
+    cache_key = _cache_mp3_key(track_id)
+    tmp = _mp3_cache.temp_path(cache_key)
     try:
-        cache_path.write_bytes(mp3_data)
-        _cleanup_cache()
-    except Exception:
-        pass
+        ok = False
+
+        # 1. Прямое скачивание (без ffmpeg) если URL не HLS
+        if not _is_hls_url(url):
+            print(f"⬇️  Direct download: {track_id}")
+            ok = await _download_direct(url, tmp)
+        else:
+            hls = await _open_hls(url)
+            if hls:
+                print(f"⬇️  HLS segments: {track_id}")
+                with open(tmp, "wb") as f:
+                    async for chunk in hls.iter_mp3():
+                        f.write(chunk)
+                ok = hls.complete
+
+        # 3. Fallback: ffmpeg (для HLS или если прямое скачивание не удалось)
+        if not ok:
+            print(f"🔧 ffmpeg convert: {track_id}")
+            cmd = [
+                FFMPEG,
+                "-hide_banner", "-loglevel", "error",
+                "-fflags", "+nobuffer+fastseek",
+                "-analyzeduration", "500000",
+                "-probesize", "500000",
+                "-user_agent", VK_USER_AGENT,
+                "-i", url,
+                "-vn",
+                "-acodec", "libmp3lame",
+                "-q:a", "7",            # VBR ~100kbps — быстрее, компактнее для Telegram
+                "-write_xing", "0",
+                "-f", "mp3", "-y", str(tmp),
+            ]
+            # Фоновая конвертация ждёт слот после стриминга слушателям
+            async with _ffmpeg.slot(BACKGROUND):
+                proc = await asyncio.create_subprocess_exec(
+                    *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+                )
+                try:
+                    _, stderr = await proc.communicate()
+                except asyncio.CancelledError:
+                    proc.kill()
+                    raise
+            if proc.returncode != 0 or not tmp.exists() or tmp.stat().st_size == 0:
+                err = stderr.decode(errors="replace")[:200] if stderr else ""
+                print(f"⚠️ ffmpeg error: {err}")
+                return None
 
-    return mp3_data
+        # Атомарно в кеш: tmp + rename, вытеснение по бюджету
+        return await _mp3_cache.acommit(cache_key, tmp)
+    except Exception as e:
+        print(f"⚠️ MP3 cache write error: {e}")
+        return None
+    finally:
+        tmp.unlink(missing_ok=True)
 
 
 # ─── Send track to Telegram bot chat ─────────────────────────────
 
 async def _fetch_track_info(track_id: str) -> Dict:
-    """Получает инфо о треке из VK API (корректно закрывает ответ)."""
-    session = await get_session()
+    """Инфо о треке; конкурентные запросы одного трека склеиваются."""
+    return await _sf_info.do(track_id, lambda: _fetch_track_info_raw(track_id))
+
+
+async def _fetch_track_info_raw(track_id: str) -> Dict:
+    """Получает инфо о треке из VK API (через общий батч getById)."""
     try:
-        async with session.get(
-            "https://api.vk.com/method/audio.getById",
-            params={"access_token": VK_TOKEN, "v": "5.131", "audios": track_id},
-            headers={"User-Agent": VK_USER_AGENT},
-        ) as resp:
-            data = await resp.json()
-            items = data.get("response", [])
-            return items[0] if items else {}
+        return await _getbyid.get(track_id) or {}
     except Exception:
         return {}
 
 
-async def _send_track_to_telegram(chat_id: int, track_id: str) -> None:
+# track_id → Telegram file_id: повторная отправка трека без загрузки байтов.
+# Всегда SQLite (переживает рестарт), file_id бота не протухает, TTL — страховка.
+_tg_file_ids = SQLiteCache(
+    CACHE_DB, ttl=30 * 86400, max_entries=int(os.getenv("TG_FILE_ID_MAX", "200000")),
+    table="tg_file_ids",
+)
+_sf_upload = SingleFlight("tg_upload")
+_file_id_stats = {"reused": 0, "uploaded": 0, "stale": 0, "no_file_id": 0}
+
+
+async def _send_audio_by_file_id(chat_id: int, file_id: str) -> bool:
+    """sendAudio с file_id — без загрузки файла, миллисекунды."""
+    result = await _tg.call("sendAudio", chat_id=chat_id, audio=file_id)
+    return bool(result.get("ok"))
+
+
+async def _send_track_to_telegram(chat_id: int, track_id: str) -> bool:
     """Фоновая задача: получает MP3 и отправляет в Telegram.
     Делается в фоне, чтобы HTTP-запрос из Mini App завершался быстро.
+    Возвращает True, если трек доставлен.
     """
     if not _valid_track_id(track_id):
         print(f"⚠️ [bg] Invalid track ID format: {track_id}")
-        return
-
+        return False
+
+    # Трек уже загружался в Telegram → шлём по file_id
+    file_id = await _tg_file_ids.aget(track_id)
+    if file_id:
+        if await _send_audio_by_file_id(chat_id, file_id):
+            _file_id_stats["reused"] += 1
+            print(f"✅ [bg] Sent to chat {chat_id} (cached file_id)")
+            return True
+        _file_id_stats["stale"] += 1
+        await _tg_file_ids.adelete(track_id)
+
+    # Одновременные отправки одного трека: загружает один, остальные берут его file_id
+    sent_chat, delivered, file_id = await _sf_upload.do(
+        track_id, lambda: _upload_track_to_telegram(chat_id, track_id)
+    )
+    if sent_chat == chat_id:
+        return delivered
+    if not file_id:
+        if not delivered:
+            return False
+        # Соседняя загрузка дошла, но без file_id — переслать нечего, грузим сами
+        return (await _upload_track_to_telegram(chat_id, track_id))[1]
+    if await _send_audio_by_file_id(chat_id, file_id):
+        _file_id_stats["reused"] += 1
+        print(f"✅ [bg] Sent to chat {chat_id} (cached file_id)")
+        return True
+    return False
+
+
+async def _upload_track_to_telegram(chat_id: int, track_id: str) -> Tuple[int, bool, Optional[str]]:
+    """
+    Загружает MP3 в чат; возвращает (chat_id, доставлен ли, file_id для
+    повторного использования). Доставлен без file_id — тоже успех, просто не в кеш.
+    """
     # Получаем URL и инфо параллельно
     url, track_info = await asyncio.gather(
         vk_get_audio_url(track_id),
@@ -683,7 +1291,7 @@ async def _send_track_to_telegram(chat_id: int, track_id: str) -> None:
 
     if isinstance(url, Exception) or not url:
         print(f"⚠️ [bg] Failed to get VK url for {track_id}: {url}")
-        return
+        return chat_id, False, None
     if isinstance(track_info, Exception):
         track_info = {}
 
@@ -692,81 +1300,217 @@ async def _send_track_to_telegram(chat_id: int, track_id: str) -> None:
 
     print(f"📤 [bg] Send to bot {chat_id}: {artist} — {title}")
 
-    # Получаем MP3 (кеш → прямое скачивание → ffmpeg)
-    mp3_data = await _get_mp3_data(track_id, url)
-    if not mp3_data:
+    # Получаем MP3 в дисковый кеш (кеш → прямое скачивание → ffmpeg)
+    mp3_path = await _get_mp3_file(track_id, url)
+    if not mp3_path:
         print(f"⚠️ [bg] Failed to get MP3 data for {track_id}")
-        return
-
-    print(f"📦 [bg] MP3 ready: {len(mp3_data) // 1024}KB, sending to Telegram...")
+        return chat_id, False, None
 
-    # Отправляем через Telegram Bot API
-    session = await get_session()
-    tg_url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendAudio"
-    form = aiohttp.FormData()
-    form.add_field("chat_id", str(chat_id))
-    form.add_field("title", title)
-    form.add_field("performer", artist)
+    # Отправляем через Telegram Bot API. Файл не читается в память целиком:
+    # aiohttp стримит его в multipart-тело чанками по 64KB
     safe_name = re.sub(r'[^\w\s\-\.]', ' ', f"{artist} - {title}")[:80].strip() or "track"
-    form.add_field("audio", mp3_data, filename=f"{safe_name}.mp3", content_type="audio/mpeg")
-
     try:
-        async with session.post(tg_url, data=form) as resp:
-            result = await resp.json()
-    except Exception as e:
-        print(f"⚠️ [bg] Telegram API error: {e}")
-        return
+        # Новая форма и свой файловый объект на каждую попытку (повтор после 429)
+        with FileForm(mp3_path, "audio", f"{safe_name}.mp3", "audio/mpeg",
+                      chat_id=chat_id, title=title, performer=artist) as form:
+            print(f"📦 [bg] MP3 ready: {form.size // 1024}KB, sending to Telegram...")
+            result = await _tg.call("sendAudio", form=form, chat_id=chat_id)
+    except OSError as e:
+        print(f"⚠️ [bg] MP3 cache read error: {e}")
+        return chat_id, False, None
 
     if not result.get("ok"):
-        desc = result.get("description", "Unknown error")
-        err_code = result.get("error_code", "?")
-        print(f"⚠️ [bg] Telegram API error {err_code}: {desc}")
-        return
+        return chat_id, False, None
 
-    print(f"✅ [bg] Sent to chat {chat_id}")
+    _file_id_stats["uploaded"] += 1
+    file_id = ((result.get("result") or {}).get("audio") or {}).get("file_id")
+    if file_id:
+        await _tg_file_ids.aset(track_id, file_id)
+        print(f"✅ [bg] Sent to chat {chat_id}")
+    else:
+        # Трек у пользователя, повтор загрузил бы его второй раз — не ошибка
+        _file_id_stats["no_file_id"] += 1
+        print(f"⚠️ [bg] Sent to chat {chat_id}, but no file_id in response — not cached")
+    return chat_id, True, file_id
 
 
-async def _run_send_to_telegram(chat_id: int, track_id: str):
-    """Обёртка для логирования ошибок фоновой задачи."""
+async def _run_send_to_telegram(payload: Dict) -> bool:
+    """Обработчик задачи очереди: логирует ошибки, возвращает успех."""
     try:
-        await _send_track_to_telegram(chat_id, track_id)
+        return await _send_track_to_telegram(payload["chat_id"], payload["track_id"])
     except Exception as e:
         print(f"⚠️ [bg] send-to-bot failed: {e}")
+        return False
+
+
+# Очередь send-to-bot: ограниченный пул на воркер вместо create_task на каждый клик
+_send_queue = JobQueue(
+    _run_send_to_telegram,
+    store=make_cache("send_jobs", ttl=3600, max_entries=20000, path=CACHE_DB),
+    concurrency=int(os.getenv("SEND_CONCURRENCY", "2")),
+    max_pending=int(os.getenv("SEND_QUEUE_MAX", "200")),
+    rate_limit=int(os.getenv("SEND_RATE_PER_MIN", "10")),
+    rate_window=60,
+    name="send-to-bot",
+)
+
+
+def _public_job(job: Dict) -> Dict:
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "track_id": job["payload"]["track_id"],
+        "created": job["created"],
+        "started": job["started"],
+        "finished": job["finished"],
+    }
 
 
 @app.post("/api/send-to-bot/{track_id}")
 async def send_to_bot(
     track_id: str,
     authorization: Optional[str] = Header(None),
-    background: BackgroundTasks = None,
 ):
-    """Эндпоинт для Mini App: быстро подтверждает запрос и
-    отправляет трек в чат в фоне, чтобы ничего не «висело»."""
+    """Эндпоинт для Mini App: быстро подтверждает запрос и ставит отправку
+    в очередь. Статус — GET /api/send-to-bot/jobs/{job_id}."""
     user = get_user_from_header(authorization)
     chat_id = user["id"]
 
     if not _valid_track_id(track_id):
         raise HTTPException(400, "Invalid track ID format")
 
-    if background is None:
-        asyncio.create_task(_run_send_to_telegram(chat_id, track_id))
-    else:
-        background.add_task(_run_send_to_telegram, chat_id, track_id)
+    # Трек уже есть в Telegram или на диске — отправка дешёвая, ставим вперёд
+    cached = bool(await _tg_file_ids.aget(track_id)) or await _has_mp3(track_id)
+    try:
+        job = await _send_queue.submit(
+            chat_id, track_id, {"chat_id": chat_id, "track_id": track_id},
+            priority=0 if cached else 1,
+        )
+    except RateLimited as e:
+        raise HTTPException(429, "Too many requests", headers={"Retry-After": str(int(e.retry_after) + 1)})
+    except QueueFull:
+        raise HTTPException(503, "Send queue is full", headers={"Retry-After": "10"})
+    except sqlite3.Error:
+        raise HTTPException(503, "Send queue is unavailable", headers={"Retry-After": "5"})
+
+    return {**_public_job(job), "chat_id": chat_id}
 
-    return {"status": "queued", "chat_id": chat_id}
+
+@app.get("/api/send-to-bot/jobs/{job_id}")
+async def send_to_bot_status(job_id: str, authorization: Optional[str] = Header(None)):
+    user = get_user_from_header(authorization)
+    job = await _send_queue.get(job_id)
+    if not job or job["user_id"] != user["id"]:
+        raise HTTPException(404, "Job not found")
+    return _public_job(job)
+
+
+# ─── Telegram webhook (BOT_MODE=webhook) ─────────────────────────
+# Обновления принимают все uvicorn-воркеры; bot.py (long polling) — fallback.
+
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:32]
+_webhook_stats = {"received": 0, "duplicates": 0, "dedup_errors": 0, "rejected": 0, "failed": 0}
+
+if BOT_MODE == "webhook":
+    import bot as tg_bot
+
+    tg_bot.use_client(_tg)
+    # update_id → обработан; общий для воркеров (повторная доставка может прийти в другой)
+    _tg_updates = make_cache("tg_updates", ttl=3600, max_entries=20000, path=CACHE_DB)
+    _update_sem = asyncio.Semaphore(int(os.getenv("BOT_UPDATE_CONCURRENCY", "16")))
+    _update_tasks: set = set()
+
+    async def _handle_update(update: Dict):
+        async with _update_sem:
+            try:
+                await tg_bot.handle_update(await get_session(), update)
+            except Exception as e:
+                _webhook_stats["failed"] += 1
+                print(f"⚠️ Update {update.get('update_id')} failed: {e}")
+                # Снимаем отметку: повторная доставка обработается заново
+                await _tg_updates.adelete(str(update["update_id"]))
+
+    async def _setup_webhook():
+        """Один воркер (flock) регистрирует webhook и меню бота."""
+        if not tg_bot.WEBAPP_URL or not tg_bot._acquire_lock():
+            return
+        session = await get_session()
+        url = f"{tg_bot.WEBAPP_URL.rstrip('/')}/api/telegram/webhook"
+        if await tg_bot.set_webhook(session, url, WEBHOOK_SECRET):
+            await tg_bot.configure_bot(session)
+
+    @app.post("/api/telegram/webhook")
+    async def telegram_webhook(
+        request: Request,
+        x_telegram_bot_api_secret_token: Optional[str] = Header(None),
+    ):
+        if not hmac.compare_digest(x_telegram_bot_api_secret_token or "", WEBHOOK_SECRET):
+            _webhook_stats["rejected"] += 1
+            raise HTTPException(403, "Invalid webhook secret")
+        update = await request.json()
+        _webhook_stats["received"] += 1
+        update_id = update.get("update_id")
+        if update_id is None:
+            return {"ok": True}
+        # add() атомарен для всех воркеров: дубль, пришедший в соседний
+        # воркер одновременно с оригиналом, тоже отсекается
+        try:
+            fresh = await _tg_updates.aadd(str(update_id), "1")
+        except sqlite3.Error:
+            # Не знаем, дубль ли это: лучше обработать дважды, чем потерять
+            _webhook_stats["dedup_errors"] += 1
+            fresh = True
+        if not fresh:
+            _webhook_stats["duplicates"] += 1
+            return {"ok": True}
+        # Отвечаем Telegram сразу, обработка — в фоне (параллельно)
+        task = asyncio.create_task(_handle_update(update))
+        _update_tasks.add(task)
+        task.add_done_callback(_update_tasks.discard)
+        return {"ok": True}
 
 
 # ─── Health check ────────────────────────────────────────────────
 
+def _sqlite_stats() -> Dict:
+    """Метрики, которые читают SQLite (COUNT(*)) — считаются в пуле run_db."""
+    return {
+        "cache_size": len(_url_cache),
+        "url_cache": _url_cache.stats(),
+        "search_cache": {**_search_cache.stats(), **_search_stats},
+        "mp3_cache": _mp3_cache.stats(),
+        "prefetch_cache": _prefetch_cache.stats(),
+        "tg_file_ids": {"size": len(_tg_file_ids), **_file_id_stats},
+    }
+
+
 @app.get("/api/health")
 async def health():
-    return {"status": "ok", "cache_size": len(_url_cache)}
+    return {
+        "status": "ok",
+        "pid": os.getpid(),
+        **await run_db(_sqlite_stats),
+        "vk_getbyid_batch": _getbyid.stats(),
+        "hls": _hls.stats(),
+        "transcode_hub": _hub.stats(),
+        "ffmpeg": _ffmpeg.stats(),
+        "prefetch": _prefetch.stats(),
+        "send_queue": _send_queue.stats(),
+        "telegram": _tg.stats(),
+        "playlist_cache": _playlists.stats(),
+        "auth": _auth.stats(),
+        "bot_mode": BOT_MODE,
+        "webhook": _webhook_stats,
+        "singleflight": {
+            sf.name: sf.stats() for sf in (_sf_url, _sf_info, _sf_search, _sf_mp3, _sf_upload)
+        },
+    }
 
 
 # ─── Статика: раздаём собранный фронтенд (dist/) напрямую ─────
 
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
 
 DIST_DIR = Path(__file__).parent.parent / "dist"
 _static_dir = Path(__file__).parent / "static"
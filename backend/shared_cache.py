@@ -0,0 +1,430 @@
+"""
+Общий TTL/LRU-кеш для server_lite.
+
+Uvicorn запускается с --workers N, поэтому обычный dict в модуле — это N
+независимых кешей. Здесь два взаимозаменяемых бэкенда с одним интерфейсом:
+
+- MemoryCache  — in-process OrderedDict (dev / один воркер)
+- SQLiteCache  — файл SQLite в WAL-режиме, общий для всех воркеров на ноде
+
+Оба держат TTL, ограничены по числу записей (LRU-вытеснение) и считают
+hit/miss для /api/health. add() (записать, если ключа нет) и incr()
+(счётчик) у SQLiteCache атомарны для всех воркеров — на них держатся общие
+rate limit и захват задач.
+
+Из async-кода — только a*-методы (aget, aset, ...): у SQLiteCache они уходят
+в отдельный пул потоков (run_db), и ожидание блокировки SQLite другим
+воркером (до timeout=5 с) не останавливает event loop. У MemoryCache
+a*-методы синхронные внутри — в поток ходить незачем.
+"""
+from __future__ import annotations
+import asyncio, os, sqlite3, threading, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Свой пул для SQLite: ожидание write-lock не занимает потоки asyncio.to_thread
+_db_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("DB_THREADS", "8")), thread_name_prefix="sqlite"
+)
+
+
+async def run_db(fn: Callable, *args) -> Any:
+    """Синхронный вызов SQLite из async-кода — в пуле _db_executor."""
+    return await asyncio.get_running_loop().run_in_executor(_db_executor, fn, *args)
+
+
+class MemoryCache:
+    """In-process LRU с TTL. Значения — строки. Lock — на случай вызовов из
+    потоков (run_db, to_thread) наравне с event loop: OrderedDict и счётчики
+    hit/miss иначе расходятся."""
+
+    backend = "memory"
+
+    def __init__(self, ttl: float, max_entries: int = 500):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.get_with_age(key)
+        return entry[0] if entry else None
+
+    def get_with_age(self, key: str) -> Optional[Tuple[str, float]]:
+        """(value, возраст в секундах) или None."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry:
+                age = time.time() - entry[1]
+                if age < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[0], age
+            self._data.pop(key, None)
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: str, created: Optional[float] = None) -> None:
+        with self._lock:
+            self._data[key] = (value, created or time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def add(self, key: str, value: str) -> bool:
+        """Записывает, только если ключа нет (или он протух). True — записали."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry and time.time() - entry[1] < self.ttl:
+                return False
+            self.set(key, value)
+            return True
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        """Счётчик: +amount, время создания не сдвигается. Возвращает новое значение."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry and time.time() - entry[1] < self.ttl:
+                value = int(entry[0]) + amount
+                self.set(key, str(value), created=entry[1])
+            else:
+                value = amount
+                self.set(key, str(value))
+            return value
+
+    async def aget(self, key: str) -> Optional[str]:
+        return self.get(key)
+
+    async def aget_with_age(self, key: str) -> Optional[Tuple[str, float]]:
+        return self.get_with_age(key)
+
+    async def aset(self, key: str, value: str, created: Optional[float] = None) -> None:
+        self.set(key, value, created)
+
+    async def adelete(self, key: str) -> None:
+        self.delete(key)
+
+    async def aadd(self, key: str, value: str) -> bool:
+        return self.add(key, value)
+
+    async def aincr(self, key: str, amount: int = 1) -> int:
+        return self.incr(key, amount)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "backend": self.backend,
+            "size": len(self._data),
+            "max_entries": self.max_entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 3) if total else 0.0,
+        }
+
+
+class SQLiteCache:
+    """
+    Кеш в SQLite-файле, общий для всех воркеров ноды.
+    - WAL: читатели не блокируют писателя
+    - accessed обновляется не чаще раза в _TOUCH_INTERVAL сек (меньше записей на hit)
+    - вытеснение по accessed (LRU) раз в _EVICT_EVERY вставок
+    """
+
+    backend = "sqlite"
+    _TOUCH_INTERVAL = 30
+    _EVICT_EVERY = 50
+
+    def __init__(self, path: Path, ttl: float, max_entries: int = 5000, table: str = "cache"):
+        if not table.isidentifier():
+            raise ValueError(f"Invalid table name: {table}")
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+        self._sets = 0
+        self._stats_lock = threading.Lock()   # счётчики меняют потоки run_db
+        self._local = threading.local()
+        self._init_schema()
+
+    def _conn(self) -> sqlite3.Connection:
+        # Своё соединение на поток (to_thread / executor) и на процесс
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=5, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_schema(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {self.table}_accessed ON {self.table}(accessed)"
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.get_with_age(key)
+        return entry[0] if entry else None
+
+    def get_with_age(self, key: str) -> Optional[Tuple[str, float]]:
+        """(value, возраст в секундах) или None."""
+        now = time.time()
+        try:
+            conn = self._conn()
+            row = conn.execute(
+                f"SELECT value, created, accessed FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row and now - row[1] < self.ttl:
+                if now - row[2] > self._TOUCH_INTERVAL:
+                    conn.execute(
+                        f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (now, key)
+                    )
+                with self._stats_lock:
+                    self.hits += 1
+                return row[0], now - row[1]
+            if row:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            print(f"⚠️ SQLite cache read error: {e}")
+        with self._stats_lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, value: str, created: Optional[float] = None) -> None:
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created, accessed)"
+                " VALUES (?, ?, ?, ?)",
+                (key, value, created or now, now),
+            )
+            with self._stats_lock:
+                self._sets += 1
+                evict = self._sets % self._EVICT_EVERY == 0
+            if evict:
+                self._evict(conn, now)
+        except sqlite3.Error as e:
+            print(f"⚠️ SQLite cache write error: {e}")
+
+    def delete(self, key: str) -> None:
+        try:
+            self._conn().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            print(f"⚠️ SQLite cache write error: {e}")
+
+    def add(self, key: str, value: str) -> bool:
+        """Записывает, только если ключа нет (или он протух) — атомарно для
+        всех воркеров. True — записали (например, «захватили» задачу).
+        Ошибку SQLite (database is locked) бросает: «ключ уже есть» и
+        «неизвестно» вызывающий должен различать."""
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    f"DELETE FROM {self.table} WHERE key = ? AND created < ?", (key, now - self.ttl)
+                )
+                added = conn.execute(
+                    f"INSERT OR IGNORE INTO {self.table} (key, value, created, accessed)"
+                    " VALUES (?, ?, ?, ?)",
+                    (key, value, now, now),
+                ).rowcount == 1
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            if added:
+                with self._stats_lock:
+                    self._sets += 1
+            return added
+        except sqlite3.Error as e:
+            print(f"⚠️ SQLite cache write error: {e}")
+            raise
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        """Общий для воркеров счётчик: +amount атомарно. Возвращает новое значение.
+        При ошибке SQLite возвращает 0 — счётчик не должен ронять запрос."""
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    f"DELETE FROM {self.table} WHERE key = ? AND created < ?", (key, now - self.ttl)
+                )
+                conn.execute(
+                    f"INSERT INTO {self.table} (key, value, created, accessed) VALUES (?, ?, ?, ?)"
+                    f" ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + excluded.value,"
+                    " accessed = excluded.accessed",
+                    (key, amount, now, now),
+                )
+                value = int(conn.execute(
+                    f"SELECT value FROM {self.table} WHERE key = ?", (key,)
+                ).fetchone()[0])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return value
+        except sqlite3.Error as e:
+            print(f"⚠️ SQLite cache write error: {e}")
+            return 0
+
+    async def aget(self, key: str) -> Optional[str]:
+        return await run_db(self.get, key)
+
+    async def aget_with_age(self, key: str) -> Optional[Tuple[str, float]]:
+        return await run_db(self.get_with_age, key)
+
+    async def aset(self, key: str, value: str, created: Optional[float] = None) -> None:
+        await run_db(self.set, key, value, created)
+
+    async def adelete(self, key: str) -> None:
+        await run_db(self.delete, key)
+
+    async def aadd(self, key: str, value: str) -> bool:
+        return await run_db(self.add, key, value)
+
+    async def aincr(self, key: str, amount: int = 1) -> int:
+        return await run_db(self.incr, key, amount)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        """Удаляем протухшие записи, затем самые давно читанные сверх лимита."""
+        conn.execute(f"DELETE FROM {self.table} WHERE created < ?", (now - self.ttl,))
+        conn.execute(
+            f"DELETE FROM {self.table} WHERE key IN ("
+            f" SELECT key FROM {self.table} ORDER BY accessed ASC"
+            f" LIMIT max(0, (SELECT COUNT(*) FROM {self.table}) - ?))",
+            (self.max_entries,),
+        )
+
+    def __len__(self) -> int:
+        try:
+            return self._conn().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "backend": self.backend,
+            "size": len(self),
+            "max_entries": self.max_entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 3) if total else 0.0,
+        }
+
+
+class TieredCache:
+    """
+    L1 — маленький in-process LRU (без SQLite на горячих ключах),
+    L2 — общий кеш воркеров. При промахе L1 запись поднимается из L2
+    с исходным временем создания, чтобы возраст (для stale-while-revalidate)
+    считался одинаково во всех воркерах.
+    """
+
+    def __init__(self, l1: MemoryCache, l2=None):
+        self.l1 = l1
+        self.l2 = l2
+        self.backend = f"memory+{l2.backend}" if l2 is not None else "memory"
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.get_with_age(key)
+        return entry[0] if entry else None
+
+    def get_with_age(self, key: str) -> Optional[Tuple[str, float]]:
+        entry = self.l1.get_with_age(key)
+        if entry or self.l2 is None:
+            return entry
+        entry = self.l2.get_with_age(key)
+        if entry:
+            self.l1.set(key, entry[0], created=time.time() - entry[1])
+        return entry
+
+    def set(self, key: str, value: str, created: Optional[float] = None) -> None:
+        self.l1.set(key, value, created)
+        if self.l2 is not None:
+            self.l2.set(key, value, created)
+
+    def delete(self, key: str) -> None:
+        self.l1.delete(key)
+        if self.l2 is not None:
+            self.l2.delete(key)
+
+    async def aget_with_age(self, key: str) -> Optional[Tuple[str, float]]:
+        # L1 — без потока; в пул идёт только промах
+        entry = self.l1.get_with_age(key)
+        if entry or self.l2 is None:
+            return entry
+        entry = await self.l2.aget_with_age(key)
+        if entry:
+            self.l1.set(key, entry[0], created=time.time() - entry[1])
+        return entry
+
+    async def aget(self, key: str) -> Optional[str]:
+        entry = await self.aget_with_age(key)
+        return entry[0] if entry else None
+
+    async def aset(self, key: str, value: str, created: Optional[float] = None) -> None:
+        self.l1.set(key, value, created)
+        if self.l2 is not None:
+            await self.l2.aset(key, value, created)
+
+    async def adelete(self, key: str) -> None:
+        self.l1.delete(key)
+        if self.l2 is not None:
+            await self.l2.adelete(key)
+
+    def __len__(self) -> int:
+        return len(self.l2) if self.l2 is not None else len(self.l1)
+
+    def stats(self) -> Dict:
+        result = {"backend": self.backend, "l1": self.l1.stats()}
+        if self.l2 is not None:
+            result["l2"] = self.l2.stats()
+        return result
+
+
+def make_cache(name: str, ttl: float, max_entries: int, path: Optional[Path] = None):
+    """
+    Фабрика по переменной окружения CACHE_BACKEND (sqlite | memory).
+    По умолчанию sqlite — общий кеш для всех uvicorn-воркеров.
+    """
+    backend = os.getenv("CACHE_BACKEND", "sqlite").lower()
+    if backend == "memory" or path is None:
+        return MemoryCache(ttl=ttl, max_entries=max_entries)
+    try:
+        return SQLiteCache(path, ttl=ttl, max_entries=max_entries, table=name)
+    except sqlite3.Error as e:
+        print(f"⚠️ SQLite cache unavailable ({e}), fallback to memory")
+        return MemoryCache(ttl=ttl, max_entries=max_entries)
@@ -0,0 +1,47 @@
+"""
+Single-flight: склейка одинаковых конкурентных запросов.
+
+Если сотня клиентов одновременно просит один и тот же трек, в VK уходит
+один запрос, остальные ждут тот же future и получают тот же результат.
+"""
+from __future__ import annotations
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    def __init__(self, name: str = ""):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0       # всего вызовов do()
+        self.executed = 0    # реально выполнено
+        self.coalesced = 0   # склеено с уже идущим запросом
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            # Отдельная задача: отмена первого клиента (обрыв соединения)
+            # не отменяет запрос для остальных ждущих
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            self.executed += 1
+            task.add_done_callback(lambda t, k=key: self._done(k, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Помечаем ошибку как прочитанную, даже если все ждущие отвалились
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+        }
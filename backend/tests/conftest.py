@@ -0,0 +1,4 @@
+import os, sys
+
+# Модули backend/ плоские: импортируем их так же, как server_lite
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
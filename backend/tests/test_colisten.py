@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("scipy")
+import numpy as np
+
+from colisten import CoListenIndex
+
+
+def _events(user, tracks, start=0.0, step=60.0):
+    return [(user, t, start + i * step, f"title {t}", "artist") for i, t in enumerate(tracks)]
+
+
+def test_pairs_respect_window_and_sessions():
+    index = CoListenIndex(window=2, session_gap=1800, min_count=1)
+    # a b c в одной сессии, d — после перерыва; повтор c подряд парой не считается
+    index.add(_events(1, "abcc") + [(1, "d", 10_000.0, "", "")])
+    assert {t for t, _ in index.similar("a")} == {"b", "c"}
+    assert {t for t, _ in index.similar("c")} == {"a", "b"}
+    assert index.similar("d") == []
+    assert index.similar("missing") == []
+    assert index.stats()["pairs"] == 3
+
+
+def test_incremental_add_matches_full_build():
+    rng = random.Random(7)
+    events = []
+    for user in range(40):
+        ts = rng.uniform(0, 3600)
+        for _ in range(30):
+            ts += rng.choice((120, 200, 5000))
+            events.append((user, f"t{int(rng.paretovariate(1.2)) % 60}", ts, "t", "a"))
+    events.sort(key=lambda e: e[2])
+
+    full = CoListenIndex(window=3, min_count=1)
+    full.add(events)
+    inc = CoListenIndex(window=3, min_count=1)
+    for i in range(0, len(events), 37):
+        inc.add(events[i:i + 37])
+
+    assert inc.names == full.names
+    pairs_full, plays_full = full._state
+    pairs_inc, plays_inc = inc._state
+    assert (pairs_full != pairs_inc).nnz == 0
+    np.testing.assert_array_equal(plays_full, plays_inc)
+    assert inc.popular(10) == full.popular(10)
+
+
+def test_min_count_scores_and_exclude():
+    index = CoListenIndex(window=1, min_count=2)
+    index.add(_events(1, "ab") + _events(2, "ab") + _events(3, "ac") + _events(4, "ad", start=10.0))
+    # a-b слушали дважды, a-c и a-d — по разу: отсекаются min_count
+    assert index.similar("a") == [("b", pytest.approx(2 / np.sqrt(4 * 2)))]
+    assert index.similar("a", exclude=["b"]) == []
+    assert index.popular(2) == ["a", "b"]
+
+
+def test_track_meta_follows_latest_event():
+    index = CoListenIndex()
+    index.add([(1, "x", 0.0, "old", "artist")])
+    index.add([(1, "x", 10.0, "new", "artist"), (2, "x", 20.0, "", "")])
+    assert index.track("x") == ("new", "artist")
+    assert index.track("missing") is None
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from disk_cache import DiskCache
+
+
+def test_put_lookup_and_byte_budget_lru(tmp_path):
+    cache = DiskCache(tmp_path, max_bytes=250)
+    cache.put_bytes("a", b"a" * 100)
+    cache.put_bytes("b", b"b" * 100)
+    assert cache.lookup("a") is not None      # a свежее b
+    cache.put_bytes("c", b"c" * 100)
+    assert cache.contains("a") and cache.contains("c")
+    assert not cache.contains("b")
+    assert not (tmp_path / "b.mp3").exists()
+    stats = cache.stats()
+    assert stats["bytes"] == 200 and stats["entries"] == 2 and stats["evictions"] == 1
+
+
+def test_lfu_evicts_least_read(tmp_path):
+    cache = DiskCache(tmp_path, max_bytes=250, policy="lfu")
+    cache.put_bytes("a", b"a" * 100)
+    cache.put_bytes("b", b"b" * 100)
+    for _ in range(3):
+        cache.lookup("a")
+    cache.lookup("b")
+    cache.lookup("b")
+    cache.lookup("a")
+    cache.put_bytes("c", b"c" * 100)
+    assert not cache.contains("b") and cache.contains("a")
+
+
+def test_unsafe_keys_are_hashed(tmp_path):
+    cache = DiskCache(tmp_path, max_bytes=1000)
+    path = cache.path_for("../../etc/passwd")
+    assert path.parent == tmp_path and ".." not in path.name
+
+
+def test_missing_file_is_forgotten(tmp_path):
+    cache = DiskCache(tmp_path, max_bytes=1000)
+    path = cache.put_bytes("a", b"x" * 10)
+    path.unlink()
+    assert cache.lookup("a") is None
+    assert cache.stats()["bytes"] == 0
+
+
+def test_index_is_shared_between_instances(tmp_path):
+    # Второй экземпляр — как соседний uvicorn-воркер
+    first = DiskCache(tmp_path, max_bytes=1000)
+    second = DiskCache(tmp_path, max_bytes=1000)
+    first.put_bytes("a", b"x" * 10)
+    assert second.lookup("a") is not None
+    second.put_bytes("b", b"y" * 20)
+    assert first.stats()["bytes"] == 30
+
+
+def test_existing_files_are_imported(tmp_path):
+    (tmp_path / "old.mp3").write_bytes(b"z" * 42)
+    cache = DiskCache(tmp_path, max_bytes=1000)
+    assert cache.contains("old") and cache.stats()["bytes"] == 42
+
+
+def test_adopt_and_discard_move_between_caches(tmp_path):
+    main = DiskCache(tmp_path / "main", max_bytes=1000)
+    warm = DiskCache(tmp_path / "warm", max_bytes=1000)
+    src = warm.put_bytes("a", b"w" * 10)
+    path = main.adopt("a", src)
+    warm.discard("a")
+    assert path.read_bytes() == b"w" * 10
+    assert not warm.contains("a") and warm.stats()["bytes"] == 0
+
+
+def test_async_wrappers(tmp_path):
+    cache = DiskCache(tmp_path, max_bytes=1000)
+
+    async def main():
+        tmp = cache.temp_path("a")
+        tmp.write_bytes(b"x")
+        await cache.acommit("a", tmp)
+        return await cache.alookup("a"), await cache.acontains("b")
+
+    path, has_b = asyncio.run(main())
+    assert path is not None and not has_b
+
+
+def test_unknown_policy(tmp_path):
+    with pytest.raises(ValueError):
+        DiskCache(tmp_path, max_bytes=1, policy="fifo")
@@ -0,0 +1,115 @@
+import asyncio, multiprocessing, os, time
+
+import pytest
+
+import ffmpeg_pool
+from ffmpeg_pool import BACKGROUND, INTERACTIVE, FfmpegPool, NodeSlots, Saturated
+
+
+def test_interactive_before_background():
+    async def main():
+        pool = FfmpegPool(max_procs=1, max_queue=4)
+        order = []
+
+        async def job(name, priority):
+            async with pool.slot(priority):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        first = asyncio.create_task(job("first", INTERACTIVE))
+        await asyncio.sleep(0)
+        rest = [asyncio.create_task(job("bg", BACKGROUND)),
+                asyncio.create_task(job("int", INTERACTIVE))]
+        await asyncio.gather(first, *rest)
+        return order, pool
+
+    order, pool = asyncio.run(main())
+    assert order == ["first", "int", "bg"]
+    assert pool.running == 0
+
+
+def test_admit_rejects_when_queue_full():
+    async def main():
+        pool = FfmpegPool(max_procs=1, max_queue=1, timeouts={INTERACTIVE: 1})
+        hold = asyncio.Event()
+
+        async def job():
+            async with pool.slot(INTERACTIVE):
+                await hold.wait()
+
+        tasks = [asyncio.create_task(job()), asyncio.create_task(job())]
+        await asyncio.sleep(0.01)
+        with pytest.raises(Saturated):
+            pool.admit(INTERACTIVE)
+        hold.set()
+        await asyncio.gather(*tasks)
+        return pool
+
+    assert asyncio.run(main()).rejected == 1
+
+
+def test_wait_timeout_raises_saturated_and_frees_nothing():
+    async def main():
+        pool = FfmpegPool(max_procs=1, max_queue=4, timeouts={INTERACTIVE: 0.05})
+        async with pool.slot(INTERACTIVE):
+            with pytest.raises(Saturated):
+                async with pool.slot(INTERACTIVE):
+                    pass
+        return pool
+
+    pool = asyncio.run(main())
+    assert pool.running == 0
+    assert pool.timed_out == 1
+
+
+def test_without_slots_dir_limit_is_split_between_workers():
+    assert FfmpegPool(max_procs=8, workers=4).max_procs == 2
+    assert FfmpegPool(max_procs=2, workers=4).max_procs == 1
+
+
+@pytest.mark.skipif(ffmpeg_pool.fcntl is None, reason="needs fcntl")
+def test_node_slots_are_exclusive(tmp_path):
+    a = NodeSlots(tmp_path, 2)
+    b = NodeSlots(tmp_path, 2)
+    first, second = a.try_acquire(), b.try_acquire()
+    assert {first, second} == {0, 1}
+    assert a.try_acquire() is None and b.busy() == 2
+    a.release(first)
+    assert b.try_acquire() == first
+
+
+def _hold_slot(directory, ready, release):
+    async def main():
+        pool = FfmpegPool(max_procs=1, slots_dir=directory)
+        async with pool.slot(BACKGROUND):
+            ready.set()
+            release.wait(10)
+
+    asyncio.run(main())
+
+
+@pytest.mark.skipif(ffmpeg_pool.fcntl is None, reason="needs fcntl")
+def test_node_limit_holds_across_processes(tmp_path):
+    ctx = multiprocessing.get_context("fork")
+    ready, release = ctx.Event(), ctx.Event()
+    other = ctx.Process(target=_hold_slot, args=(tmp_path, ready, release))
+    other.start()
+    try:
+        assert ready.wait(10)
+
+        async def main():
+            pool = FfmpegPool(max_procs=1, slots_dir=tmp_path, timeouts={INTERACTIVE: 0.2})
+            # Локально слот свободен, но на узле его держит другой процесс
+            with pytest.raises(Saturated):
+                async with pool.slot(INTERACTIVE):
+                    pass
+            assert pool.running == 0
+            release.set()
+            started = time.monotonic()
+            async with pool.slot(INTERACTIVE, timeout=5):
+                return time.monotonic() - started
+
+        assert asyncio.run(main()) < 5
+    finally:
+        release.set()
+        other.join(10)
@@ -0,0 +1,161 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("motor")
+pytest.importorskip("pydantic_settings")
+# Обязательные поля Settings (в проде приходят из .env)
+for _name in ("BOT_TOKEN", "VK_TOKEN", "VK_USER_AGENT", "MONGO_URL", "DB_NAME", "SSL_KEYFILE", "SSL_CERTFILE"):
+    os.environ.setdefault(_name, "test")
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from app.services.history import HistoryBuffer, HistoryBufferFull
+
+
+class FakeCollection:
+    def __init__(self, fail=()):
+        self.batches = []
+        self.fail = list(fail)    # исключения для первых вызовов insert_many
+        self.gate = None
+
+    async def insert_many(self, docs, ordered=True):
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.fail:
+            raise self.fail.pop(0)
+        self.batches.append([d["n"] for d in docs])
+
+
+def _buffer(coll, **kw):
+    kw.setdefault("flush_interval", 0.01)
+    return HistoryBuffer(lambda: coll, **kw)
+
+
+def test_flushes_in_batches_and_drains_on_stop():
+    coll = FakeCollection()
+
+    async def main():
+        buf = _buffer(coll, batch_size=3, flush_interval=60)
+        await buf.start()
+        for n in range(7):
+            await buf.add({"n": n})
+        await asyncio.sleep(0.05)
+        # Две полные пачки ушли сразу, хвост — только при остановке
+        assert coll.batches == [[0, 1, 2], [3, 4, 5]]
+        await buf.stop()
+        return buf.stats()
+
+    stats = asyncio.run(main())
+    assert coll.batches[-1] == [6]
+    assert stats["written"] == 7 and stats["batches"] == 3 and stats["pending"] == 0
+
+
+def test_backpressure_rejects_after_timeout():
+    coll = FakeCollection()
+
+    async def main():
+        coll.gate = asyncio.Event()   # Mongo «висит»
+        buf = _buffer(coll, batch_size=10, max_pending=2, enqueue_timeout=0.05)
+        await buf.start()
+        await buf.add({"n": 0})
+        await buf.add({"n": 1})
+        with pytest.raises(HistoryBufferFull):
+            await buf.add({"n": 2})
+        coll.gate.set()
+        await buf.stop()
+        return buf.stats()
+
+    stats = asyncio.run(main())
+    assert stats["rejected"] == 1 and stats["written"] == 2
+
+
+def test_duplicate_keys_count_as_written_and_errors_retry():
+    dup = BulkWriteError({"writeErrors": [{"code": 11000}], "writeConcernErrors": []})
+    coll = FakeCollection(fail=[RuntimeError("down"), dup])
+
+    async def main():
+        buf = _buffer(coll, batch_size=2)
+        await buf.start()
+        first, second = {"n": 0}, {"n": 1}
+        await buf.add(first)
+        await buf.add(second)
+        await buf.stop()
+        return buf.stats(), first, second
+
+    stats, first, second = asyncio.run(main())
+    # Ошибка → повтор той же пачки с теми же _id; duplicate key — пачка уже записана
+    assert isinstance(first["_id"], ObjectId) and first["_id"] != second["_id"]
+    assert stats["errors"] == 1 and stats["written"] == 2
+    assert coll.batches == []
+
+
+def test_recovers_spool_of_dead_process(tmp_path):
+    base = tmp_path / "history.jsonl"
+    dead = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                          capture_output=True, text=True).stdout.strip()
+    when = datetime(2024, 5, 1, 12, 30)
+    oid = ObjectId()
+    lines = [
+        json.dumps({"n": 0, "_id": {"$oid": str(oid)}, "at": {"$date": when.isoformat()}}),
+        json.dumps({"n": 1}),
+        '{"n": 2, "broken',   # оборванная при падении строка
+    ]
+    (tmp_path / f"history.jsonl.{dead}").write_text("\n".join(lines))
+    coll = FakeCollection()
+    docs = []
+
+    async def main():
+        buf = _buffer(coll, batch_size=10, spool_path=str(base))
+        await buf.start()
+        docs.extend(buf._buffer)
+        await buf.stop()
+
+    asyncio.run(main())
+    assert coll.batches == [[0, 1]]
+    assert docs[0]["_id"] == oid and docs[0]["at"] == when
+    # Чужой spool забран, свой удалён после полной записи
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_spool_with_reused_pid_is_replayed(tmp_path):
+    # Рестарт контейнера: новый процесс получил тот же PID, что и упавший
+    base = tmp_path / "history.jsonl"
+    (tmp_path / f"history.jsonl.{os.getpid()}").write_text(json.dumps({"n": 0}) + "\n")
+    coll = FakeCollection()
+
+    async def main():
+        buf = _buffer(coll, batch_size=10, spool_path=str(base))
+        await buf.start()
+        await buf.stop()
+
+    asyncio.run(main())
+    assert coll.batches == [[0]]
+
+
+def test_spool_of_live_worker_is_left_alone(tmp_path):
+    base = tmp_path / "history.jsonl"
+    coll = FakeCollection()
+
+    async def main():
+        coll.gate = asyncio.Event()   # первый воркер не успевает записать
+        first = _buffer(coll, batch_size=10, spool_path=str(base))
+        await first.start()
+        await first.add({"n": 0})
+        second = _buffer(coll, batch_size=10, spool_path=str(base))
+        await second.start()
+        taken = len(second._buffer)
+        coll.gate.set()
+        await second.stop()
+        await first.stop()
+        return taken
+
+    assert asyncio.run(main()) == 0
+    assert coll.batches == [[0]]
+    assert list(tmp_path.iterdir()) == []
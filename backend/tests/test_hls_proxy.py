@@ -0,0 +1,221 @@
+import asyncio
+
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web
+
+import hls_proxy
+from hls_proxy import HlsProxy, HlsUnsupported, TsAudioDemuxer, find_mp3_sync, parse_playlist
+
+_AUDIO_PID = 0x101
+
+
+def _packet(pid: int, payload: bytes, pusi: bool = False) -> bytes:
+    header = bytes([0x47, (0x40 if pusi else 0) | pid >> 8, pid & 0xFF])
+    room = 184 - len(payload)
+    if room == 0:
+        return header + b"\x10" + payload
+    # Короткий хвост добиваем adaptation field со stuffing-байтами
+    adaptation = bytes([room - 1]) + (b"\x00" + b"\xff" * (room - 2) if room > 1 else b"")
+    return header + b"\x30" + adaptation + payload
+
+
+def _section(table: bytes) -> bytes:
+    return (b"\x00" + table + b"\x00" * 4).ljust(184, b"\xff")  # pointer, секция, CRC
+
+
+def ts_segment(audio: bytes, stream_type: int = 0x03) -> bytes:
+    pat = b"\x00\xb0\x0d\x00\x01\xc1\x00\x00" + b"\x00\x01\xe1\x00"
+    pmt = (b"\x02\xb0\x12\x00\x01\xc1\x00\x00\xe1\x01\xf0\x00"
+           + bytes([stream_type, 0xE0 | _AUDIO_PID >> 8, _AUDIO_PID & 0xFF, 0xF0, 0x00]))
+    out = [_packet(0, _section(pat), pusi=True), _packet(0x100, _section(pmt), pusi=True)]
+    pes = b"\x00\x00\x01\xc0\x00\x00\x80\x00\x00" + audio
+    for i in range(0, len(pes), 184):
+        out.append(_packet(_AUDIO_PID, pes[i:i + 184], pusi=i == 0))
+    return b"".join(out)
+
+
+def mp3_frames(n: int, fill: int) -> bytes:
+    return (b"\xff\xfb\x90\x00" + bytes([fill]) * 96) * n
+
+
+def media_playlist(uris, duration=10.0, key_line=None, ended=True) -> str:
+    lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:10", "#EXT-X-MEDIA-SEQUENCE:0"]
+    if key_line:
+        lines.append(key_line)
+    for uri in uris:
+        lines += [f"#EXTINF:{duration},", uri]
+    if ended:
+        lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines)
+
+
+def serve(routes, scenario):
+    """Поднимает локальный HTTP с routes {path: bytes} и прогоняет scenario(proxy, base)."""
+    async def handler(request):
+        body = routes.get(request.path)
+        if body is None:
+            return web.Response(status=404)
+        return web.Response(body=body)
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/{tail:.*}", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        session = aiohttp.ClientSession()
+        try:
+            proxy = HlsProxy(lambda: _const(session), "test", prefetch=2, retries=0)
+            return await scenario(proxy, f"http://127.0.0.1:{port}")
+        finally:
+            await session.close()
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+async def _const(value):
+    return value
+
+
+async def _read_all(proxy, url, start=0.0):
+    stream = await proxy.open(url, start)
+    chunks = [c async for c in stream.iter_mp3()]
+    return b"".join(chunks), stream
+
+
+def test_parse_master_and_media_playlists():
+    master = parse_playlist(
+        "#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=64000\nlow.m3u8\n"
+        "#EXT-X-STREAM-INF:BANDWIDTH=320000\nhigh/index.m3u8\n",
+        "http://h/a/master.m3u8",
+    )
+    assert max(master["variants"]) == (320000, "http://h/a/high/index.m3u8")
+
+    media = parse_playlist(
+        "#EXTM3U\n#EXT-X-MEDIA-SEQUENCE:7\n#EXTINF:4.5,\ns0.ts\n"
+        '#EXT-X-KEY:METHOD=AES-128,URI="k.bin",IV=0x000000000000000000000000000000ff\n'
+        "#EXTINF:5,\ns1.ts\n#EXT-X-KEY:METHOD=NONE\n#EXTINF:5,\ns2.ts\n#EXT-X-ENDLIST\n",
+        "http://h/a/index.m3u8",
+    )
+    s0, s1, s2 = media["segments"]
+    assert media["ended"] and not media["map"]
+    assert (s0.seq, s0.duration, s0.key) == (7, 4.5, None)
+    assert s1.key.uri == "http://h/a/k.bin" and s1.key.iv == (255).to_bytes(16, "big")
+    assert s2.seq == 9 and s2.key is None
+    with pytest.raises(HlsUnsupported):
+        parse_playlist("<html>", "http://h/")
+
+
+def test_demuxer_extracts_audio_across_packets():
+    audio = mp3_frames(10, 0x11)   # 1000 байт: несколько пакетов, хвост со stuffing
+    demuxer = TsAudioDemuxer()
+    assert demuxer.feed(ts_segment(audio)) == audio
+    assert (demuxer.audio_pid, demuxer.stream_type) == (_AUDIO_PID, 0x03)
+    # Следующий сегмент: PID уже известен, склейка без заголовков PES
+    assert demuxer.feed(ts_segment(audio)) == audio
+    with pytest.raises(HlsUnsupported):
+        demuxer.feed(b"\x00" * 188)
+
+
+def test_find_mp3_sync():
+    data = b"\x00\xff\x00\xff\xfb\x90"
+    assert find_mp3_sync(data) == 3
+    assert find_mp3_sync(data, 4) == len(data)
+
+
+def test_streams_segments_in_order():
+    audio = [mp3_frames(5, i + 1) for i in range(5)]
+    routes = {f"/s{i}.ts": ts_segment(a) for i, a in enumerate(audio)}
+    routes["/index.m3u8"] = media_playlist([f"s{i}.ts" for i in range(5)]).encode()
+
+    async def scenario(proxy, base):
+        body, stream = await _read_all(proxy, f"{base}/index.m3u8")
+        return body, stream.complete, proxy.stats()
+
+    body, complete, stats = serve(routes, scenario)
+    assert body == b"".join(audio)
+    assert complete
+    assert stats["streams"] == 1 and stats["segments"] == 5 and stats["errors"] == 0
+
+
+def test_seek_starts_inside_covering_segment():
+    audio = [mp3_frames(10, i + 1) for i in range(3)]
+    routes = {f"/s{i}.ts": ts_segment(a) for i, a in enumerate(audio)}
+    routes["/index.m3u8"] = media_playlist([f"s{i}.ts" for i in range(3)]).encode()
+
+    async def scenario(proxy, base):
+        body, _ = await _read_all(proxy, f"{base}/index.m3u8", start=15.0)
+        return body
+
+    body = serve(routes, scenario)
+    # Середина второго сегмента, по границе кадра, дальше — третий целиком
+    assert body == mp3_frames(5, 2) + audio[2]
+
+
+def test_aes128_segments_are_decrypted():
+    pytest.importorskip("cryptography")
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+    key = bytes(range(16))
+
+    def encrypt(data: bytes, seq: int) -> bytes:
+        padder = padding.PKCS7(128).padder()
+        enc = Cipher(algorithms.AES(key), modes.CBC(seq.to_bytes(16, "big"))).encryptor()
+        return enc.update(padder.update(data) + padder.finalize()) + enc.finalize()
+
+    audio = [mp3_frames(4, i + 1) for i in range(3)]
+    routes = {f"/s{i}.ts": encrypt(ts_segment(a), i) for i, a in enumerate(audio)}
+    routes["/key.bin"] = key
+    routes["/index.m3u8"] = media_playlist(
+        [f"s{i}.ts" for i in range(3)], key_line='#EXT-X-KEY:METHOD=AES-128,URI="key.bin"'
+    ).encode()
+
+    async def scenario(proxy, base):
+        body, _ = await _read_all(proxy, f"{base}/index.m3u8")
+        return body
+
+    assert serve(routes, scenario) == b"".join(audio)
+
+
+def test_encrypted_stream_without_cryptography_falls_back(monkeypatch):
+    monkeypatch.setattr(hls_proxy, "Cipher", None)
+    routes = {"/index.m3u8": media_playlist(
+        ["s0.ts"], key_line='#EXT-X-KEY:METHOD=AES-128,URI="key.bin"'
+    ).encode()}
+
+    async def scenario(proxy, base):
+        with pytest.raises(HlsUnsupported):
+            await proxy.open(f"{base}/index.m3u8")
+        return proxy.fallbacks
+
+    assert serve(routes, scenario) == 1
+
+
+@pytest.mark.parametrize("routes", [
+    # AAC — только через ffmpeg
+    {"/index.m3u8": media_playlist(["s0.ts"]).encode(), "/s0.ts": ts_segment(b"\x00" * 50, 0x0F)},
+    # live-плейлист без ENDLIST
+    {"/index.m3u8": media_playlist(["s0.ts"], ended=False).encode(), "/s0.ts": ts_segment(b"\x00")},
+    # сегмент отдаёт 404
+    {"/index.m3u8": media_playlist(["s0.ts"]).encode()},
+    # битый PAT: pointer field за пределами пакета
+    {"/index.m3u8": media_playlist(["s0.ts"]).encode(),
+     "/s0.ts": _packet(0, b"\xb8" + b"\xff" * 183, pusi=True)},
+    # ключ не отдаётся
+    {"/index.m3u8": media_playlist(["s0.ts"], key_line='#EXT-X-KEY:METHOD=AES-128,URI="key.bin"').encode(),
+     "/s0.ts": b"\x00" * 32},
+])
+def test_unsupported_streams_fall_back_to_ffmpeg(routes):
+    async def scenario(proxy, base):
+        with pytest.raises(HlsUnsupported):
+            await proxy.open(f"{base}/index.m3u8")
+        return proxy.stats()
+
+    stats = serve(routes, scenario)
+    assert stats["ffmpeg_fallbacks"] == 1 and stats["streams"] == 0
@@ -0,0 +1,166 @@
+import asyncio
+
+import pytest
+
+from job_queue import JobQueue, QueueFull, RateLimited, RateLimiter
+from shared_cache import MemoryCache, SQLiteCache
+
+
+def _queue(handler, **kwargs):
+    return JobQueue(handler, store=MemoryCache(ttl=3600, max_entries=1000), **kwargs)
+
+
+def test_priority_order_and_status():
+    order = []
+
+    async def handler(payload):
+        order.append(payload["n"])
+        await asyncio.sleep(0)
+        return payload["n"] != "bad"
+
+    async def main():
+        q = _queue(handler, concurrency=1)
+        jobs = [await q.submit(1, f"k{n}", {"n": n}, priority=p)
+                for n, p in (("slow", 1), ("fast", 0), ("bad", 1))]
+        q.start()
+        await q._queue.join()
+        statuses = [(await q.get(j["id"]))["status"] for j in jobs]
+        await q.stop()
+        return statuses, q
+
+    statuses, q = asyncio.run(main())
+    assert order == ["fast", "slow", "bad"]
+    assert statuses == ["done", "done", "failed"]
+    assert q.done == 2 and q.failed == 1
+
+
+def test_duplicate_submit_returns_active_job():
+    async def handler(payload):
+        return True
+
+    async def main():
+        q = _queue(handler)
+        first = await q.submit(1, "t", {})
+        second = await q.submit(1, "t", {})
+        other_user = await q.submit(2, "t", {})
+        await q.stop()
+        return first, second, other_user, q
+
+    first, second, other_user, q = asyncio.run(main())
+    assert first["id"] == second["id"] != other_user["id"]
+    assert q.deduplicated == 1
+
+
+def test_concurrent_duplicate_submits_share_one_job(tmp_path):
+    # Одновременные клики в двух воркерах на одном SQLite
+    store = SQLiteCache(tmp_path / "jobs.db", ttl=3600, table="jobs")
+
+    async def handler(payload):
+        await asyncio.sleep(10)   # задача активна, пока идут все клики
+        return True
+
+    async def main():
+        a = JobQueue(handler, store, rate_limit=100)
+        b = JobQueue(handler, store, rate_limit=100)
+        jobs = await asyncio.gather(*(q.submit(1, "t", {}) for q in (a, b) * 5))
+        await a.stop()
+        await b.stop()
+        return jobs, a, b
+
+    jobs, a, b = asyncio.run(main())
+    assert len({j["id"] for j in jobs}) == 1
+    assert a.submitted + b.submitted == 1
+    assert a.deduplicated + b.deduplicated == 9
+
+
+def test_stale_active_job_is_replaced_once():
+    async def handler(payload):
+        return True
+
+    async def main():
+        q = _queue(handler, stale_after=60)
+        stale = await q.submit(1, "t", {})
+        stale["created"] -= 120
+        await q._save(stale)   # задача воркера, упавшего час назад
+        jobs = await asyncio.gather(*(q.submit(1, "t", {}) for _ in range(5)))
+        await q.stop()
+        return stale, jobs
+
+    stale, jobs = asyncio.run(main())
+    ids = {j["id"] for j in jobs}
+    assert len(ids) == 1 and stale["id"] not in ids
+
+
+def test_queue_full():
+    async def handler(payload):
+        return True
+
+    async def main():
+        q = _queue(handler, concurrency=1, max_pending=1)
+        await q.submit(1, "a", {})
+        with pytest.raises(QueueFull):
+            await q.submit(1, "b", {})
+        await q.stop()
+
+    asyncio.run(main())
+
+
+def test_rate_limit_is_shared_between_queues(tmp_path):
+    # Две очереди на одном SQLite — как два uvicorn-воркера
+    store = SQLiteCache(tmp_path / "jobs.db", ttl=3600, table="jobs")
+
+    async def handler(payload):
+        return True
+
+    async def main():
+        a = JobQueue(handler, store, rate_limit=3, rate_window=3600)
+        b = JobQueue(handler, store, rate_limit=3, rate_window=3600)
+        await a.submit(1, "1", {})
+        await b.submit(1, "2", {})
+        await a.submit(1, "3", {})
+        with pytest.raises(RateLimited) as e:
+            await b.submit(1, "4", {})
+        await b.submit(2, "1", {})   # другой пользователь — свой лимит
+        await a.stop()
+        await b.stop()
+        return e.value
+
+    err = asyncio.run(main())
+    assert 0 < err.retry_after <= 3600
+
+
+def test_stop_fails_queued_and_running_jobs():
+    async def main():
+        running = asyncio.Event()
+
+        async def handler(payload):
+            running.set()
+            await asyncio.sleep(10)
+            return True
+
+        q = _queue(handler, concurrency=1)
+        first = await q.submit(1, "a", {})
+        queued = await q.submit(1, "b", {})
+        await running.wait()
+        await q.stop()
+        return q, await q.get(first["id"]), await q.get(queued["id"])
+
+    q, first, queued = asyncio.run(main())
+    for job in (first, queued):
+        assert job["status"] == "failed" and job["error"] == "shutdown"
+    # Активные ключи сняты: повторная отправка не дедуплицируется со старой
+    assert q.store.get("active:1:a") is None and q.store.get("active:1:b") is None
+
+
+def test_rate_limiter_window():
+    store = MemoryCache(ttl=3600)
+
+    async def main():
+        limiter = RateLimiter(store, limit=2, window=3600)
+        await limiter.check(1)
+        await limiter.check(1)
+        with pytest.raises(RateLimited):
+            await limiter.check(1)
+        return limiter
+
+    assert asyncio.run(main()).rejected == 1
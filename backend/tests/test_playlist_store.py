@@ -0,0 +1,127 @@
+import json
+import threading
+
+import pytest
+
+from playlist_store import LimitExceeded, PlaylistReadCache, PlaylistStore, VersionConflict
+
+
+def _t(tid):
+    return {"id": tid, "title": f"title {tid}", "artist": "a", "duration": 100, "cover_url": None}
+
+
+def _ids(store, user=1):
+    return [t["id"] for t in store.load(user)[0]]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PlaylistStore(tmp_path / "p.db")
+
+
+def test_add_remove_and_versions(store):
+    assert store.add(1, _t("a"), limit=10) == ("saved", 1, 2)
+    assert store.add(1, _t("a"), limit=10) == ("already_exists", 1, 2)
+    assert store.add(1, _t("b"), limit=10) == ("saved", 2, 3)
+    assert store.add(1, _t("c"), limit=2)[0] == "limit_reached"
+    assert store.remove(1, "a") == (1, 4)
+    # Удаление отсутствующего трека не меняет версию
+    assert store.remove(1, "zzz") == (1, 4)
+    assert _ids(store) == ["b"]
+
+
+def test_batch_version_conflict(store):
+    store.add_many(1, [_t("a"), _t("b")], limit=10)
+    version = store.version(1)
+    with pytest.raises(VersionConflict) as e:
+        store.remove_many(1, ["a"], if_version=version - 1)
+    assert e.value.current == version
+    assert _ids(store) == ["a", "b"]
+    removed, count, new_version = store.remove_many(1, ["a", "a", "x"], if_version=version)
+    assert (removed, count, new_version) == (1, 1, version + 1)
+
+
+def test_add_many_is_all_or_nothing(store):
+    store.add_many(1, [_t("a")], limit=3)
+    with pytest.raises(LimitExceeded):
+        store.add_many(1, [_t("b"), _t("c"), _t("d")], limit=3)
+    assert _ids(store) == ["a"]
+    added, count, _ = store.add_many(1, [_t("a"), _t("b"), _t("b")], limit=3)
+    assert (added, count) == (1, 2)
+
+
+@pytest.mark.parametrize("track, to_index, expected", [
+    ("a", 3, ["b", "c", "d", "a", "e"]),
+    ("e", 0, ["e", "a", "b", "c", "d"]),
+    ("c", 1, ["a", "c", "b", "d", "e"]),
+    ("b", 99, ["a", "c", "d", "e", "b"]),
+])
+def test_move_renumbers_with_gaps(store, track, to_index, expected):
+    store.add_many(1, [_t(x) for x in "axbycdze"], limit=20)
+    # Дыры в позициях после удаления: перенумерация префикса должна их пережить
+    store.remove_many(1, ["x", "y", "z"])
+    store.move(1, track, to_index)
+    assert _ids(store) == expected
+    # Последующая вставка встаёт в конец, порядок не ломается
+    store.add(1, _t("n"), limit=20)
+    assert _ids(store) == expected + ["n"]
+
+
+def test_move_to_same_place_keeps_version(store):
+    store.add_many(1, [_t("a"), _t("b")], limit=10)
+    version = store.version(1)
+    assert store.move(1, "b", 1) == (2, version)
+    with pytest.raises(KeyError):
+        store.move(1, "missing", 0)
+
+
+def test_reorder_and_replace(store):
+    store.add_many(1, [_t(x) for x in "abcd"], limit=10)
+    store.reorder(1, ["c", "zzz", "a", "c"])
+    assert _ids(store) == ["c", "a", "b", "d"]
+    store.replace(1, [_t("x"), _t("y"), _t("x")], limit=10)
+    assert _ids(store) == ["x", "y"]
+    with pytest.raises(LimitExceeded):
+        store.replace(1, [_t("p"), _t("q")], limit=1)
+
+
+def test_legacy_json_is_imported_on_first_access(tmp_path):
+    (tmp_path / "5.json").write_text(json.dumps([_t("a"), _t("a"), {"bad": 1}, _t("b")]))
+    store = PlaylistStore(tmp_path / "p.db", legacy_dir=tmp_path)
+    assert _ids(store, 5) == ["a", "b"]
+
+
+def test_concurrent_adds_from_two_connections(tmp_path):
+    # Два экземпляра на одном файле — как два uvicorn-воркера
+    first = PlaylistStore(tmp_path / "p.db")
+    second = PlaylistStore(tmp_path / "p.db")
+
+    def add(store, prefix):
+        for i in range(25):
+            store.add(1, _t(f"{prefix}{i}"), limit=100)
+
+    threads = [threading.Thread(target=add, args=(s, p)) for s, p in ((first, "a"), (second, "b"))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    tracks, version = first.load(1)
+    assert len(tracks) == 50 and version == 51
+
+
+def test_read_cache_sees_other_worker_writes(tmp_path):
+    mine = PlaylistReadCache(PlaylistStore(tmp_path / "p.db"))
+    other = PlaylistStore(tmp_path / "p.db")
+    mine.add(1, _t("a"), limit=10)
+    first = json.loads(mine.get_json(1))
+    assert [t["id"] for t in first["items"]] == ["a"]
+    assert json.loads(mine.get_json(1)) == first and mine.hits == 1
+    other.add(1, _t("b"), limit=10)
+    body = json.loads(mine.get_json(1))
+    assert [t["id"] for t in body["items"]] == ["a", "b"]
+    assert body["version"] == other.version(1)
+    # Запись этого воркера — write-through, без повторной загрузки
+    misses = mine.misses
+    mine.remove(1, "a")
+    assert [t["id"] for t in json.loads(mine.get_json(1))["items"]] == ["b"]
+    assert mine.misses == misses
@@ -0,0 +1,47 @@
+import asyncio
+
+from prefetch import Prefetcher
+
+
+def test_dedupe_concurrency_and_overflow():
+    running, peak, seen = [0], [0], []
+
+    async def warm(track_id):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        seen.append(track_id)
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+        return track_id != "cached"
+
+    async def main():
+        p = Prefetcher(warm, concurrency=2, max_pending=5)
+        added = p.schedule(["a", "b", "a", "cached", "c", "d", "e"])
+        # Пока a уже греется, повтор не ставится
+        again = p.schedule(["a"])
+        await asyncio.sleep(0.1)
+        return p, added, again
+
+    p, added, again = asyncio.run(main())
+    # Дубль пропущен, шестой трек не влез в очередь
+    assert added == 5 and again == 0
+    assert seen == ["a", "b", "cached", "c", "d"]
+    assert peak[0] == 2
+    assert p.stats()["warmed"] == 4 and p.skipped == 1 and p.dropped == 1
+
+
+def test_failed_warm_is_counted_and_does_not_block_queue():
+    async def warm(track_id):
+        if track_id == "bad":
+            raise RuntimeError("boom")
+        return True
+
+    async def main():
+        p = Prefetcher(warm, concurrency=1)
+        p.schedule(["bad", "ok"])
+        await asyncio.sleep(0.05)
+        return p
+
+    p = asyncio.run(main())
+    assert p.failed == 1 and p.warmed == 1
+    assert p.stats()["running"] == 0 and p.stats()["pending"] == 0
@@ -0,0 +1,78 @@
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from shared_cache import MemoryCache, SQLiteCache, TieredCache
+
+
+def test_sqlite_ttl_and_lru(tmp_path):
+    cache = SQLiteCache(tmp_path / "c.db", table="t", ttl=60, max_entries=3)
+    cache._EVICT_EVERY = 1   # вытеснение обычно раз в N записей
+    for i in range(5):
+        cache.set(f"k{i}", str(i))
+    assert cache.get("k0") is None and cache.get("k4") == "4"
+    cache.set("old", "v", created=1)
+    assert cache.get("old") is None
+
+
+def test_add_is_insert_if_absent(tmp_path):
+    cache = SQLiteCache(tmp_path / "c.db", table="t", ttl=60)
+    assert cache.add("k", "a")
+    assert not cache.add("k", "b")
+    assert cache.get("k") == "a"
+    cache.delete("k")
+    assert cache.add("k", "c")
+
+
+def test_add_raises_when_database_is_locked(tmp_path):
+    cache = SQLiteCache(tmp_path / "c.db", table="t", ttl=60)
+    cache._conn().execute("PRAGMA busy_timeout = 0")
+    other = sqlite3.connect(str(tmp_path / "c.db"), isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")   # соседний воркер держит запись
+    # «Не знаем» не должно выглядеть как «ключ уже есть»
+    with pytest.raises(sqlite3.OperationalError):
+        cache.add("k", "a")
+    other.execute("ROLLBACK")
+    assert cache.add("k", "a")
+
+
+def test_incr_is_atomic_across_connections(tmp_path):
+    # Каждый поток — своё соединение, как разные uvicorn-воркеры
+    cache = SQLiteCache(tmp_path / "c.db", table="t", ttl=60)
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda _: cache.incr("n"), range(200)))
+    assert cache.incr("n", 0) == 200
+
+
+def test_hit_counters_are_exact_under_threads(tmp_path):
+    memory = MemoryCache(ttl=60)
+    sqlite = SQLiteCache(tmp_path / "c.db", table="t", ttl=60)
+    for cache in (memory, sqlite):
+        cache.set("hit", "v")
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(lambda i: cache.get("hit" if i % 2 else "miss"), range(4000)))
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"]) == (2000, 2000)
+
+
+def test_memory_incr_and_add():
+    cache = MemoryCache(ttl=60)
+    assert cache.incr("n") == 1 and cache.incr("n", 2) == 3
+    assert cache.add("k", "a") and not cache.add("k", "b")
+
+
+def test_tiered_async_fills_l1_from_l2(tmp_path):
+    l2 = SQLiteCache(tmp_path / "c.db", table="t", ttl=60)
+    l2.set("k", "v")
+    tiered = TieredCache(MemoryCache(ttl=60), l2)
+
+    async def main():
+        value = await tiered.aget("k")
+        await tiered.aset("k2", "v2")
+        return value
+
+    assert asyncio.run(main()) == "v"
+    assert tiered.l1.get("k") == "v"
+    assert l2.get("k2") == "v2"
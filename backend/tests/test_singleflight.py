@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "url"
+
+    async def main():
+        sf = SingleFlight("t")
+        results = await asyncio.gather(*[sf.do("k", fetch) for _ in range(10)])
+        return sf, results
+
+    sf, results = asyncio.run(main())
+    assert results == ["url"] * 10
+    assert len(calls) == 1
+    assert sf.stats() == {"calls": 10, "executed": 1, "coalesced": 9, "inflight": 0}
+
+
+def test_error_reaches_all_waiters_and_key_is_released():
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("vk")
+
+    async def main():
+        sf = SingleFlight()
+        results = await asyncio.gather(*[sf.do("k", fail) for _ in range(3)], return_exceptions=True)
+        # После ошибки ключ свободен: следующий вызов выполняется заново
+        again = await sf.do("k", lambda: asyncio.sleep(0, "ok"))
+        return results, again
+
+    results, again = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert again == "ok"
+
+
+def test_cancelled_caller_does_not_cancel_others():
+    async def slow():
+        await asyncio.sleep(0.02)
+        return 42
+
+    async def main():
+        sf = SingleFlight()
+        first = asyncio.create_task(sf.do("k", slow))
+        second = asyncio.create_task(sf.do("k", slow))
+        await asyncio.sleep(0.005)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == 42
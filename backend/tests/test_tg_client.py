@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web
+
+from tg_client import FileForm, TelegramClient
+
+
+def test_sendaudio_retry_after_429_sends_full_file(tmp_path):
+    payload = bytes(range(256)) * 4096   # 1 МБ: не влезает в один чанк
+    path = tmp_path / "track.mp3"
+    path.write_bytes(payload)
+    received = []
+
+    async def send_audio(request):
+        fields = {}
+        reader = await request.multipart()
+        async for part in reader:
+            fields[part.name] = await part.read()
+        received.append(fields)
+        if len(received) == 1:
+            return web.json_response(
+                {"ok": False, "error_code": 429, "parameters": {"retry_after": 0}}
+            )
+        return web.json_response({"ok": True, "result": {"audio": {"file_id": "F"}}})
+
+    async def main():
+        app = web.Application(client_max_size=4 * 1024 * 1024)
+        app.router.add_post("/botT/sendAudio", send_audio)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        session = aiohttp.ClientSession()
+        try:
+            tg = TelegramClient("T", lambda: _const(session))
+            tg.api = f"http://127.0.0.1:{port}/botT"
+            with FileForm(path, "audio", "a.mp3", "audio/mpeg", chat_id=7, title="t") as form:
+                result = await tg.call("sendAudio", form=form, chat_id=7)
+            return result, tg
+        finally:
+            await session.close()
+            await runner.cleanup()
+
+    result, tg = asyncio.run(main())
+    assert result["ok"]
+    assert len(received) == 2
+    assert tg.throttled == 1
+    for fields in received:
+        assert fields["audio"] == payload
+        assert fields["chat_id"] == b"7"
+        assert fields["title"] == b"t"
+
+
+def test_long_poll_timeout_reaches_getupdates():
+    received = []
+
+    async def get_updates(request):
+        received.append(await request.json())
+        return web.json_response({"ok": True, "result": []})
+
+    async def main():
+        app = web.Application()
+        app.router.add_post("/botT/getUpdates", get_updates)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        session = aiohttp.ClientSession()
+        try:
+            tg = TelegramClient("T", lambda: _const(session))
+            tg.api = f"http://127.0.0.1:{port}/botT"
+            return await tg.call("getUpdates", offset=5, timeout=30, http_timeout=40)
+        finally:
+            await session.close()
+            await runner.cleanup()
+
+    assert asyncio.run(main())["ok"]
+    # timeout — параметр Telegram, http_timeout остаётся у клиента
+    assert received == [{"offset": 5, "timeout": 30}]
+
+
+def test_fileform_closes_everything(tmp_path):
+    path = tmp_path / "a.mp3"
+    path.write_bytes(b"x" * 10)
+    with FileForm(path, "audio", "a.mp3", "audio/mpeg") as form:
+        form()
+        form()
+        opened = list(form._opened)
+        assert form.size == 10
+    assert all(f.closed for f in opened)
+    assert form._fd is None
+
+
+async def _const(value):
+    return value
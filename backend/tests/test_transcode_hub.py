@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from transcode_hub import TranscodeHub
+
+
+class Sink:
+    def __init__(self):
+        self.data = b""
+        self.ok = None
+
+    def write(self, chunk):
+        self.data += chunk
+
+    async def finish(self, ok):
+        self.ok = ok
+
+
+def test_one_source_for_all_listeners():
+    runs = []
+    sink = Sink()
+
+    async def source():
+        runs.append(1)
+        for i in range(10):
+            await asyncio.sleep(0.005)
+            yield bytes([i]) * 10
+
+    async def main():
+        hub = TranscodeHub(max_buffer=1 << 20, idle_timeout=0.05)
+
+        async def listen(delay):
+            await asyncio.sleep(delay)
+            return b"".join([c async for c in hub.stream("t", source, lambda: sink)])
+
+        return await asyncio.gather(*[listen(i * 0.01) for i in range(4)])
+
+    results = asyncio.run(main())
+    assert len(runs) == 1
+    # Опоздавшие начинают с начала трека
+    assert all(r == results[0] and len(r) == 100 for r in results)
+    assert sink.ok and sink.data == results[0]
+
+
+def test_abandoned_stream_is_reaped():
+    sink = Sink()
+
+    async def source():
+        while True:
+            await asyncio.sleep(0.005)
+            yield b"x"
+
+    async def main():
+        hub = TranscodeHub(idle_timeout=0.02)
+        it = hub.stream("t", source, lambda: sink)
+        await it.__anext__()
+        await it.aclose()
+        await asyncio.sleep(0.1)
+        return hub
+
+    hub = asyncio.run(main())
+    assert not hub.active("t") and hub.reaped == 1
+    assert sink.ok is False
+
+
+def test_source_error_before_first_chunk_reaches_listeners():
+    class Busy(Exception):
+        pass
+
+    async def source():
+        raise Busy()
+        yield b""
+
+    async def main():
+        hub = TranscodeHub()
+        with pytest.raises(Busy):
+            async for _ in hub.stream("t", source):
+                pass
+        return hub
+
+    assert asyncio.run(main()).failed == 1
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from vk_batch import GetByIdBatcher
+
+
+def test_concurrent_gets_go_out_as_one_batch():
+    batches = []
+
+    async def fetch_many(ids):
+        batches.append(sorted(ids))
+        return {tid: {"id": tid} for tid in ids if tid != "1_gone"}
+
+    async def main():
+        b = GetByIdBatcher(fetch_many, window=0.01, max_batch=50)
+        ids = ["1_1", "1_2", "1_1", "1_gone"]
+        return b, await asyncio.gather(*[b.get(tid) for tid in ids])
+
+    b, results = asyncio.run(main())
+    assert batches == [["1_1", "1_2", "1_gone"]]
+    assert results == [{"id": "1_1"}, {"id": "1_2"}, {"id": "1_1"}, None]
+    assert b.stats()["requests"] == 4 and b.stats()["batches"] == 1
+
+
+def test_full_batch_flushes_without_waiting_for_window():
+    batches = []
+
+    async def fetch_many(ids):
+        batches.append(len(ids))
+        return {}
+
+    async def main():
+        b = GetByIdBatcher(fetch_many, window=10, max_batch=3)
+        await asyncio.wait_for(asyncio.gather(*[b.get(f"1_{i}") for i in range(3)]), 1)
+
+    asyncio.run(main())
+    assert batches == [3]
+
+
+def test_fetch_error_reaches_every_waiter():
+    async def fetch_many(ids):
+        raise RuntimeError("vk down")
+
+    async def main():
+        b = GetByIdBatcher(fetch_many, window=0.001)
+        return await asyncio.gather(b.get("1_1"), b.get("1_2"), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
@@ -0,0 +1,145 @@
+"""
+Проверка Telegram WebApp initData — общая для server_lite.py и app/.
+
+- секрет HMAC (HMAC_SHA256("WebAppData", bot_token)) считается один раз
+- дешёвые отказы до HMAC: нет hash / не 64 hex-символа / протухший auth_date
+- проверенные initData кешируются (sha256 → user) до истечения auth_date
+- compat: старые варианты строки проверки (без signature, только
+  user/auth_date/query_id, «\\/» в user, ключ sha256(token)). Включается
+  флагом, пробуется только после неудачи стандартной проверки
+- без print на каждую ошибку: только счётчики в stats()
+"""
+from __future__ import annotations
+import hashlib, hmac, json, time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+_HEX = frozenset("0123456789abcdefABCDEF")
+_CORE_FIELDS = ("auth_date", "query_id", "user")
+
+
+def webapp_secret(bot_token: str) -> bytes:
+    return hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+
+
+class InitDataValidator:
+    def __init__(
+        self,
+        bot_token: str,
+        max_age: float = 86400,
+        compat: bool = False,
+        cache_size: int = 10000,
+    ):
+        self.max_age = max_age
+        self.compat = compat
+        self.cache_size = cache_size
+        self._keys = [webapp_secret(bot_token)]
+        if compat:
+            self._keys.append(hashlib.sha256(bot_token.encode()).digest())
+        self._cache: "OrderedDict[bytes, Tuple[Dict, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.expired = 0
+        self.compat_matches = 0
+
+    # ─── API ─────────────────────────────────────────────────────
+
+    def validate(self, init_data: str) -> Optional[Dict]:
+        """user из initData или None. Повторная initData — из кеша."""
+        key = hashlib.sha256(init_data.encode()).digest()
+        entry = self._cache.get(key)
+        if entry is not None:
+            if time.time() < entry[1]:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            del self._cache[key]
+        self.misses += 1
+        result = self.verify(init_data)
+        if result is None:
+            return None
+        user, auth_date = result
+        if self.cache_size > 0:
+            self._cache[key] = (user, auth_date + self.max_age)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return user
+
+    def verify(self, init_data: str) -> Optional[Tuple[Dict, int]]:
+        """(user, auth_date) или None. Без кеша."""
+        try:
+            params = parse_qsl(init_data, keep_blank_values=True)
+        except ValueError:
+            self.rejected += 1
+            return None
+        fields = {}
+        for k, v in params:
+            fields.setdefault(k, v)
+        received = fields.pop("hash", "")
+        if len(received) != 64 or not _HEX.issuperset(received):
+            self.rejected += 1
+            return None
+        try:
+            auth_date = int(fields.get("auth_date", ""))
+        except ValueError:
+            self.rejected += 1
+            return None
+        # auth_date ещё не проверен подписью, но протухшую initData отвергнем
+        # в любом случае — значит, и HMAC для неё считать незачем
+        if time.time() - auth_date > self.max_age:
+            self.expired += 1
+            return None
+        user_raw = fields.get("user")
+        if not user_raw:
+            self.rejected += 1
+            return None
+
+        received = received.lower()
+        check = "\n".join(f"{k}={v}" for k, v in sorted(fields.items())).encode()
+        ok = hmac.compare_digest(
+            hmac.new(self._keys[0], check, hashlib.sha256).hexdigest(), received
+        )
+        if not ok and self.compat:
+            ok = any(
+                hmac.compare_digest(hmac.new(key, s, hashlib.sha256).hexdigest(), received)
+                for key in self._keys
+                for s in self._legacy_strings(fields)
+            )
+            if ok:
+                self.compat_matches += 1
+        if not ok:
+            self.rejected += 1
+            return None
+        try:
+            user = json.loads(user_raw)
+        except ValueError:
+            self.rejected += 1
+            return None
+        return user, auth_date
+
+    def _legacy_strings(self, fields: Dict[str, str]) -> List[bytes]:
+        variants = [
+            {k: v for k, v in fields.items() if k != "signature"},
+            {k: v for k, v in fields.items() if k in _CORE_FIELDS},
+        ]
+        out: List[bytes] = []
+        for f in variants:
+            if "\\/" in f.get("user", ""):
+                variants.append({**f, "user": f["user"].replace("\\/", "/")})
+            s = "\n".join(f"{k}={v}" for k, v in sorted(f.items())).encode()
+            if s not in out:
+                out.append(s)
+        return out
+
+    def stats(self) -> Dict:
+        return {
+            "compat": self.compat,
+            "cached": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "compat_matches": self.compat_matches,
+        }
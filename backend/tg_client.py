@@ -0,0 +1,220 @@
+"""
+Общий клиент Telegram Bot API для bot.py и server_lite.py.
+
+- token bucket: глобальный (~30 сообщений/с на бота) и на каждый чат (~1/с)
+- запросы ждут своей очереди в bucket, а не улетают пачкой
+- 429 → ждём parameters.retry_after и повторяем; 5xx/сеть → экспоненциальный backoff
+- FileForm: multipart с файлом, который можно отправить повторно
+- метрики: глубина очереди, число 429, суммарное ожидание
+"""
+from __future__ import annotations
+import asyncio, os, time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import aiohttp
+
+API_BASE = "https://api.telegram.org"
+
+# Методы без отправки сообщений не тратят токены bucket'ов
+_UNTHROTTLED = {"getUpdates", "getMe", "setWebhook", "deleteWebhook", "getWebhookInfo",
+                "setChatMenuButton", "setMyCommands", "answerCallbackQuery"}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0   # пауза после 429
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> float:
+        """Ждёт токен (FIFO через lock). Возвращает время ожидания в секундах."""
+        waited = 0.0
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    delay = self.blocked_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+                    delay = (1 - self.tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle(self) -> bool:
+        return (not self._lock.locked() and self.tokens >= self.capacity
+                and time.monotonic() >= self.blocked_until)
+
+
+SessionGetter = Callable[[], Awaitable[aiohttp.ClientSession]]
+FormFactory = Callable[[], aiohttp.FormData]
+
+
+class FileForm:
+    """
+    Фабрика FormData с файлом для call(form=...).
+
+    aiohttp закрывает файл после отправки тела, поэтому на каждую попытку
+    нужен свой файловый объект: берём dup() дескриптора, открытого в
+    __enter__ (файл не пропадёт, даже если кеш его вытеснит между попытками).
+
+        with FileForm(path, "audio", "a.mp3", "audio/mpeg", chat_id=1) as form:
+            await tg.call("sendAudio", form=form, chat_id=1)
+    """
+
+    def __init__(self, path, field: str, filename: str, content_type: str, **fields):
+        self.path = path
+        self.field = field
+        self.filename = filename
+        self.content_type = content_type
+        self.fields = fields
+        self._fd: Optional[int] = None
+        self._opened = []
+
+    def __enter__(self) -> "FileForm":
+        self._fd = os.open(self.path, os.O_RDONLY)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @property
+    def size(self) -> int:
+        return os.fstat(self._fd).st_size
+
+    def __call__(self) -> aiohttp.FormData:
+        f = os.fdopen(os.dup(self._fd), "rb")
+        f.seek(0)   # dup делит позицию с прошлыми попытками
+        self._opened.append(f)
+        form = aiohttp.FormData()
+        for name, value in self.fields.items():
+            form.add_field(name, str(value))
+        form.add_field(self.field, f, filename=self.filename, content_type=self.content_type)
+        return form
+
+    def close(self) -> None:
+        for f in self._opened:
+            f.close()
+        self._opened.clear()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class TelegramClient:
+    def __init__(
+        self,
+        token: str,
+        get_session: SessionGetter,
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        chat_burst: float = 3,
+        max_retries: int = 3,
+    ):
+        self.api = f"{API_BASE}/bot{token}"
+        self.get_session = get_session
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chat_buckets: Dict[Any, TokenBucket] = {}
+        self.waiting = 0        # запросов ждут bucket (глубина очереди)
+        self.requests = 0
+        self.throttled = 0      # ответов 429
+        self.retries = 0
+        self.failures = 0
+        self.wait_seconds = 0.0
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Простаивающие bucket'ы полные — их можно выбросить без потерь
+                for k in [k for k, b in self._chat_buckets.items() if b.idle()]:
+                    del self._chat_buckets[k]
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def call(
+        self,
+        method: str,
+        form: Optional[FormFactory] = None,
+        chat_id: Any = None,
+        http_timeout: Optional[float] = None,
+        **params,
+    ) -> Dict:
+        """
+        Вызов метода Bot API. params уходят JSON-ом (в том числе timeout
+        long poll у getUpdates); для загрузки файлов — form: фабрика FormData
+        (на повтор нужен новый объект). http_timeout — таймаут самого HTTP-запроса.
+        Ошибки не бросает: возвращает dict с ok=False, как сам Telegram.
+        """
+        chat_id = chat_id if chat_id is not None else params.get("chat_id")
+        throttled = method not in _UNTHROTTLED
+        attempt = 0
+        while True:
+            if throttled:
+                self.waiting += 1
+                try:
+                    waited = await self.global_bucket.acquire()
+                    if chat_id is not None:
+                        waited += await self._chat_bucket(chat_id).acquire()
+                finally:
+                    self.waiting -= 1
+                self.wait_seconds += waited
+
+            self.requests += 1
+            try:
+                session = await self.get_session()
+                kwargs: Dict[str, Any] = {"data": form()} if form else {"json": params}
+                if http_timeout is not None:
+                    kwargs["timeout"] = aiohttp.ClientTimeout(total=http_timeout)
+                async with session.post(f"{self.api}/{method}", **kwargs) as resp:
+                    data = await resp.json(content_type=None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                data = {"ok": False, "error_code": 0, "description": f"{type(e).__name__}: {e}"}
+
+            if data.get("ok"):
+                return data
+
+            code = data.get("error_code")
+            retryable = code == 429 or code == 0 or (isinstance(code, int) and code >= 500)
+            if not retryable or attempt >= self.max_retries:
+                self.failures += 1
+                print(f"⚠️  TG API {method}: {data.get('description', data)}")
+                return data
+
+            attempt += 1
+            self.retries += 1
+            if code == 429:
+                self.throttled += 1
+                retry_after = float((data.get("parameters") or {}).get("retry_after", 1))
+                # Лимит чата — ждёт только этот чат; без чата — весь бот
+                bucket = self._chat_bucket(chat_id) if chat_id is not None else self.global_bucket
+                bucket.block(retry_after)
+                if not throttled:
+                    await asyncio.sleep(retry_after)
+            else:
+                await asyncio.sleep(min(2 ** attempt, 10))
+
+    def stats(self) -> Dict:
+        return {
+            "queue_depth": self.waiting,
+            "requests": self.requests,
+            "throttled_429": self.throttled,
+            "retries": self.retries,
+            "failures": self.failures,
+            "wait_seconds": round(self.wait_seconds, 2),
+            "chat_buckets": len(self._chat_buckets),
+        }
@@ -0,0 +1,172 @@
+"""
+Один источник MP3 на трек — сколько угодно слушателей.
+
+- первый запрос трека запускает источник (HLS-прокси или ffmpeg) в фоновой
+  задаче, остальные подписываются на уже идущий поток
+- вывод копится в буфере (кольцо до max_buffer байт): опоздавший слушатель
+  начинает с начала трека, а не с середины
+- sink получает каждый чанк (tee в дисковый кеш) и finish(ok) в конце
+- источник упал, не выдав ни байта (например, Saturated из пула ffmpeg), —
+  слушатели получают это исключение, а не пустой поток
+- ушли все слушатели и никто не ждёт → через idle_timeout источник
+  останавливается, недописанный файл выбрасывается
+"""
+from __future__ import annotations
+import asyncio
+from typing import AsyncIterator, Callable, Dict, List, Optional, Protocol
+
+
+class Sink(Protocol):
+    def write(self, chunk: bytes) -> None: ...
+    async def finish(self, ok: bool) -> None: ...
+
+
+Source = Callable[[], AsyncIterator[bytes]]
+
+
+class Broadcast:
+    def __init__(self, key: str, max_buffer: int):
+        self.key = key
+        self.max_buffer = max_buffer
+        self.chunks: List[bytes] = []
+        self.base = 0           # абсолютный номер chunks[0] (голова кольца)
+        self.size = 0           # байт в буфере
+        self.total = 0          # байт выдано источником
+        self.listeners = 0
+        self.done = False
+        self.ok = False
+        self.error: Optional[BaseException] = None
+        self.task: Optional[asyncio.Task] = None
+        self._event = asyncio.Event()
+        self._finished = asyncio.Event()
+
+    def push(self, chunk: bytes) -> None:
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        self.total += len(chunk)
+        while self.size > self.max_buffer and len(self.chunks) > 1:
+            self.size -= len(self.chunks.pop(0))
+            self.base += 1
+        self._wake()
+
+    def finish(self, ok: bool) -> None:
+        self.done = True
+        self.ok = ok
+        self._finished.set()
+        self._wake()
+
+    def _wake(self) -> None:
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+
+class TranscodeHub:
+    def __init__(self, max_buffer: int = 32 * 1024 * 1024, idle_timeout: float = 15):
+        self.max_buffer = max_buffer
+        self.idle_timeout = idle_timeout
+        self._active: Dict[str, Broadcast] = {}
+        self.started = 0
+        self.joined = 0
+        self.reaped = 0
+        self.failed = 0
+
+    # ─── API ─────────────────────────────────────────────────────
+
+    def stream(self, key: str, source: Optional[Source], sink: Optional[Callable[[], Optional[Sink]]] = None) -> AsyncIterator[bytes]:
+        """Итератор MP3-чанков трека с начала. source/sink нужны, только если потока ещё нет."""
+        b = self._active.get(key)
+        if b is None:
+            b = self._start(key, source, sink() if sink else None)
+        else:
+            self.joined += 1
+        b.listeners += 1
+        return self._listen(b)
+
+    def active(self, key: str) -> bool:
+        return key in self._active
+
+    async def wait(self, key: str) -> Optional[bool]:
+        """Дождаться конца идущего потока: ok, или None — если потока нет."""
+        b = self._active.get(key)
+        if b is None:
+            return None
+        b.listeners += 1   # ожидающий тоже держит источник живым
+        try:
+            await b._finished.wait()
+        finally:
+            self._leave(b)
+        return b.ok
+
+    # ─── Внутреннее ──────────────────────────────────────────────
+
+    def _start(self, key: str, source: Source, sink: Optional[Sink]) -> Broadcast:
+        b = Broadcast(key, self.max_buffer)
+        self._active[key] = b
+        self.started += 1
+        b.task = asyncio.ensure_future(self._produce(b, source, sink))
+        return b
+
+    async def _produce(self, b: Broadcast, source: Source, sink: Optional[Sink]) -> None:
+        ok = False
+        try:
+            async for chunk in source():
+                b.push(chunk)
+                if sink:
+                    sink.write(chunk)
+            ok = b.total > 0
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            b.error = e
+            print(f"⚠️ transcode {b.key} failed: {type(e).__name__}: {e}")
+        finally:
+            if not ok:
+                self.failed += 1
+            if self._active.get(b.key) is b:
+                del self._active[b.key]
+            b.finish(ok)
+            if sink:
+                try:
+                    await sink.finish(ok)
+                except Exception as e:
+                    print(f"⚠️ transcode {b.key} sink error: {e}")
+
+    async def _listen(self, b: Broadcast) -> AsyncIterator[bytes]:
+        pos = b.base
+        try:
+            while True:
+                if pos < b.base:
+                    pos = b.base   # голову кольца уже вытеснили
+                idx = pos - b.base
+                if idx < len(b.chunks):
+                    pos += 1
+                    yield b.chunks[idx]
+                    continue
+                if b.done:
+                    if b.total == 0 and b.error is not None:
+                        raise b.error
+                    return
+                await b._event.wait()
+        finally:
+            self._leave(b)
+
+    def _leave(self, b: Broadcast) -> None:
+        b.listeners -= 1
+        if b.listeners == 0 and not b.done:
+            asyncio.get_running_loop().call_later(self.idle_timeout, self._reap, b)
+
+    def _reap(self, b: Broadcast) -> None:
+        if b.listeners == 0 and not b.done and b.task:
+            self.reaped += 1
+            b.task.cancel()
+
+    def stats(self) -> Dict:
+        return {
+            "active": len(self._active),
+            "listeners": sum(b.listeners for b in self._active.values()),
+            "buffered_bytes": sum(b.size for b in self._active.values()),
+            "started": self.started,
+            "joined": self.joined,
+            "reaped": self.reaped,
+            "failed": self.failed,
+        }
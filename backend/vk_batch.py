@@ -0,0 +1,71 @@
+"""
+Микро-батчинг audio.getById.
+
+VK принимает в audio.getById список id через запятую. Вместо одного
+HTTP-запроса на трек копим id в течение короткого окна (несколько мс)
+или до max_batch штук, делаем один вызов и раздаём результаты ждущим.
+"""
+from __future__ import annotations
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional
+
+FetchMany = Callable[[List[str]], Awaitable[Dict[str, Dict]]]
+
+
+class GetByIdBatcher:
+    def __init__(self, fetch_many: FetchMany, window: float = 0.005, max_batch: int = 50):
+        self.fetch_many = fetch_many
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.requests = 0   # вызовов get()
+        self.batches = 0    # HTTP-запросов в VK
+        self.ids = 0        # id отправлено в VK
+
+    async def get(self, track_id: str) -> Optional[Dict]:
+        """Item из audio.getById или None, если трек недоступен."""
+        self.requests += 1
+        fut = self._pending.get(track_id)
+        if fut is None:
+            loop = asyncio.get_running_loop()
+            fut = loop.create_future()
+            self._pending[track_id] = fut
+            if len(self._pending) >= self.max_batch:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._flush)
+        return await asyncio.shield(fut)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: Dict[str, asyncio.Future]) -> None:
+        self.batches += 1
+        self.ids += len(batch)
+        try:
+            items = await self.fetch_many(list(batch))
+        except Exception as e:
+            for fut in batch.values():
+                if not fut.done():
+                    fut.set_exception(e)
+                    fut.exception()  # не шумим, если ждущие уже ушли
+            return
+        for track_id, fut in batch.items():
+            if not fut.done():
+                fut.set_result(items.get(track_id))
+
+    def stats(self) -> Dict:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "ids": self.ids,
+            "avg_batch": round(self.ids / self.batches, 2) if self.batches else 0.0,
+            "pending": len(self._pending),
+        }
@@ -14,7 +14,10 @@ import {
   addToPlaylist,
   fetchPlaylist,
   getCachedAudioUrl,
+  getDownloadUrl,
+  isDownloadUrl,
   loginTelegram,
+  prefetchNext,
   preloadBatchUrls,
   preloadTrackUrl,
   removeFromPlaylist,
@@ -28,6 +31,15 @@ import type { Track } from "./types";
 type TgUser = { id: number; first_name: string; username?: string } | null;
 const MAX_VISIBLE = 20;
 
+/** Позиция t внутри диапазонов, куда браузер может перемотать сам. */
+const isSeekable = (audio: HTMLAudioElement, t: number) => {
+  if (t < 0) return false;
+  for (let i = 0; i < audio.seekable.length; i++) {
+    if (audio.seekable.start(i) <= t && t <= audio.seekable.end(i)) return true;
+  }
+  return false;
+};
+
 const App = () => {
   useTelegramTheme();
   const audioRef = useRef<HTMLAudioElement>(null);
@@ -53,6 +65,8 @@ const App = () => {
   const bufferingRef = useRef(false);       // true = загрузка/смена трека
   const userPausedRef = useRef(false);      // true = пользователь нажал паузу
   const seekingRef = useRef(false);         // true = пользователь тянет ползунок
+  const offsetRef = useRef(0);              // с какой секунды начат текущий src (?t=)
+  const audioUrlRef = useRef<string | null>(null);
   const handleNextRef = useRef<() => void>(() => {});
 
   const debouncedQuery = useDebouncedValue(query, 300);
@@ -112,6 +126,7 @@ const App = () => {
     setIsBuffering(true);
     setCurrentTime(0);
     setDuration(track.duration && track.duration > 0 ? track.duration : 0);
+    offsetRef.current = 0;
 
     // Сразу обновляем системный пуш (без ожидания React effect)
     if ("mediaSession" in navigator) {
@@ -155,6 +170,7 @@ const App = () => {
     const prevIdx = (currentIndex - 1 + queue.length) % queue.length;
     preloadTrackUrl(queue[nextIdx].id);
     if (prevIdx !== nextIdx) preloadTrackUrl(queue[prevIdx].id);
+    prefetchNext(queue[currentIndex].id);
   }, [queue, currentIndex]);
 
   const togglePlay = useCallback(() => {
@@ -175,11 +191,23 @@ const App = () => {
     if (!audio) return;
     seekingRef.current = true;
     setCurrentTime(value);
-    audio.currentTime = value;
+    const local = value - offsetRef.current;
+    if (currentTrack && isDownloadUrl(audioUrlRef.current) && !isSeekable(audio, local)) {
+      // Поток прокси без Range (трек ещё не в кеше сервера): перематывать
+      // некуда — запрашиваем поток заново с позиции value, сдвиг помним
+      // для таймера и ползунка
+      offsetRef.current = value;
+      bufferingRef.current = true;
+      setIsBuffering(true);
+      setAudioUrl(getDownloadUrl(currentTrack.id, value));
+      seekingRef.current = false;
+      return;
+    }
+    audio.currentTime = Math.max(0, local);
     const unlock = () => { seekingRef.current = false; };
     audio.addEventListener("seeked", unlock, { once: true });
     setTimeout(unlock, 500);
-  }, []);
+  }, [currentTrack]);
 
   // ─── Playlist actions ────────────────────────────────────────────
   const handleRemove = useCallback(async (track: Track) => {
@@ -222,6 +250,7 @@ const App = () => {
     bufferingRef.current = false;
     userPausedRef.current = false;
     setCurrentTrack(null); setAudioUrl(null);
+    offsetRef.current = 0;
     setIsPlaying(false); setIsBuffering(false);
     setCurrentTime(0); setDuration(0); setIsPlayerOpen(false);
   }, []);
@@ -234,10 +263,12 @@ const App = () => {
     const onTimeUpdate = () => {
       // Не обновляем таймер во время буферизации/смены трека/seek
       if (bufferingRef.current || seekingRef.current) return;
-      setCurrentTime(audio.currentTime);
+      setCurrentTime(offsetRef.current + audio.currentTime);
     };
 
     const onDurationChange = () => {
+      // Поток с ?t= — это хвост трека, его длительность не общая
+      if (offsetRef.current > 0) return;
       const ad = audio.duration;
       if (!ad || !Number.isFinite(ad) || ad <= 0) return;
       setDuration((prev) => {
@@ -325,6 +356,8 @@ const App = () => {
     toast.error(msg);
   }, []);
 
+  useEffect(() => { audioUrlRef.current = audioUrl; }, [audioUrl]);
+
   useHlsAudio(audioRef, audioUrl, onAudioReady, onAudioError);
 
   useMediaSession(currentTrack, isPlaying, togglePlay, handleNext, handlePrev, handleSeek, duration, currentTime);
@@ -159,9 +159,26 @@ export const preloadBatchUrls = (trackIds: string[]) => {
   }
 };
 
-/** Fallback URL через прокси (для обратной совместимости) */
-export const getDownloadUrl = (id: string) =>
-  `${API_BASE}/api/music/download/${encodeURIComponent(id)}`;
+/**
+ * Просим бэкенд прогреть вероятные следующие треки (следующие в плейлисте,
+ * соседи по исполнителю) — fire & forget.
+ */
+export const prefetchNext = (trackId: string) => {
+  fetch(`${API_BASE}/api/music/prefetch/${encodeURIComponent(trackId)}`, {
+    method: "POST",
+    headers: authHeaders(),
+  }).catch(() => {});
+};
+
+/**
+ * Fallback URL через прокси (для обратной совместимости).
+ * t — старт с позиции t секунд: seek в потоке без Range (трек не в кеше).
+ */
+export const getDownloadUrl = (id: string, t = 0) =>
+  `${API_BASE}/api/music/download/${encodeURIComponent(id)}` + (t > 0 ? `?t=${Math.floor(t)}` : "");
+
+/** URL — поток через прокси /api/music/download (а не прямой VK CDN). */
+export const isDownloadUrl = (url: string | null) => !!url && url.includes("/api/music/download/");
 
 // ─── Auth ───────────────────────────────────────────────────────
 
@@ -227,7 +244,16 @@ export const removeFromPlaylist = async (trackId: string): Promise<boolean> => {
 
 // ─── Send to Telegram bot ───────────────────────────────────────
 
+const _SEND_POLL_MS = 1000;
+const _SEND_TIMEOUT = 2 * 60_000; // очередь может быть длинной
+
+/**
+ * Ставит отправку в очередь и ждёт результата: POST возвращает job_id,
+ * дальше опрашиваем статус, пока задача не станет done или failed.
+ */
 export const sendToBot = async (trackId: string): Promise<boolean> => {
+  let jobId: string;
+  let status: SendJobStatus | null;
   try {
     const resp = await fetchWithTimeout(
       `${API_BASE}/api/send-to-bot/${encodeURIComponent(trackId)}`,
@@ -236,8 +262,36 @@ export const sendToBot = async (trackId: string): Promise<boolean> => {
         headers: authHeaders(),
         body: "{}",
       },
-      60000,
+      15000,
     );
-    return resp.ok;
+    if (!resp.ok) return false;
+    const data = await resp.json();
+    jobId = data.job_id;
+    status = (data.status as SendJobStatus) ?? null;
   } catch { return false; }
+  if (!jobId) return false;
+
+  const deadline = Date.now() + _SEND_TIMEOUT;
+  while (status !== "done" && status !== "failed") {
+    if (Date.now() > deadline) return false;
+    await new Promise((r) => setTimeout(r, _SEND_POLL_MS));
+    // null — сетевая ошибка или 5xx: пробуем ещё раз до дедлайна
+    status = (await fetchSendJobStatus(jobId)) ?? status;
+  }
+  return status === "done";
+};
+
+export type SendJobStatus = "queued" | "running" | "done" | "failed";
+
+/** Статус задачи send-to-bot (job_id из ответа POST /api/send-to-bot). */
+export const fetchSendJobStatus = async (jobId: string): Promise<SendJobStatus | null> => {
+  try {
+    const resp = await fetchWithTimeout(
+      `${API_BASE}/api/send-to-bot/jobs/${encodeURIComponent(jobId)}`,
+      { headers: authHeaders() }, 8000,
+    );
+    if (!resp.ok) return null;
+    const data = await resp.json();
+    return (data.status as SendJobStatus) ?? null;
+  } catch { return null; }
 };